@@ -2,10 +2,18 @@
 """
 FlavorGraph Demo - Food Pairing Recommendations
 """
-import pickle
+import sys
+from pathlib import Path
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "src"))
+from embedding_store import load_embedding
+from registry import Registry
+from similarity import SimilarityIndex
+from ann import load_ann
+from knn_table import KNNTable
+from name_resolver import NameResolver, load_aliases, ALIASES
 
 # Load the graph data to get ingredient names
 print("Loading FlavorGraph data...")
@@ -28,12 +36,14 @@ for _, row in nodes_df.iterrows():
     }
     name_to_id[name] = node_id
 
-# Load the embeddings
-embedding_file = "./output/FlavorGraph+CSL-embedding_M11-metapath_300-dim_0.0025-initial_lr_3-window_size_2-iterations_5-min_count-_False-isCSP_0.0001-CSPcoef.pickle"
+# Exact or alias name lookups, e.g. "Lemon Juice" or "jeera"; fuzzy matches are only offered as suggestions
+resolver = NameResolver({node_id: info['name'] for node_id, info in id_to_name.items()}, load_aliases(ALIASES))
+
+# Load the embeddings (latest registered run, or a registry tag/id given on the command line)
+embedding_file = Registry("./output/").resolve(sys.argv[1] if len(sys.argv) > 1 else "latest")
 
 print("Loading FlavorGraph embeddings...")
-with open(embedding_file, "rb") as f:
-    embeddings = pickle.load(f)
+embeddings = load_embedding(embedding_file)
 
 print(f"Loaded embeddings for {len(embeddings)} nodes")
 print(f"Embedding dimension: {len(next(iter(embeddings.values())))}")
@@ -57,29 +67,47 @@ for i, (node_id, name, is_hub) in enumerate(ingredients[:10]):
     hub_status = "Hub" if is_hub == "hub" else "Regular"
     print(f"{i+1:2d}. {name:<30} ({hub_status})")
 
+# Normalized matrix with type / hub masks: every query is one matrix product
+index = SimilarityIndex(embeddings, {node_id: (info['name'], info['type'], info['is_hub']) for node_id, info in id_to_name.items()})
+
+# Approximate index, if one was built for these embeddings (python3 src/ann.py --emb <artifact>)
+try:
+    ann = load_ann(embedding_file)
+    print(f"Using IVF index with {len(ann.centroids)} lists")
+except FileNotFoundError:
+    ann = None
+
+# Precomputed neighbour table, if one was built (python3 src/knn_table.py --emb <artifact>)
+try:
+    knn = KNNTable.load(embedding_file)
+    print(f"Using precomputed top-{knn.k} neighbour table")
+except FileNotFoundError:
+    knn = None
+
 def find_similar_ingredients(target_name, top_k=5):
     """Find ingredients most similar to the target ingredient"""
-    if target_name not in name_to_id:
-        print(f"Ingredient '{target_name}' not found")
+    found = resolver.lookup(target_name)
+    if found is None:
+        # no silent substitution: the neighbours of a similar-sounding ingredient are not an answer
+        suggestions = ", ".join(name for _, name, _ in resolver.matches(target_name, k=3))
+        print(f"Ingredient '{target_name}' not found" + (f" (did you mean: {suggestions}?)" if suggestions else ""))
         return []
-    
-    target_id = name_to_id[target_name]
+    target_id, target_graph_name = found
+    if target_graph_name != target_name:
+        print(f"  ('{target_name}' is the graph node '{target_graph_name}')")
+
     if target_id not in embeddings:
         print(f"No embedding found for '{target_name}'")
         return []
     
-    target_vector = embeddings[target_id].reshape(1, -1)
-    similarities = []
-    
-    for node_id, embedding in embeddings.items():
-        if node_id != target_id and node_id in id_to_name:
-            info = id_to_name[node_id]
-            if info['type'] == 'ingredient':  # Only compare with other ingredients
-                sim = cosine_similarity(target_vector, embedding.reshape(1, -1))[0][0]
-                similarities.append((info['name'], sim, info['is_hub']))
-    
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
+    if knn is not None and target_id in knn and top_k <= knn.k:
+        similar = [(node_id, id_to_name[node_id]['name'], sim) for node_id, sim in knn.neighbours(target_id, top_k)]
+    elif ann is not None:
+        rows, scores = ann.search(embeddings[target_id], k=top_k, allowed=index.mask(types=['ingredient'], exclude=[target_id]))
+        similar = [(ann.ids[r], id_to_name[ann.ids[r]]['name'], float(sim)) for r, sim in zip(rows[0], scores[0]) if r >= 0]
+    else:
+        similar = index.most_similar([target_id], k=top_k, types=['ingredient'])[0]
+    return [(name, sim, id_to_name[node_id]['is_hub']) for node_id, name, sim in similar]
 
 # Test with actual ingredients from the dataset
 test_ingredients = [name for _, name, _ in ingredients[:5]]
@@ -98,6 +126,17 @@ for ingredient_name in test_ingredients:
     else:
         print("  No similar ingredients found")
 
+# Combined queries: closest to the sum of some ingredients minus others
+positive = [resolver.resolve(name) for name in ['lemon', 'ginger']]
+positive = [(node_id, name) for node_id, name in positive if node_id in embeddings]
+negative = [resolver.resolve(name) for name in ['sugar']]
+negative = [(node_id, name) for node_id, name in negative if node_id in embeddings]
+if positive:
+    print(f"\nIngredients closest to {' + '.join(n for _, n in positive)}{''.join(' - ' + n for _, n in negative)}:")
+    combined = index.combine([i for i, _ in positive], negative=[i for i, _ in negative], k=5, types=['ingredient'])
+    for i, (node_id, name, sim) in enumerate(combined, 1):
+        print(f"  {i}. {name:<35} (similarity: {sim:.3f})")
+
 # Summary statistics
 ingredient_count = sum(1 for node_id in embeddings.keys() 
                       if node_id in id_to_name and id_to_name[node_id]['type'] == 'ingredient')
@@ -112,7 +151,7 @@ print(f"🧪 Chemical compounds: {compound_count}")
 print(f"📐 Embedding dimension: {len(next(iter(embeddings.values())))}")
 print(f"🔄 Training iterations: 2")
 print(f"🎯 Metapaths used: CHC + CHNHC + NHCHN")
-print(f"💾 Output file: FlavorGraph+CSL-embedding_*.pickle")
+print(f"💾 Output file: {embedding_file}")
 print(f"{'='*70}")
 print("✨ FlavorGraph successfully trained and ready for food pairing recommendations!")
 
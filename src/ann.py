@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from texttable import Texttable
+
+from embedding_store import load_embedding, artifact_stem
+from quantize import normalize_rows, PQCodes, recall_at_k
+from clustering import kmeans_single
+from registry import Registry
+
+"""
+Approximate nearest-neighbour search over an embedding artifact: an inverted file (IVF) index.
+Normalized rows are assigned to the nearest of `nlist` spherical k-means centroids and stored list by
+list, so a query only scans the `nprobe` lists whose centroids are closest to it. Rows are kept as
+float32, or as PQ codes of their residual to the centroid (q . x = q . c + q . r, and the q . r lookup
+table does not depend on the list). All arrays are .npy files opened with mmap:
+    <stem>_ivf.json                     settings and the recall report
+    <stem>_ivf_centroids.npy            nlist x d
+    <stem>_ivf_offsets.npy              nlist + 1, list l holds positions offsets[l]:offsets[l+1]
+    <stem>_ivf_order.npy                artifact row of every position
+    <stem>_ivf_vectors.npy              normalized rows by position (without PQ)
+    <stem>_ivf_pq_codes.npy / _codebooks.npy   residual PQ codes by position (with PQ)
+
+    python3 src/ann.py --emb latest --nlist 0 --pq_m 0
+"""
+BLOCK_ROWS = 65536
+
+
+def ivf_prefix(path):
+    return artifact_stem(path) + '_ivf'
+
+
+class IVFIndex(object):
+    def __init__(self, ids, centroids, offsets, order, vectors=None, pq=None, nprobe=8):
+        self.ids = list(ids)
+        self.centroids = centroids
+        self.offsets = offsets
+        self.order = order
+        self.vectors = vectors
+        self.pq = pq
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, ids, matrix, nlist=0, pq_m=0, train_size=None, seed=0):
+        """
+        :param nlist: Number of lists (0: about 4 sqrt(N)).
+        :param pq_m: PQ subspaces for the residuals (0: keep float32 rows).
+        :param train_size: Rows sampled to train the centroids and codebooks (default 256 per list).
+        """
+        n = len(matrix)
+        nlist = min(nlist or int(4 * np.sqrt(n)), n)
+        rng = np.random.default_rng(seed)
+        train_size = min(n, train_size or 256 * nlist)
+        sample = normalize_rows(matrix[np.sort(rng.choice(n, train_size, replace=False))])
+        _, _, centroids = kmeans_single(sample.astype(np.float64), nlist, seed, max_iter=25)
+        centroids = centroids.astype(np.float32)
+
+        assignment = np.empty(n, dtype=np.int64)
+        for start in range(0, n, BLOCK_ROWS):
+            block = normalize_rows(matrix[start:start + BLOCK_ROWS])
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+
+        vectors, pq = None, None
+        if pq_m:
+            sample_rows = rng.choice(n, train_size, replace=False)
+            residuals = normalize_rows(matrix[sample_rows]) - centroids[assignment[sample_rows]]
+            pq = PQCodes.fit(residuals, pq_m, seed=seed, normalize=False)
+            codes = np.empty((n, pq_m), dtype=np.uint8)
+            for start in range(0, n, BLOCK_ROWS):
+                rows = order[start:start + BLOCK_ROWS]
+                codes[start:start + len(rows)] = pq.encode(normalize_rows(matrix[rows]) - centroids[assignment[rows]])
+            pq = PQCodes(codes, pq.codebooks)
+        else:
+            vectors = normalize_rows(matrix[order])
+        return cls(ids, centroids, offsets, order, vectors=vectors, pq=pq)
+
+    def list_scores(self, query, lut, positions, lists):
+        if self.pq is None:
+            return np.asarray(self.vectors[positions]) @ query
+        codes = np.asarray(self.pq.codes[positions], dtype=np.intp)
+        scores = np.repeat(query @ self.centroids[lists].T, np.diff(self.offsets)[lists])
+        for sub in range(codes.shape[1]):
+            scores += lut[sub, codes[:, sub]]
+        return scores
+
+    def search(self, queries, k=10, nprobe=None, allowed=None):
+        """
+        Approximate top-k artifact rows for every query vector.
+        :param allowed: Optional boolean mask over the artifact rows (e.g. one node type).
+        :return (q, k) rows and cosine scores, best first; -1 / -inf where fewer than k were found.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        coarse = queries @ self.centroids.T
+        probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+        luts = self.pq.lookup_table(queries) if self.pq is not None else [None] * len(queries)
+
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, (query, lists, lut) in enumerate(zip(queries, probes, luts)):
+            lists = lists[self.offsets[lists + 1] > self.offsets[lists]]
+            if len(lists) == 0:
+                continue
+            positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            candidate_rows = np.asarray(self.order[positions])
+            candidate_scores = self.list_scores(query, lut, positions, lists)
+            if allowed is not None:
+                keep = allowed[candidate_rows]
+                candidate_rows, candidate_scores = candidate_rows[keep], candidate_scores[keep]
+            found = min(k, len(candidate_rows))
+            if found == 0:
+                continue
+            top = np.argpartition(-candidate_scores, found - 1)[:found]
+            top = top[np.argsort(-candidate_scores[top], kind="stable")]
+            rows[i, :found] = candidate_rows[top]
+            scores[i, :found] = candidate_scores[top]
+        return rows, scores
+
+    def nbytes(self):
+        stored = self.pq.nbytes() if self.pq is not None else self.vectors.nbytes
+        return int(stored + self.centroids.nbytes + self.offsets.nbytes + self.order.nbytes)
+
+    def save(self, prefix, report=None):
+        np.save(prefix + '_centroids.npy', self.centroids)
+        np.save(prefix + '_offsets.npy', self.offsets)
+        np.save(prefix + '_order.npy', self.order)
+        if self.pq is not None:
+            np.save(prefix + '_pq_codes.npy', self.pq.codes)
+            np.save(prefix + '_pq_codebooks.npy', self.pq.codebooks)
+        else:
+            np.save(prefix + '_vectors.npy', self.vectors)
+        meta = {"nlist": len(self.centroids), "pq_m": 0 if self.pq is None else int(self.pq.codes.shape[1]),
+                "nprobe": self.nprobe, "ids": self.ids, "report": report}
+        # written last: its presence means the index is complete
+        tmp = "{}.json.tmp-{}".format(prefix, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, prefix + '.json')
+        return prefix + '.json'
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        if not os.path.exists(prefix + '.json'):
+            raise FileNotFoundError("No IVF index at {}".format(prefix))
+        with open(prefix + '.json') as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        vectors, pq = None, None
+        if meta["pq_m"]:
+            pq = PQCodes(np.load(prefix + '_pq_codes.npy', mmap_mode=mmap_mode), np.load(prefix + '_pq_codebooks.npy'))
+        else:
+            vectors = np.load(prefix + '_vectors.npy', mmap_mode=mmap_mode)
+        return cls(meta["ids"], np.load(prefix + '_centroids.npy'), np.load(prefix + '_offsets.npy'),
+                   np.load(prefix + '_order.npy', mmap_mode=mmap_mode), vectors=vectors, pq=pq, nprobe=meta["nprobe"])
+
+
+def load_ann(path, mmap=True):
+    """IVF index built for an embedding artifact."""
+    return IVFIndex.load(ivf_prefix(path), mmap=mmap)
+
+
+def recall_report(index, matrix, k=10, num_queries=500, nprobes=(1, 2, 4, 8, 16, 32), seed=0):
+    """recall@k against exact search and query latency for several nprobe values, self matches included."""
+    rng = np.random.default_rng(seed)
+    queries = normalize_rows(matrix[np.sort(rng.choice(len(matrix), min(num_queries, len(matrix)), replace=False))])
+    exact = np.empty((len(queries), len(matrix)), dtype=np.float32)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        exact[:, start:start + BLOCK_ROWS] = queries @ normalize_rows(matrix[start:start + BLOCK_ROWS]).T
+    k = min(k, len(matrix))
+    top_exact = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+
+    report = []
+    for nprobe in nprobes:
+        if nprobe > len(index.centroids):
+            break
+        start = time.time()
+        rows, _ = index.search(queries, k, nprobe=nprobe)
+        elapsed = time.time() - start
+        hits = [len(np.intersect1d(a, b[b >= 0])) for a, b in zip(top_exact, rows)]
+        report.append({"nprobe": nprobe, "recall@{}".format(k): float(np.mean(hits)) / k,
+                       "query_ms": 1000.0 * elapsed / len(queries)})
+    return report
+
+
+def build_ann(path, nlist=0, pq_m=0, nprobe=8, k=10, seed=0):
+    """Build, evaluate and save the IVF index of an embedding artifact; returns the index json path."""
+    print("\nBuilding IVF index...", path)
+    table = load_embedding(path)
+    start = time.time()
+    index = IVFIndex.build(table.ids, table.matrix, nlist=nlist, pq_m=pq_m, seed=seed)
+    print("Built {} lists in {:.1f}s".format(len(index.centroids), time.time() - start))
+    report = recall_report(index, table.matrix, k=k, seed=seed)
+
+    # default nprobe: the smallest one reaching 95% recall, unless given
+    reached = [r["nprobe"] for r in report if r["recall@{}".format(k)] >= 0.95]
+    index.nprobe = nprobe or (reached[0] if reached else report[-1]["nprobe"])
+    t = Texttable()
+    t.add_rows([["nprobe", "Recall@{}".format(k), "ms / query"]] +
+               [[r["nprobe"], "%.3f" % r["recall@{}".format(k)], "%.3f" % r["query_ms"]] for r in report])
+    print(t.draw())
+    print("Index bytes: {} (float32 matrix: {}), default nprobe {}".format(index.nbytes(), table.matrix.shape[0] * table.matrix.shape[1] * 4, index.nprobe))
+    return index.save(ivf_prefix(path), report=report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an IVF approximate nearest-neighbour index for an embedding artifact")
+    parser.add_argument('--emb', default="latest", type=str, help="registry id/tag or artifact path")
+    parser.add_argument('--output_path', default="./output/", type=str, help="registry root")
+    parser.add_argument('--nlist', default=0, type=int, help="number of lists (0: about 4 sqrt(N))")
+    parser.add_argument('--pq_m', default=0, type=int, help="PQ subspaces for the residuals (0: float32 rows)")
+    parser.add_argument('--nprobe', default=0, type=int, help="default lists scanned per query (0: smallest reaching 95%% recall)")
+    parser.add_argument('--k', default=10, type=int, help="k for the recall@k report")
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    registry = Registry(args.output_path)
+    path = registry.resolve(args.emb)
+    meta = build_ann(path, nlist=args.nlist, pq_m=args.pq_m, nprobe=args.nprobe, k=args.k, seed=args.seed)
+    entry = None if os.path.exists(args.emb) else registry.get(args.emb)
+    if entry is not None:
+        registry.update(entry["id"], files={"ivf": meta})
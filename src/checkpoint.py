@@ -0,0 +1,103 @@
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+
+
+def rng_state():
+    """RNG states of every generator the training loop draws from."""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def snapshot(obj):
+    """
+    Copy of a (nested) state dict with every tensor cloned to the CPU,
+    so training can keep updating the originals while the copy is written.
+    """
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def save_checkpoint(state, path):
+    """Write atomically: readers see either the previous or the new checkpoint, never half of one."""
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    print("### Resuming from checkpoint...", path)
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints from a background thread.
+    Only the newest pending state is kept: if training produces checkpoints faster
+    than the disk takes them, older unwritten ones are dropped.
+    A failed write stops the writer; the error is raised by the next submit() or by close().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("Writing checkpoint {} failed".format(self.path)) from self.error
+
+    def submit(self, state):
+        self.check()
+        state = snapshot(state)
+        with self.condition:
+            self.pending = state
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                state, self.pending = self.pending, None
+            try:
+                save_checkpoint(state, self.path)
+            except Exception as e:
+                print("### Checkpoint writer failed:", repr(e))
+                self.error = e
+                return
+
+    def close(self):
+        """Flush the pending checkpoint and stop the writer thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.check()
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+"""
+Spherical (cosine) k-means in NumPy.
+Replaces nltk's KMeansClusterer(cosine_distance, normalise=True, avoid_empty_clusters=True):
+the assignment step is one matrix product per iteration and restarts run in a process pool.
+"""
+
+
+def normalize(X):
+    X = np.asarray(X, dtype=np.float64)
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+
+
+def kmeans_single(X, k, seed, max_iter=100, tol=1e-6):
+    """
+    One restart on row-normalized X.
+    :return objective (sum of cosine similarities to the assigned centroid, higher is better), labels, centroids
+    """
+    rng = np.random.default_rng(seed)
+    centroids = X[rng.choice(len(X), k, replace=False)]
+    labels = None
+    objective = -np.inf
+    for _ in range(max_iter):
+        similarity = X @ centroids.T
+        new_labels = np.argmax(similarity, axis=1)
+        best = similarity[np.arange(len(X)), new_labels]
+
+        counts = np.bincount(new_labels, minlength=k)
+        for empty in np.flatnonzero(counts == 0):
+            # avoid empty clusters: move the point that fits its cluster worst
+            worst = np.argmin(best)
+            counts[new_labels[worst]] -= 1
+            new_labels[worst] = empty
+            counts[empty] = 1
+            best[worst] = 1.0
+
+        new_objective = float(best.sum())
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, new_labels, X)
+        centroids = normalize(sums)
+
+        converged = labels is not None and (np.array_equal(new_labels, labels) or new_objective - objective <= tol * abs(objective))
+        labels, objective = new_labels, new_objective
+        if converged:
+            break
+    return objective, labels, centroids
+
+
+def _restarts(X, k, seeds, max_iter, tol):
+    return [kmeans_single(X, k, seed, max_iter, tol)[:2] for seed in seeds]
+
+
+def spherical_kmeans(X, k, n_init=100, max_iter=100, tol=1e-6, n_jobs=None, seed=0):
+    """
+    Best of n_init restarts of spherical k-means.
+    :param n_jobs: Worker processes for the restarts (default: all cores, 1 runs in process).
+        The workers are spawned, not forked, so this is safe from a process that runs other threads.
+    :return labels of the best restart, list of (objective, labels) of every restart
+    """
+    X = normalize(X)
+    seeds = [seed + i for i in range(n_init)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, n_init)
+    if n_jobs <= 1:
+        runs = _restarts(X, k, seeds, max_iter, tol)
+    else:
+        chunks = [seeds[i::n_jobs] for i in range(n_jobs)]
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_restarts, X, k, chunk, max_iter, tol) for chunk in chunks]
+            runs = [run for future in futures for run in future.result()]
+    best = max(runs, key=lambda run: run[0])
+    return best[1], runs
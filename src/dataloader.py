@@ -1,14 +1,24 @@
+import os
+import queue
+import threading
+import time
 import torch
 import torch.optim as optim
 from tqdm import tqdm
 import numpy as np
 
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+from sampling import TypedAliasTable
 
 class DataReader:
     NEGATIVE_TABLE_SIZE = 1e8
-    def __init__(self, min_count, care_type, inputFileName):
+    def __init__(self, min_count, care_type, inputFileName, seed=0, negative_table=True, node_types=None):
         self.negatives = []
+        # care_type 1: node id -> type key ("ingredient+hub", "compound+food", ...) for heterogeneous negatives
+        self.node_types = node_types or {}
+        self.seed = seed
+        # the 1e8 entry table is only needed when the workers draw the negatives
+        self.negative_table = negative_table
         self.discards = []
         self.negpos = 0
         self.care_type = care_type
@@ -18,16 +28,21 @@ class DataReader:
         self.token_count = 0
         self.word_frequency = dict()
         self.inputFileName = inputFileName
+        self.offsets = []
 
         self.read_words(min_count)
+        self.initTableTypes()
         self.initTableNegatives()
         self.initTableDiscards()
 
     def read_words(self, min_count):
         word_frequency = dict()
-        for line in open(self.inputFileName, encoding="ISO-8859-1"):
-            line = line.split()
+        offset = 0
+        # binary mode, so the byte offset of every walk can be kept for random access
+        for raw in open(self.inputFileName, "rb"):
+            line = raw.decode("ISO-8859-1").split()
             if len(line) > 1:
+                self.offsets.append(offset)
                 self.sentences_count += 1
                 for word in line:
                     if len(word) > 0:
@@ -36,6 +51,8 @@ class DataReader:
 
                         if self.token_count % 1000000 == 0:
                             print("Read " + str(int(self.token_count)) + " words.")
+            offset += len(raw)
+        self.offsets = np.array(self.offsets, dtype=np.int64)
 
         wid = 0
         for w, c in word_frequency.items():
@@ -56,20 +73,42 @@ class DataReader:
         f = np.array(list(self.word_frequency.values())) / self.token_count
         self.discards = np.sqrt(t / f) + (t / f)
 
+    def initTableTypes(self):
+        # type index of every word id; words of unknown type share one extra type
+        self.type_names = sorted(set(self.node_types.get(w, "unknown") for w in self.word2id))
+        type_index = {t: i for i, t in enumerate(self.type_names)}
+        self.types = np.array([type_index[self.node_types.get(self.id2word[wid], "unknown")] for wid in range(len(self.id2word))], dtype=np.int64)
+
     def initTableNegatives(self):
         # get a table for negative sampling, if word with index 2 appears twice, then 2 will be listed
         # in the table twice.
         pow_frequency = np.array(list(self.word_frequency.values())) ** 0.75
         words_pow = sum(pow_frequency)
         ratio = pow_frequency / words_pow
+        self.sampling_prob = ratio
+        if self.care_type == 1:
+            # metapath2vec++: negatives follow unigram^0.75 within the type of the context node
+            self.typed_table = TypedAliasTable(ratio, self.types)
+            for name, size in zip(self.type_names, self.typed_table.sizes):
+                print("Negative sampling table for {}: {} nodes".format(name, size))
+            return
+        if not self.negative_table:
+            return
         count = np.round(ratio * DataReader.NEGATIVE_TABLE_SIZE)
         for wid, c in enumerate(count):
             self.negatives += [wid] * int(c)
         self.negatives = np.array(self.negatives)
-        np.random.shuffle(self.negatives)
+        np.random.RandomState(self.seed).shuffle(self.negatives)
         self.sampling_prob = ratio
 
-    def getNegatives(self, target, size):  # TODO check equality with target
+    def getNegatives(self, target, size, rng=None):  # TODO check equality with target
+        # target may be a single word id or an array of them; the result has shape target.shape + (size,)
+        if self.care_type == 1:
+            return self.typed_table.sample(self.types[target], size, rng if rng is not None else np.random)
+        if self.care_type == 0 and rng is not None:
+            # random positions in the shuffled table: same distribution as the running
+            # pointer below, but reproducible from the caller's generator
+            return self.negatives[rng.integers(0, len(self.negatives), np.shape(target) + (size,))]
         if self.care_type == 0:
             response = self.negatives[self.negpos:self.negpos + size]
             self.negpos = (self.negpos + size) % len(self.negatives)
@@ -80,42 +119,81 @@ class DataReader:
 
 # -----------------------------------------------------------------------------------------------------------------
 
+class EpochSampler(Sampler):
+    """
+    Shuffles the walks with a generator seeded from (seed, epoch), so the order of an
+    epoch can be rebuilt after a restart and iteration can start at any position.
+    """
+    def __init__(self, num_samples, seed):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1000003 + self.epoch)
+        order = torch.randperm(self.num_samples, generator=generator)[self.start:]
+        return iter(order.tolist())
+
+    def __len__(self):
+        return max(self.num_samples - self.start, 0)
+
+
 class DatasetLoader(Dataset):
-    def __init__(self, data, window_size):
+    def __init__(self, data, window_size, seed=0, device_sampling=False):
         # read in data, window_size and input filename
         self.data = data
         self.window_size = window_size
-        self.input_file = open(data.inputFileName, encoding="ISO-8859-1")
+        self.seed = seed
+        # with device_sampling, negatives are left to the training step (see sampling.py)
+        self.device_sampling = device_sampling
+        self.epoch = 0
+        self.input_file = None
+        self.input_pid = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
 
     def __len__(self):
         # return the number of walks
         return self.data.sentences_count
 
+    def readline(self, idx):
+        # every (forked) worker needs its own file handle, a shared one shares the seek position
+        if self.input_file is None or self.input_pid != os.getpid():
+            self.input_file = open(self.data.inputFileName, "rb")
+            self.input_pid = os.getpid()
+        self.input_file.seek(self.data.offsets[idx])
+        return self.input_file.readline().decode("ISO-8859-1")
+
     def __getitem__(self, idx):
         # return the list of pairs (center, context, 5 negatives)
-        while True:
-            line = self.input_file.readline()
-            if not line:
-                self.input_file.seek(0, 0)
-                line = self.input_file.readline()
+        # subsampling and negatives only depend on (seed, epoch, idx), which makes a resumed run exact
+        rng = np.random.default_rng([self.seed, self.epoch, int(idx)])
+        words = self.readline(idx).split()
+        # word2vec subsampling: every occurrence is kept or discarded once, before the windows are built
+        word_ids = [self.data.word2id[w] for w in words if
+                    w in self.data.word2id and rng.random() < self.data.discards[self.data.word2id[w]]]
 
-            if len(line) > 1:
-                words = line.split()
-
-                if len(words) > 1:
-                    word_ids = [self.data.word2id[w] for w in words if
-                                w in self.data.word2id and np.random.rand() < self.data.discards[self.data.word2id[w]]]
-
-                    pair_catch = []
-                    for i, u in enumerate(word_ids):
-                        for j, v in enumerate(
-                                word_ids[max(i - self.window_size, 0):i + self.window_size]):
-                            assert u < self.data.word_count
-                            assert v < self.data.word_count
-                            if i == j:
-                                continue
-                            pair_catch.append((u, v, self.data.getNegatives(v,5)))
-                    return pair_catch
+        pair_catch = []
+        for i, u in enumerate(word_ids):
+            for j, v in enumerate(
+                    word_ids[max(i - self.window_size, 0):i + self.window_size]):
+                assert u < self.data.word_count
+                assert v < self.data.word_count
+                if i == j:
+                    continue
+                pair_catch.append((u, v))
+        if self.device_sampling or not pair_catch:
+            return pair_catch
+        # negatives for the whole walk in one draw
+        negatives = self.data.getNegatives(np.array([v for _, v in pair_catch]), 5, rng)
+        return [(u, v, neg) for (u, v), neg in zip(pair_catch, negatives)]
 
     @staticmethod
     def collate(batches):
@@ -124,3 +202,108 @@ class DatasetLoader(Dataset):
         all_neg_v = [neg_v for batch in batches for _, _, neg_v in batch if len(batch) > 0]
 
         return torch.LongTensor(all_u), torch.LongTensor(all_v), torch.LongTensor(all_neg_v)
+
+    @staticmethod
+    def collate_pairs(batches):
+        all_u = [u for batch in batches for u, _ in batch if len(batch) > 0]
+        all_v = [v for batch in batches for _, v in batch if len(batch) > 0]
+
+        return torch.LongTensor(all_u), torch.LongTensor(all_v)
+
+
+# -----------------------------------------------------------------------------------------------------------------
+
+class BatchPrefetcher:
+    """
+    Pulls batches from a DataLoader in a background thread and keeps up to `depth` of them
+    ready, so collation and the host->device copy overlap with forward/backward.
+    On CUDA, batches are staged in reusable pinned buffers and copied on a side stream into
+    reusable device buffers; a slot is only refilled once the step that used it has finished.
+    wait_time accumulates how long the training loop blocked on data.
+    """
+    def __init__(self, loader, device, depth=2):
+        self.loader = loader
+        self.device = device
+        self.depth = depth
+        self.use_cuda = device.type == "cuda"
+        self.wait_time = 0.0
+        self.slots = [dict(host=[], device=[], done=None) for _ in range(depth + 1)]
+
+    def __len__(self):
+        return len(self.loader)
+
+    def stage(self, slot, batch, stream):
+        """Copy a collated batch into the slot's buffers and start its transfer to the device."""
+        if slot["done"] is not None:
+            # the step that last read this slot (and so the copy feeding it) has to be finished
+            # before the pinned and device buffers are overwritten
+            slot["done"].synchronize()
+        out = []
+        for i, tensor in enumerate(batch):
+            n = tensor.shape[0]
+            if i == len(slot["host"]):
+                slot["host"].append(None)
+                slot["device"].append(None)
+            if slot["host"][i] is None or slot["host"][i].shape[0] < n or slot["host"][i].shape[1:] != tensor.shape[1:]:
+                # grow with headroom, batch sizes vary with the number of pairs per walk
+                shape = (max(n, 2 * (slot["host"][i].shape[0] if slot["host"][i] is not None else 0)),) + tuple(tensor.shape[1:])
+                slot["host"][i] = torch.empty(shape, dtype=tensor.dtype).pin_memory()
+                slot["device"][i] = torch.empty(shape, dtype=tensor.dtype, device=self.device)
+            slot["host"][i][:n].copy_(tensor)
+            with torch.cuda.stream(stream):
+                slot["device"][i][:n].copy_(slot["host"][i][:n], non_blocking=True)
+            out.append(slot["device"][i][:n])
+        ready = torch.cuda.Event()
+        ready.record(stream)
+        return out, ready
+
+    def produce(self, ready, free):
+        stream = torch.cuda.Stream(device=self.device) if self.use_cuda else None
+        try:
+            for batch in self.loader:
+                slot_id = free.get()
+                if slot_id is None:
+                    return
+                if self.use_cuda:
+                    batch, event = self.stage(self.slots[slot_id], batch, stream)
+                else:
+                    event = None
+                ready.put((slot_id, batch, event))
+        except Exception as e:
+            ready.put(e)
+            return
+        ready.put(None)
+
+    def __iter__(self):
+        ready = queue.Queue()
+        free = queue.Queue()
+        for slot_id in range(self.depth + 1):
+            free.put(slot_id)
+        thread = threading.Thread(target=self.produce, args=(ready, free), daemon=True)
+        thread.start()
+
+        previous = None
+        try:
+            while True:
+                start = time.perf_counter()
+                item = ready.get()
+                self.wait_time += time.perf_counter() - start
+                if previous is not None:
+                    # everything queued on the compute stream so far used the previous slot
+                    if self.use_cuda:
+                        done = torch.cuda.Event()
+                        done.record(torch.cuda.current_stream(self.device))
+                        self.slots[previous]["done"] = done
+                    free.put(previous)
+                    previous = None
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                slot_id, batch, event = item
+                if event is not None:
+                    torch.cuda.current_stream(self.device).wait_event(event)
+                previous = slot_id
+                yield batch
+        finally:
+            free.put(None)
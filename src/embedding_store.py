@@ -0,0 +1,141 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+"""
+Embedding artifact:
+    <stem>.npy           |V| x d matrix, row i is the embedding of ids[i]
+    <stem>_CSPLayer.npy  optional |V| x 881 CSP projection (encoder applied to every row)
+    <stem>.index.json    ids, names and the file names above; written last, so its presence means the artifact is complete
+Older runs saved <stem>.pickle (+ <stem>_CSPLayer.pickle) dicts of id -> vector, load_embedding reads those as well.
+"""
+EXTENSIONS = ('.index.json', '.npy', '.pickle')
+
+
+def artifact_stem(path):
+    """Strip any of the artifact extensions, so a matrix, index or legacy pickle path all name the same artifact."""
+    for ext in EXTENSIONS:
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def index_path(path):
+    return artifact_stem(path) + '.index.json'
+
+
+def save_embedding_artifact(path, ids, matrix, csp=None, names=None):
+    """
+    Write an embedding artifact.
+    :param path: Artifact path (any of the artifact extensions, or the bare stem).
+    :param ids: Node id of every row.
+    :param matrix: Embedding matrix, saved in its own dtype.
+    :param csp: Optional CSP projection of the same rows.
+    :param names: Optional node id -> name mapping.
+    """
+    stem = artifact_stem(path)
+    np.save(stem + '.npy', np.ascontiguousarray(matrix))
+    if csp is not None:
+        np.save(stem + '_CSPLayer.npy', np.ascontiguousarray(csp))
+    index = {
+        "format": 1,
+        "ids": [str(i) for i in ids],
+        "names": [names.get(str(i)) for i in ids] if names else None,
+        "dim": int(matrix.shape[1]),
+        "dtype": str(matrix.dtype),
+        "matrix": os.path.basename(stem + '.npy'),
+        "csp": os.path.basename(stem + '_CSPLayer.npy') if csp is not None else None,
+    }
+    tmp = "{}.tmp-{}".format(index_path(stem), os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path(stem))
+    return index_path(stem)
+
+
+class EmbeddingTable(object):
+    """
+    Embedding matrix plus its id index.
+    Behaves like the old {node_id: vector} dicts (in, [], keys, items, len), rows come back as float32.
+    """
+    def __init__(self, ids, matrix, names=None, csp=None, path=None):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.names = names
+        self.csp = csp
+        self.path = path
+        self.index = {node_id: row for row, node_id in enumerate(self.ids)}
+
+    def row(self, node_id):
+        return self.index[str(node_id)]
+
+    def vectors(self, node_ids, dtype=np.float32):
+        """Rows of several ids in one fancy-indexing call."""
+        return np.asarray(self.matrix[[self.row(i) for i in node_ids]], dtype=dtype)
+
+    def as_matrix(self, dtype=np.float32):
+        return np.asarray(self.matrix, dtype=dtype)
+
+    def csp_table(self):
+        if self.csp is None:
+            raise FileNotFoundError("No CSP projection stored with {}".format(self.path))
+        return EmbeddingTable(self.ids, self.csp, names=self.names, path=self.path)
+
+    def __contains__(self, node_id):
+        return str(node_id) in self.index
+
+    def __getitem__(self, node_id):
+        return np.asarray(self.matrix[self.row(node_id)], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def keys(self):
+        return list(self.ids)
+
+    def values(self):
+        return (self[i] for i in self.ids)
+
+    def items(self):
+        return ((i, self[i]) for i in self.ids)
+
+    def as_dict(self):
+        return dict(self.items())
+
+
+def load_legacy_pickle(stem):
+    with open(stem + '.pickle', "rb") as handle:
+        vectors = pickle.load(handle)
+    ids = [str(i) for i in vectors]
+    matrix = np.stack([np.asarray(vectors[i]) for i in vectors])
+    csp = None
+    if os.path.exists(stem + '_CSPLayer.pickle'):
+        with open(stem + '_CSPLayer.pickle', "rb") as handle:
+            binary = pickle.load(handle)
+        csp = np.stack([np.asarray(binary[i]) for i in vectors])
+    return EmbeddingTable(ids, matrix, csp=csp, path=stem + '.pickle')
+
+
+def load_embedding(path, mmap=True):
+    """
+    Open an embedding artifact; the matrices are memory-mapped unless mmap is False.
+    Falls back to the legacy pickled dicts when there is no index for this stem.
+    """
+    stem = artifact_stem(path)
+    if not os.path.exists(index_path(stem)):
+        if os.path.exists(stem + '.pickle'):
+            return load_legacy_pickle(stem)
+        raise FileNotFoundError("No embedding artifact at {}".format(path))
+    with open(index_path(stem)) as f:
+        index = json.load(f)
+    folder = os.path.dirname(stem)
+    mmap_mode = 'r' if mmap else None
+    matrix = np.load(os.path.join(folder, index["matrix"]), mmap_mode=mmap_mode)
+    csp = np.load(os.path.join(folder, index["csp"]), mmap_mode=mmap_mode) if index.get("csp") else None
+    names = dict(zip(index["ids"], index["names"])) if index.get("names") else None
+    return EmbeddingTable(index["ids"], matrix, names=names, csp=csp, path=index_path(stem))
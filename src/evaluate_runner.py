@@ -0,0 +1,186 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from texttable import Texttable
+
+from utils import graph_reader, cluster_nmi
+from embedding_store import load_embedding, artifact_stem
+from linkpred import pair_scores, ranking_metrics
+from registry import Registry
+
+"""
+Evaluate many embedding artifacts in one go.
+The graph and the category labels are read once; every artifact is then evaluated in its own
+worker process (node clustering, CSP clustering, held-out link prediction when the run has one)
+and the results are written as a leaderboard, sorted by one metric, with per-stage timings.
+
+    python3 src/evaluate_runner.py --all --jobs 8 --sort nmi
+    python3 src/evaluate_runner.py --emb latest <id> output/some-embedding.npy
+"""
+PARAM_COLUMNS = ["idx_embed", "which_metapath", "dim", "window_size", "CSP_coef", "care_type", "holdout_ratio"]
+
+# set once per worker by init_worker, so the labels are not pickled again for every artifact
+_LABELS = None
+
+
+def category_labels(graph, labels_csv):
+    """(node id, category) for every labelled ingredient found in the graph."""
+    node_name2node = {info['name']: node for node, info in graph.nodes(data=True)}
+    df = pd.read_csv(labels_csv)
+    labels = []
+    for category in df.columns:
+        for name in df[category].dropna().values:
+            if name in node_name2node:
+                labels.append((str(node_name2node[name]), category))
+            else:
+                print("No node named", name)
+    return labels
+
+
+def init_worker(labels):
+    global _LABELS
+    _LABELS = labels
+
+
+def _clustering(table, n_init):
+    rows = [(node, category) for node, category in _LABELS if node in table]
+    X = table.vectors([node for node, _ in rows])
+    # one worker per artifact already: the restarts stay in the worker process
+    nmi, nmi_mean, nmi_std = cluster_nmi(X, [category for _, category in rows], n_init=n_init, n_jobs=1)
+    return {"nmi": nmi, "nmi_mean": nmi_mean, "nmi_std": nmi_std}
+
+
+def evaluate_artifact(name, path, linkpred_path=None, n_init=100):
+    """
+    Evaluate one artifact in a worker.
+    :return row of the leaderboard (metrics and *_s timings)
+    """
+    row = {"artifact": name, "path": path}
+    start = time.time()
+    table = load_embedding(path)
+    row["load_s"] = time.time() - start
+
+    tick = time.time()
+    row.update(_clustering(table, n_init))
+    row["cluster_s"] = time.time() - tick
+
+    if table.csp is not None:
+        tick = time.time()
+        row.update({"csp_" + k: v for k, v in _clustering(table.csp_table(), n_init).items()})
+        row["csp_s"] = time.time() - tick
+
+    linkpred_path = linkpred_path or artifact_stem(path) + '_linkpred.npz'
+    if os.path.exists(linkpred_path):
+        tick = time.time()
+        pairs = np.load(linkpred_path)
+        metrics = ranking_metrics(pair_scores(table, pairs["positives"]), pair_scores(table, pairs["negatives"]))
+        row.update({"linkpred_" + k: v for k, v in metrics.items()})
+        row["linkpred_s"] = time.time() - tick
+
+    row["total_s"] = time.time() - start
+    return row
+
+
+def row_metrics(row):
+    """Metrics of a leaderboard row, without names, parameters and timings."""
+    return {k: v for k, v in row.items() if k not in PARAM_COLUMNS and k not in ("artifact", "path") and not k.endswith("_s")}
+
+
+def collect_artifacts(registry, refs, use_all):
+    """(name, path, linkpred file, registry entry) for every requested artifact."""
+    manifest = registry.load()
+    entries = [entry for entry in manifest["artifacts"].values() if entry["kind"] == "embedding"] if use_all else []
+    artifacts = [(entry["id"], entry) for entry in entries]
+    for ref in refs:
+        entry = None if os.path.exists(ref) else registry.get(ref)
+        if entry is None and not os.path.exists(ref):
+            raise FileNotFoundError("No embedding artifact registered for {}".format(ref))
+        artifacts.append((entry["id"] if entry else ref, entry))
+
+    seen = set()
+    jobs = []
+    for name, entry in artifacts:
+        if name in seen:
+            continue
+        seen.add(name)
+        if entry is None:
+            jobs.append((name, name, None, None))
+            continue
+        linkpred = registry.file(entry, "linkpred") if "linkpred" in entry["files"] else None
+        jobs.append((name, registry.file(entry), linkpred, entry))
+    return jobs
+
+
+def write_leaderboard(rows, out, sort):
+    columns = []
+    for row in rows:
+        columns += [c for c in row if c not in columns]
+    rows = sorted(rows, key=lambda row: row.get(sort, float("-inf")), reverse=True)
+    with open(out + ".json", "w") as f:
+        json.dump(rows, f, indent=1)
+    with open(out + ".csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    shown = ["artifact"] + [c for c in ["dim", "window_size", "CSP_coef", sort, "csp_nmi", "linkpred_auc", "total_s"] if c in columns and c != "artifact"]
+    shown = list(dict.fromkeys(shown))
+    t = Texttable()
+    t.add_rows([shown] + [[row.get(c, "") for c in shown] for row in rows])
+    print(t.draw())
+    print("Leaderboard written to {}.csv / {}.json".format(out, out))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate several embedding artifacts in parallel and write a leaderboard")
+    parser.add_argument('--emb', nargs='*', default=[], type=str, help="artifact ids, tags or paths")
+    parser.add_argument('--all', action='store_true', help="evaluate every embedding in the registry")
+    parser.add_argument('--output_path', default="./output/", type=str, help="registry root")
+    parser.add_argument('--input_nodes', default="./input/nodes_191120.csv", type=str)
+    parser.add_argument('--input_edges', default="./input/edges_191120.csv", type=str)
+    parser.add_argument('--labels', default="./input/node_classification_hub.csv", type=str, help="category csv")
+    parser.add_argument('--n_init', default=100, type=int, help="k-means restarts per artifact")
+    parser.add_argument('--jobs', default=None, type=int, help="worker processes (default: all cores)")
+    parser.add_argument('--sort', default="nmi", type=str, help="leaderboard metric, higher is better")
+    parser.add_argument('--out', default=None, type=str, help="leaderboard path without extension (default: <output_path>/leaderboard)")
+    parser.add_argument('--record', action='store_true', help="write the metrics back to the registry")
+    args = parser.parse_args()
+
+    registry = Registry(args.output_path)
+    jobs = collect_artifacts(registry, args.emb, args.all)
+    if not jobs:
+        parser.error("nothing to evaluate, pass --emb or --all")
+
+    graph, _ = graph_reader(args.input_nodes, args.input_edges)
+    labels = category_labels(graph, args.labels)
+
+    start = time.time()
+    rows = []
+    workers = min(args.jobs or os.cpu_count() or 1, len(jobs))
+    print("\nEvaluating {} artifacts with {} workers...".format(len(jobs), workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(labels,)) as pool:
+        futures = {pool.submit(evaluate_artifact, name, path, linkpred, args.n_init): entry
+                   for name, path, linkpred, entry in jobs}
+        for future in as_completed(futures):
+            entry = futures[future]
+            row = future.result()
+            if entry is not None:
+                row.update({k: entry["params"].get(k) for k in PARAM_COLUMNS if k in entry["params"]})
+            print("{}: nmi {:.4f} in {:.1f}s".format(row["artifact"], row["nmi"], row["total_s"]))
+            rows.append(row)
+            if args.record and entry is not None:
+                registry.update(entry["id"], metrics=row_metrics(row))
+    print("Evaluated {} artifacts in {:.1f}s".format(len(rows), time.time() - start))
+
+    write_leaderboard(rows, args.out or os.path.join(args.output_path, "leaderboard"), args.sort)
+
+
+if __name__ == "__main__":
+    main()
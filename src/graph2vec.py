@@ -5,172 +5,271 @@ from torch.autograd import Variable
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 import numpy as np
+import math
+import time
 import pickle
 import os
-from dataloader import DataReader, DatasetLoader
-from walkers import MetaPathWalker, DeepWalker
-from model import SkipGramModel, SkipGramModelAux
+from dataloader import DataReader, DatasetLoader, EpochSampler, BatchPrefetcher
+from walkers import MetaPathWalker, DeepWalker, metapath_file_name, deepwalk_file_name, walk_file_name
+from model import SkipGramModel, SkipGramModelAux, MasterRowAdam
+from sampling import NegativeSampler
+from utils import node_type_keys
+from embedding_store import artifact_stem, index_path
+from registry import Registry, embedding_params, file_hash
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, set_rng_state
 
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "1"
 
-class Metapath2Vec:
-    def __init__(self, args, graph):
-        # 1. generate walker
-        walker = MetaPathWalker(args, graph)
-
-        files = os.listdir(args.input_path)
-        is_file = False
-        for file in files:
-            fullFilename = os.path.join(args.input_path, file)
-            # if file exists, load the file.
-            if file.startswith(args.idx_metapath):
-                is_file = True
-                print("\n !!! Found the file that you have specified...")
-                self.inputFileName = "{}{}-metapath_{}-whichmeta_{}-num_walks_{}-len_metapath.txt".format(args.input_path, args.idx_metapath, args.which_metapath, args.num_walks, args.len_metapath)
-                print("### Metapaths Loaded...", self.inputFileName)
-
-        # if file does not exists, create the new one.
-        if not is_file:
-            print("\n !!! There is no metapaths with the given parameters...")
-            print("### Creating new Metapaths...")
-            self.metapaths = walker.generate_metapaths(args)
-            walker.create_metapath_walks(args, args.num_walks, self.metapaths)
-            self.inputFileName = "{}{}-metapath_{}-whichmeta_{}-num_walks_{}-len_metapath.txt".format(args.input_path, args.idx_metapath, args.which_metapath, args.num_walks, args.len_metapath)
-            print("### Metapaths Loaded...", self.inputFileName)
-
-        # 2. read data
-        print("\n\n##########################################################################")
-        print("### Metapaths to DataLoader...", self.inputFileName)
-        self.data = DataReader(args.min_count, args.care_type, self.inputFileName)
+class SkipGramTrainer:
+    """
+    Training loop shared by Metapath2Vec and Node2Vec.
+    Optimizers and schedulers live for the whole run; the state needed to continue
+    (model, optimizers, schedulers, RNGs, position in the epoch) is checkpointed every
+    --checkpoint_every steps and at the end of each iteration.
+    """
+    def init_training(self, args):
+        # output files are named and later found through the artifact registry
+        self.registry = Registry(args.output_path)
+        self.params = embedding_params(args)
+        self.artifact_id = self.registry.artifact_id(self.params)
+        self.output_file_name = self.registry.artifact_path(self.params, prefix=args.idx_embed + "-embedding")
+        self.tag = args.tag
 
         # 3. make dataset for training
-        dataset = DatasetLoader(self.data, args.window_size)
-
+        self.dataset = DatasetLoader(self.data, args.window_size, seed=args.seed, device_sampling=args.device_sampling)
+        self.sampler = EpochSampler(len(self.dataset), args.seed)
 
         # 4. initialize dataloader
-        self.dataloader = DataLoader(dataset, batch_size=args.batch_size,
-                                     shuffle=True, num_workers=args.num_workers, collate_fn=dataset.collate)
-        self.output_file_name = "{}{}-embedding_{}-metapath_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count-_{}-isCSP_{}-CSPcoef.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count, args.CSP_train, args.CSP_coef)
-        self.emb_size = len(self.data.word2id)
-        self.emb_dimension = args.dim
-        self.batch_size = args.batch_size
-        self.iterations = args.iterations
-        self.initial_lr = args.initial_lr
-        self.aux_mode = args.CSP_train
-        self.aux_coef = args.CSP_coef
+        collate = self.dataset.collate_pairs if args.device_sampling else self.dataset.collate
+        self.dataloader = DataLoader(self.dataset, batch_size=args.batch_size, sampler=self.sampler,
+                                     num_workers=args.num_workers, collate_fn=collate)
+        self.steps_per_epoch = math.ceil(len(self.dataset) / args.batch_size)
+        self.checkpoint_every = args.checkpoint_every
+        self.checkpoint_path = artifact_stem(self.output_file_name) + '.ckpt'
+        self.node_names = {str(node): info['name'] for node, info in self.graph.nodes(data=True)} if self.graph is not None else None
+        self.resume = args.resume
+        self.seed = args.seed
+        self.prefetch = args.prefetch
+        self.device_sampling = args.device_sampling
 
-        if args.CSP_train:
-            print("\n\n#####################################")
-            print("### SkipGram with CSP")
-            self.skip_gram_model = SkipGramModelAux(self.emb_size, self.emb_dimension, nodes=self.data.id2word, aux_coef=self.aux_coef, CSP_save=args.CSP_save)
+    def build_optimizers(self):
+        model = self.skip_gram_model
+        if self.table_dtype != "fp32":
+            optimizer = MasterRowAdam(model, lr=self.initial_lr)
+        elif self.aux_mode:
+            optimizer = optim.Adam([model.u_embeddings.weight, model.v_embeddings.weight], lr=self.initial_lr)
         else:
-            print("\n\n#####################################")
-            print("### SkipGram Normal")
-            self.skip_gram_model = SkipGramModel(self.emb_size, self.emb_dimension)
+            optimizer = optim.SparseAdam(model.parameters(), lr=self.initial_lr)
+        # warm restarts every epoch give the same cosine schedule per iteration as before,
+        # without throwing the optimizer state away
+        self.optimizers = [optimizer]
+        if self.aux_mode:
+            self.optimizers.append(optim.Adam([model.encoder.weight], lr=0.001))
+        self.schedulers = [torch.optim.lr_scheduler.CosineAnnealingWarmRestarts(o, self.steps_per_epoch) for o in self.optimizers]
+        self.negative_sampler = NegativeSampler(self.data, self.device, seed=self.seed) if self.device_sampling else None
 
-        self.use_cuda = torch.cuda.is_available()
-        self.device = torch.device("cuda" if self.use_cuda else "cpu")
-        if self.use_cuda:
-            self.skip_gram_model.cuda()
+    def training_state(self, iteration, step, running_loss):
+        return {
+            "model": self.skip_gram_model.state_dict(),
+            "optimizers": [o.state_dict() for o in self.optimizers],
+            "schedulers": [s.state_dict() for s in self.schedulers],
+            "rng": rng_state(),
+            "negative_sampler": self.negative_sampler.state_dict() if self.negative_sampler is not None else None,
+            "iteration": iteration,
+            "step": step,
+            "running_loss": running_loss,
+        }
+
+    def restore(self, state):
+        self.skip_gram_model.load_state_dict(state["model"])
+        for optimizer, optimizer_state in zip(self.optimizers, state["optimizers"]):
+            optimizer.load_state_dict(optimizer_state)
+        for scheduler, scheduler_state in zip(self.schedulers, state["schedulers"]):
+            scheduler.load_state_dict(scheduler_state)
+        set_rng_state(state["rng"])
+        if self.negative_sampler is not None:
+            self.negative_sampler.load_state_dict(state["negative_sampler"])
+        return state["iteration"], state["step"], state["running_loss"]
 
     def train(self):
-        for iteration in range(self.iterations):
-            #print(self.skip_gram_model.u_embeddings.weight.data)
+        self.build_optimizers()
+        start_iteration, start_step, running_loss = 0, 0, 0.0
+        if self.resume and os.path.exists(self.checkpoint_path):
+            start_iteration, start_step, running_loss = self.restore(load_checkpoint(self.checkpoint_path))
+            if start_iteration >= self.iterations:
+                # the run finished but was not published (checkpoints are removed after publishing)
+                print("### Checkpoint holds a finished run ({} iterations), publishing it without training".format(start_iteration))
+            else:
+                print("### Iteration {}, step {}".format(start_iteration + 1, start_step))
+        elif self.resume:
+            print("### No checkpoint at {}, training from the start".format(self.checkpoint_path))
+        writer = CheckpointWriter(self.checkpoint_path) if self.checkpoint_every > 0 else None
+
+        for iteration in range(start_iteration, self.iterations):
             print("\n\n\nIteration: " + str(iteration + 1))
-            # Temporary Fix!
-            if self.aux_mode:
-                u = self.skip_gram_model.u_embeddings.weight
-                v = self.skip_gram_model.v_embeddings.weight
-                e = self.skip_gram_model.encoder.weight
-                optimizer = optim.Adam([u, v], lr=self.initial_lr)
-                aux_optimizer = optim.Adam([e], lr=0.001)
-                aux_scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(aux_optimizer, len(self.dataloader))
+            step = start_step if iteration == start_iteration else 0
+            if step == 0:
+                running_loss = 0.0
+            self.dataset.set_epoch(iteration)
+            self.sampler.set_epoch(iteration, start=step * self.batch_size)
+            if self.prefetch > 0:
+                batches = BatchPrefetcher(self.dataloader, self.device, depth=self.prefetch)
             else:
-                optimizer = optim.SparseAdam(self.skip_gram_model.parameters(), lr=self.initial_lr)
-            scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, len(self.dataloader))
+                batches = self.dataloader
+            epoch_start = time.perf_counter()
 
-            running_loss = 0.0
-            for i, sample_batched in enumerate(tqdm(self.dataloader)):
+            for sample_batched in tqdm(batches, initial=step, total=self.steps_per_epoch):
+                if self.negative_sampler is not None and len(sample_batched[0]) > 1:
+                    sample_batched = self.negative_sampler.sample(sample_batched[0].to(self.device, non_blocking=True),
+                                                                  sample_batched[1].to(self.device, non_blocking=True))
                 if len(sample_batched[0]) > 1:
-                    pos_u = sample_batched[0].to(self.device)
-                    pos_v = sample_batched[1].to(self.device)
-                    neg_v = sample_batched[2].to(self.device)
-
-                    scheduler.step()
-                    optimizer.zero_grad()
-                    if self.aux_mode:
-                        aux_scheduler.step()
-                        aux_optimizer.zero_grad()
+                    pos_u = sample_batched[0].to(self.device, non_blocking=True)
+                    pos_v = sample_batched[1].to(self.device, non_blocking=True)
+                    neg_v = sample_batched[2].to(self.device, non_blocking=True)
 
+                    for optimizer in self.optimizers:
+                        optimizer.zero_grad()
                     loss = self.skip_gram_model.forward(pos_u, pos_v, neg_v)
                     loss.backward()
-                    optimizer.step()
-                    if self.aux_mode:
-                        aux_optimizer.step()
+                    for optimizer in self.optimizers:
+                        optimizer.step()
+                    for scheduler in self.schedulers:
+                        scheduler.step()
                     running_loss = running_loss * 0.9 + loss.item() * 0.1
 
-                    #if i > 0 and i % int(len(self.dataloader)/3) == 0:
+                step += 1
+                if writer is not None and step % self.checkpoint_every == 0:
+                    writer.submit(self.training_state(iteration, step, running_loss))
+
             print(" Loss: " + str(running_loss))
+            if self.prefetch > 0:
+                elapsed = time.perf_counter() - epoch_start
+                print(" Data wait: {:.1f}s of {:.1f}s ({:.0%})".format(batches.wait_time, elapsed, batches.wait_time / max(elapsed, 1e-9)))
             if self.aux_mode:
-                    print(" Auxiliary Loss: " + str(self.skip_gram_model.aux_loss.item()))
+                print(" Auxiliary Loss: " + str(self.skip_gram_model.aux_loss.item()))
+            if writer is not None:
+                writer.submit(self.training_state(iteration + 1, 0, running_loss))
 
-        self.skip_gram_model.save_embedding(self.data.id2word, self.output_file_name)
+        if writer is not None:
+            writer.close()
+        self.skip_gram_model.save_embedding(self.data.id2word, self.output_file_name, names=self.node_names)
+        self.registry.publish(self.params, {"embedding": index_path(self.output_file_name)},
+                              corpus_hash=getattr(self.data, "corpus_hash", None) or file_hash(self.inputFileName), tags=[self.tag] if self.tag else [])
+        print("### Published embedding", self.artifact_id, self.output_file_name)
+        # the run is complete: a later --resume with the same parameters must not restore it
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
 
-class Node2Vec:
-    def __init__(self, args, graph):
-        print("\nPerforming Node2vec...\n")
-        # 1. generate walker
-        walker = DeepWalker(args, graph)
-        print("\nDoing deepwalks...\n")
-        walker.create_features()
 
-        self.inputFileName = "{}{}-deepwalk_{}-num_walks_{}-len_metapath.txt".format(args.input_path, args.idx_metapath, args.number_of_walks, args.walk_length)
+def read_walks(args, graph, inputFileName):
+    return DataReader(args.min_count, args.care_type, inputFileName, seed=args.seed, negative_table=not args.device_sampling,
+                      node_types=node_type_keys(graph) if args.care_type == 1 else None)
 
-        # 2. read data
-        self.data = DataReader(args.min_count, args.care_type, self.inputFileName)
 
-        # 3. make dataset for training
-        dataset = DatasetLoader(self.data, args.window_size)
+def metapath_data(args, graph):
+    """Metapath walks (generated unless the walk file already exists) read into a DataReader."""
+    # 1. generate walker
+    walker = MetaPathWalker(args, graph)
 
-        # 4. initialize dataloader
-        self.dataloader = DataLoader(dataset, batch_size=args.batch_size,
-                                     shuffle=True, num_workers=args.num_workers, collate_fn=dataset.collate)
+    inputFileName = metapath_file_name(args)
+    is_file = False
+    # if file exists, load the file.
+    if os.path.exists(inputFileName):
+        is_file = True
+        print("\n !!! Found the file that you have specified...")
+        print("### Metapaths Loaded...", inputFileName)
+
+    # if file does not exists, create the new one.
+    if not is_file:
+        print("\n !!! There is no metapaths with the given parameters...")
+        print("### Creating new Metapaths...")
+        metapaths = walker.generate_metapaths(args)
+        walker.create_metapath_walks(args, args.num_walks, metapaths)
+        print("### Metapaths Loaded...", inputFileName)
+
+    # 2. read data
+    print("\n\n##########################################################################")
+    print("### Metapaths to DataLoader...", inputFileName)
+    return read_walks(args, graph, inputFileName)
+
+
+def deepwalk_data(args, graph):
+    """DeepWalk walks read into a DataReader."""
+    print("\nPerforming Node2vec...\n")
+    # 1. generate walker
+    walker = DeepWalker(args, graph)
+    print("\nDoing deepwalks...\n")
+    walker.create_features()
+
+    # 2. read data
+    return read_walks(args, graph, deepwalk_file_name(args))
 
-        self.output_file_name = "{}{}-embedding_{}-deepwalk_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count)
+
+def generate_walks(args, graph):
+    """(Re)generate the walk file of a run, whether or not it exists, and return its path."""
+    if args.idx_embed == 'Node2vec':
+        DeepWalker(args, graph).create_features()
+    else:
+        walker = MetaPathWalker(args, graph)
+        walker.create_metapath_walks(args, args.num_walks, walker.generate_metapaths(args))
+    return walk_file_name(args)
+
+
+def build_data(args, graph):
+    """Walks and vocabulary of a run; trials that only differ in skip-gram parameters can share them."""
+    return deepwalk_data(args, graph) if args.idx_embed == 'Node2vec' else metapath_data(args, graph)
+
+
+class Metapath2Vec(SkipGramTrainer):
+    def __init__(self, args, graph, data=None):
+        self.graph = graph
+        self.data = data if data is not None else metapath_data(args, graph)
+        self.inputFileName = self.data.inputFileName
+
+        self.init_training(args)
         self.emb_size = len(self.data.word2id)
         self.emb_dimension = args.dim
         self.batch_size = args.batch_size
         self.iterations = args.iterations
         self.initial_lr = args.initial_lr
-        self.skip_gram_model = SkipGramModel(self.emb_size, self.emb_dimension)
+        self.aux_mode = args.CSP_train
+        self.aux_coef = args.CSP_coef
+        self.table_dtype = args.table_dtype
+
+        if args.CSP_train:
+            print("\n\n#####################################")
+            print("### SkipGram with CSP")
+            self.skip_gram_model = SkipGramModelAux(self.emb_size, self.emb_dimension, nodes=self.data.id2word, aux_coef=self.aux_coef, CSP_save=args.CSP_save,
+                                                    precision=args.precision, table_dtype=args.table_dtype)
+        else:
+            print("\n\n#####################################")
+            print("### SkipGram Normal")
+            self.skip_gram_model = SkipGramModel(self.emb_size, self.emb_dimension, precision=args.precision, table_dtype=args.table_dtype)
 
         self.use_cuda = torch.cuda.is_available()
         self.device = torch.device("cuda" if self.use_cuda else "cpu")
         if self.use_cuda:
             self.skip_gram_model.cuda()
 
-    def train(self):
-        for iteration in range(self.iterations):
-            print("\n\n\nIteration: " + str(iteration + 1))
-            optimizer = optim.SparseAdam(self.skip_gram_model.parameters(), lr=self.initial_lr)
-            scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, len(self.dataloader))
 
-            running_loss = 0.0
-            for i, sample_batched in enumerate(tqdm(self.dataloader)):
+class Node2Vec(SkipGramTrainer):
+    def __init__(self, args, graph, data=None):
+        self.graph = graph
+        self.data = data if data is not None else deepwalk_data(args, graph)
+        self.inputFileName = self.data.inputFileName
 
-                if len(sample_batched[0]) > 1:
-                    pos_u = sample_batched[0].to(self.device)
-                    pos_v = sample_batched[1].to(self.device)
-                    neg_v = sample_batched[2].to(self.device)
+        self.init_training(args)
+        self.emb_size = len(self.data.word2id)
+        self.emb_dimension = args.dim
+        self.batch_size = args.batch_size
+        self.iterations = args.iterations
+        self.initial_lr = args.initial_lr
+        self.aux_mode = False
+        self.table_dtype = args.table_dtype
+        self.skip_gram_model = SkipGramModel(self.emb_size, self.emb_dimension, precision=args.precision, table_dtype=args.table_dtype)
 
-                    scheduler.step()
-                    optimizer.zero_grad()
-                    loss = self.skip_gram_model.forward(pos_u, pos_v, neg_v)
-                    loss.backward()
-                    optimizer.step()
-                    running_loss = running_loss * 0.9 + loss.item() * 0.1
-            print(" Loss: " + str(running_loss))
-            self.skip_gram_model.save_embedding(self.data.id2word, self.output_file_name)
+        self.use_cuda = torch.cuda.is_available()
+        self.device = torch.device("cuda" if self.use_cuda else "cpu")
+        if self.use_cuda:
+            self.skip_gram_model.cuda()
@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_store import load_embedding, artifact_stem
+from similarity import node_attributes, normalize_rows
+from registry import Registry
+
+"""
+Precomputed top-k neighbour table for every ingredient.
+The normalized ingredient matrix is multiplied with itself one block of rows at a time; the block of rows
+is sized so that its scores against all ingredients fit the memory budget, and its column blocks are
+scored and reduced to a partial top-k by parallel threads (NumPy releases the GIL in the products).
+    <stem>_knn.json         k, the node id of every table row, settings
+    <stem>_knn_ids.npy      int32 node ids, rows x k, best first
+    <stem>_knn_scores.npy   float16 cosine similarities, rows x k
+Serving a "most compatible ingredients" request is then one row lookup in the memory-mapped arrays.
+
+    python3 src/knn_table.py --emb latest --k 50 --memory_mb 512 --threads 8
+"""
+
+
+def topk_block(queries, columns, k, offset, self_rows):
+    """Top-k columns of one (row block x column block) product, with the diagonal masked out."""
+    scores = queries @ columns.T
+    inside = (self_rows >= offset) & (self_rows < offset + len(columns))
+    scores[np.flatnonzero(inside), self_rows[inside] - offset] = -np.inf
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return top + offset, np.take_along_axis(scores, top, axis=1)
+
+
+def all_pairs_topk(X, k=50, memory_mb=512, threads=None):
+    """
+    Top-k most similar rows of every row of X (itself excluded).
+    :return (n, k) row indices and scores, best first
+    """
+    X = normalize_rows(X)
+    n = len(X)
+    k = min(k, n - 1)
+    threads = threads or os.cpu_count() or 1
+    rows_per_block = max(1, min(n, (memory_mb << 20) // (4 * n)))
+    column_block = -(-n // threads)
+    ids = np.empty((n, k), dtype=np.int64)
+    scores = np.empty((n, k), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for start in range(0, n, rows_per_block):
+            queries = X[start:start + rows_per_block]
+            self_rows = np.arange(start, start + len(queries))
+            parts = list(pool.map(lambda offset: topk_block(queries, X[offset:offset + column_block], k, offset, self_rows),
+                                  range(0, n, column_block)))
+            # merge the partial top-k of the column blocks
+            part_ids = np.concatenate([p[0] for p in parts], axis=1)
+            part_scores = np.concatenate([p[1] for p in parts], axis=1)
+            top = np.argpartition(-part_scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(part_scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            ids[start:start + len(queries)] = np.take_along_axis(np.take_along_axis(part_ids, top, axis=1), order, axis=1)
+            scores[start:start + len(queries)] = np.take_along_axis(top_scores, order, axis=1)
+    return ids, scores
+
+
+class KNNTable(object):
+    """Memory-mapped neighbour table; `neighbours(node_id)` is a dict lookup and a row slice."""
+    def __init__(self, node_ids, ids, scores, k):
+        self.node_ids = node_ids
+        self.row = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.ids = ids
+        self.scores = scores
+        self.k = k
+
+    def __contains__(self, node_id):
+        return str(node_id) in self.row
+
+    def neighbours(self, node_id, k=None):
+        """[(node id, score)] of the k (default: all stored) nearest ingredients, best first."""
+        row = self.row[str(node_id)]
+        k = k or self.k
+        return [(str(i), float(s)) for i, s in zip(self.ids[row, :k], self.scores[row, :k])]
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        stem = artifact_stem(path)
+        if not os.path.exists(stem + '_knn.json'):
+            raise FileNotFoundError("No kNN table for {}".format(path))
+        with open(stem + '_knn.json') as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        return cls(meta["node_ids"], np.load(stem + '_knn_ids.npy', mmap_mode=mmap_mode),
+                   np.load(stem + '_knn_scores.npy', mmap_mode=mmap_mode), meta["k"])
+
+
+def build_knn_table(path, nodes_csv=None, node_type="ingredient", k=50, memory_mb=512, threads=None):
+    """Compute and save the neighbour table of the `node_type` nodes of an artifact; returns the json path."""
+    print("\nBuilding kNN table...", path)
+    table = load_embedding(path)
+    attributes = node_attributes(nodes_csv) if nodes_csv else {}
+    node_ids = [i for i in table.ids if not attributes or attributes.get(i, (None, None))[1] == node_type]
+    matrix = table.vectors(node_ids)
+
+    start = time.time()
+    rows, scores = all_pairs_topk(matrix, k=k, memory_mb=memory_mb, threads=threads)
+    print("{} x {} neighbours in {:.1f}s".format(len(node_ids), rows.shape[1], time.time() - start))
+
+    stem = artifact_stem(path)
+    np.save(stem + '_knn_ids.npy', np.array(node_ids, dtype=np.int32)[rows])
+    np.save(stem + '_knn_scores.npy', scores.astype(np.float16))
+    meta = {"k": int(rows.shape[1]), "node_type": node_type if attributes else None, "node_ids": node_ids}
+    tmp = "{}_knn.json.tmp-{}".format(stem, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, stem + '_knn.json')
+    return stem + '_knn.json'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the top-k neighbours of every ingredient")
+    parser.add_argument('--emb', default="latest", type=str, help="registry id/tag or artifact path")
+    parser.add_argument('--output_path', default="./output/", type=str, help="registry root")
+    parser.add_argument('--nodes', default="./input/nodes_191120.csv", type=str, help="nodes csv, for the node types ('' for all nodes)")
+    parser.add_argument('--node_type', default="ingredient", type=str)
+    parser.add_argument('--k', default=50, type=int)
+    parser.add_argument('--memory_mb', default=512, type=int, help="memory for one block of scores")
+    parser.add_argument('--threads', default=None, type=int, help="threads over column blocks (default: all cores)")
+    args = parser.parse_args()
+
+    registry = Registry(args.output_path)
+    path = registry.resolve(args.emb)
+    meta = build_knn_table(path, nodes_csv=args.nodes or None, node_type=args.node_type, k=args.k,
+                           memory_mb=args.memory_mb, threads=args.threads)
+    entry = None if os.path.exists(args.emb) else registry.get(args.emb)
+    if entry is not None:
+        registry.update(entry["id"], files={"knn": meta})
@@ -0,0 +1,125 @@
+import numpy as np
+
+from embedding_store import load_embedding, artifact_stem
+from registry import Registry, resolve_embedding, embedding_params
+
+"""
+Held-out link prediction for ingredient pairing.
+A fraction of the ingr-ingr edges is removed from the graph before the walks are generated;
+after training, every held-out edge (a, b) is scored against a negative (a, c) where c is an
+ingredient of similar degree to b that is not connected to a. All scoring is batched.
+"""
+
+
+def split_ingredient_edges(graph, ratio, seed=0):
+    """
+    Remove a random `ratio` of the ingr-ingr edges from the graph (in place).
+    Edges whose removal would leave an endpoint without any edge are kept, so every node still gets an embedding.
+    :return heldout: (n, 2) array of node ids
+    """
+    rng = np.random.default_rng(seed)
+    edges = [(a, b) for a, b, data in graph.edges(data=True) if data['type'] == 'ingr-ingr' and a != b]
+    order = rng.permutation(len(edges))
+    target = int(round(ratio * len(edges)))
+    heldout = []
+    for i in order:
+        if len(heldout) >= target:
+            break
+        a, b = edges[i]
+        if graph.degree(a) > 1 and graph.degree(b) > 1:
+            graph.remove_edge(a, b)
+            heldout.append((a, b))
+    print("\nHeld out {} of {} ingr-ingr edges for link prediction".format(len(heldout), len(edges)))
+    return np.array(heldout, dtype=np.int64).reshape(-1, 2)
+
+
+def degree_matched_negatives(graph, heldout, candidates, seed=0, window=10, rounds=20):
+    """
+    One negative (a, c) per held-out edge (a, b): c is drawn among the `window` candidates
+    closest to b in degree order, rejecting c == a, c == b and pairs that are (held-out) edges.
+    """
+    rng = np.random.default_rng(seed)
+    candidates = np.array(sorted(candidates, key=lambda n: (graph.degree(n), n)), dtype=np.int64)
+    position = {node: i for i, node in enumerate(candidates)}
+    forbidden = set(map(tuple, heldout.tolist())) | set(map(tuple, heldout[:, ::-1].tolist()))
+
+    anchor = heldout[:, 0]
+    center = np.array([position.get(b, len(candidates) // 2) for b in heldout[:, 1]])
+    negatives = np.full(len(heldout), -1, dtype=np.int64)
+    todo = np.arange(len(heldout))
+    for _ in range(rounds):
+        if len(todo) == 0:
+            break
+        offset = rng.integers(-window, window + 1, size=len(todo))
+        picked = candidates[np.clip(center[todo] + offset, 0, len(candidates) - 1)]
+        ok = np.array([c != a and c != b and not graph.has_edge(a, c) and (a, c) not in forbidden
+                       for a, b, c in zip(anchor[todo], heldout[todo, 1], picked)], dtype=bool)
+        negatives[todo[ok]] = picked[ok]
+        todo = todo[~ok]
+    keep = negatives >= 0
+    return np.stack([anchor[keep], negatives[keep]], axis=1), keep
+
+
+def pair_scores(table, pairs):
+    """Cosine similarity of every (a, b) row pair, in one gather and one row-wise dot."""
+    left = table.vectors([str(a) for a in pairs[:, 0]])
+    right = table.vectors([str(b) for b in pairs[:, 1]])
+    left /= np.linalg.norm(left, axis=1, keepdims=True) + 1e-12
+    right /= np.linalg.norm(right, axis=1, keepdims=True) + 1e-12
+    return np.einsum('ij,ij->i', left, right)
+
+
+def ranking_metrics(pos, neg, ks=(10, 50, 100)):
+    """
+    AUC (Mann-Whitney with tied ranks averaged), average precision, and Hits@K in the OGB sense:
+    the fraction of positives scoring above the K-th best negative.
+    """
+    scores = np.concatenate([pos, neg])
+    labels = np.concatenate([np.ones(len(pos)), np.zeros(len(neg))])
+    order = np.argsort(scores, kind="mergesort")
+    ranks = np.empty(len(scores))
+    sorted_scores = scores[order]
+    # average ranks over ties
+    _, first, counts = np.unique(sorted_scores, return_index=True, return_counts=True)
+    ranks[order] = np.repeat(first + (counts + 1) / 2.0, counts)
+    auc = (ranks[:len(pos)].sum() - len(pos) * (len(pos) + 1) / 2.0) / (len(pos) * len(neg))
+
+    desc = np.argsort(-scores, kind="mergesort")
+    hits = labels[desc]
+    precision = np.cumsum(hits) / np.arange(1, len(hits) + 1)
+    ap = float((precision * hits).sum() / max(hits.sum(), 1))
+
+    metrics = {"auc": float(auc), "ap": ap}
+    neg_sorted = np.sort(neg)[::-1]
+    for k in ks:
+        threshold = neg_sorted[k - 1] if len(neg_sorted) >= k else -np.inf
+        metrics["hits@{}".format(k)] = float(np.mean(pos > threshold))
+    return metrics
+
+
+def link_prediction(args, graph, heldout, table=None):
+    """
+    Score the held-out ingr-ingr edges of this run against degree-matched negatives,
+    store the pairs next to the embedding and the metrics in the registry.
+    :param table: Embedding table of the run, if it is already loaded.
+    """
+    print("\nLink Prediction...")
+    if table is None:
+        table = load_embedding(resolve_embedding(args))
+    file = table.path
+    candidates = [n for n, info in graph.nodes(data=True) if info['type'] == 'ingredient' and str(n) in table]
+    known = np.array([str(a) in table and str(b) in table for a, b in heldout], dtype=bool)
+    positives = heldout[known]
+    negatives, keep = degree_matched_negatives(graph, positives, candidates, seed=args.seed)
+    positives = positives[keep]
+
+    metrics = ranking_metrics(pair_scores(table, positives), pair_scores(table, negatives))
+    for name, value in metrics.items():
+        print("%s: %f" % (name, value))
+
+    path = artifact_stem(file) + '_linkpred.npz'
+    np.savez(path, positives=positives, negatives=negatives)
+    registry = Registry(args.output_path)
+    registry.update(registry.artifact_id(embedding_params(args)),
+                    metrics={"linkpred_" + k: v for k, v in metrics.items()}, files={"linkpred": path})
+    return metrics
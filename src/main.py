@@ -1,11 +1,5 @@
-import torch
 from parser import parameter_parser
 
-from utils import tab_printer, graph_reader, evaluate
-from dataloader import DataReader, DatasetLoader
-from graph2vec import Metapath2Vec, Node2Vec
-from plotter import plot_embedding
-
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
@@ -13,40 +7,19 @@ os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 def main():
     """
     Parsing command line parameters.
-    Reading data, embedding base graph, creating persona graph and learning a splitter.
-    Saving the persona mapping and the embedding.
+    Running the stages of the pipeline: reading the graph, generating walks, training the embedding,
+    then plotting and evaluating it. Stages with cached results are loaded instead of run.
     """
     args = parameter_parser()
+    # heavy modules (torch, pandas, plotting) are only imported once the arguments are valid
+    import torch
+    from utils import tab_printer
+    from pipeline import Pipeline
+
     torch.manual_seed(args.seed)
     tab_printer(args)
 
-    """
-    1. read graph and load as torch dataset
-    """
-    graph, graph_ingr_only = graph_reader(args.input_nodes, args.input_edges)
-
-
-    """
-    2. Metapath2vec with MetaPathWalker - Ingredient-Ingredient / Ingredient-Food-like Compound / Ingredient-Drug-like Compound
-    """
-    
-    if args.idx_embed == 'Node2vec':
-        node2vec = Node2Vec(args, graph)
-        node2vec.train()
-
-    else:
-        metapath2vec = Metapath2Vec(args, graph)
-        metapath2vec.train()
-
-    """
-    3. Plot your embedding if you like
-    """
-    plot_embedding(args, graph)
-
-    """
-    4. Evaluate Node Classification & Node Clustering
-    """
-    evaluate(args, graph)
+    Pipeline(args).run(only=args.only, start=args.from_stage, force=args.force)
 
 if __name__ == "__main__":
     main()
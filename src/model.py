@@ -1,16 +1,22 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.optim as optim
 from torch.nn import init
 import pickle
 import pandas as pd
 import numpy as np
+from embedding_store import save_embedding_artifact
 
 """
     u_embedding: Embedding for center word.
     v_embedding: Embedding for neighbor words.
 """
-def load_augmentive_features(nodes):
+DTYPES = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def load_augmentive_features(nodes, dtype=torch.float32):
     PICKLE_PATH = "./input/node2fp_revised_1120.pickle"
     print("Loading Chemical Vectors from ", PICKLE_PATH)
     with open(PICKLE_PATH, "rb") as handle:
@@ -31,16 +37,69 @@ def load_augmentive_features(nodes):
             binary_mask.append([0])
         augmentive_matrix.append(binary_vector)
 
-    binary_mask = np.array(binary_mask).astype(float)
-    augmentive_matrix = np.array(augmentive_matrix).astype(float)
+    # fingerprints are binary, so they are exact in any of the half dtypes as well
+    binary_mask = np.asarray(binary_mask, dtype=np.float32)
+    augmentive_matrix = np.asarray(augmentive_matrix, dtype=np.float32)
     vector_length = augmentive_matrix.shape[1]
-    return torch.tensor(augmentive_matrix, requires_grad=False).float().to("cuda"), vector_length, torch.tensor(binary_mask, requires_grad=False).float().to("cuda")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.from_numpy(augmentive_matrix).to(device=device, dtype=dtype), vector_length, torch.from_numpy(binary_mask).to(device)
+
+class MasterRowAdam(optim.Optimizer):
+    """
+    Adam for embedding tables stored in fp16/bf16.
+    The model gathers the rows touched by a batch into fp32 master rows, the update is done
+    on those in fp32 and only the result is rounded back into the low precision table.
+    Moments are kept in fp32, like SparseAdam does.
+    """
+    def __init__(self, model, lr=1e-3, betas=(0.9, 0.999), eps=1e-8):
+        self.model = model
+        super(MasterRowAdam, self).__init__([model.u_embeddings.weight, model.v_embeddings.weight],
+                                            dict(lr=lr, betas=betas, eps=eps))
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = closure() if closure is not None else None
+        group = self.param_groups[0]
+        beta1, beta2 = group['betas']
+        for weight, rows, master in self.model.pop_master_rows():
+            if master.grad is None:
+                continue
+            state = self.state[weight]
+            if len(state) == 0:
+                state['step'] = torch.zeros((), dtype=torch.float32)
+                state['exp_avg'] = torch.zeros(weight.shape, dtype=torch.float32, device=weight.device)
+                state['exp_avg_sq'] = torch.zeros(weight.shape, dtype=torch.float32, device=weight.device)
+            state['step'] += 1
+            step = state['step'].item()
+
+            grad = master.grad
+            exp_avg = state['exp_avg'][rows].mul_(beta1).add_(grad, alpha=1 - beta1)
+            exp_avg_sq = state['exp_avg_sq'][rows].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            state['exp_avg'][rows] = exp_avg
+            state['exp_avg_sq'][rows] = exp_avg_sq
+
+            step_size = group['lr'] * math.sqrt(1 - beta2 ** step) / (1 - beta1 ** step)
+            update = exp_avg / exp_avg_sq.sqrt().add_(group['eps'])
+            weight[rows] = master.sub_(update, alpha=step_size).to(weight.dtype)
+        return loss
+
+    def load_state_dict(self, state_dict):
+        super(MasterRowAdam, self).load_state_dict(state_dict)
+        # Optimizer.load_state_dict casts the moments to the dtype of the tables, keep them fp32
+        params = self.param_groups[0]['params']
+        for idx, saved in state_dict['state'].items():
+            for key in ('exp_avg', 'exp_avg_sq'):
+                self.state[params[idx]][key] = saved[key].to(device=params[idx].device, dtype=torch.float32)
+
 
 class SkipGramModel(nn.Module):
-    def __init__(self, emb_size, emb_dimension):
+    def __init__(self, emb_size, emb_dimension, precision="fp32", table_dtype="fp32"):
         super(SkipGramModel, self).__init__()
         self.emb_size = emb_size                # row / 1825
         self.emb_dimension = emb_dimension      # column / 128
+        self.precision = precision
+        self.table_dtype = table_dtype
+        self.master_rows = []
 
         self.u_embeddings = nn.Embedding(emb_size, emb_dimension, sparse=True)
         self.v_embeddings = nn.Embedding(emb_size, emb_dimension, sparse=True)
@@ -51,20 +110,58 @@ class SkipGramModel(nn.Module):
         initrange = 1.0 / self.emb_dimension
         init.uniform_(self.u_embeddings.weight.data, -initrange, initrange)
         init.constant_(self.v_embeddings.weight.data, 0)
-
-    def forward(self, pos_u, pos_v, neg_v):
-        emb_u = self.u_embeddings(pos_u)
-        emb_v = self.v_embeddings(pos_v)
-        emb_neg_v = self.v_embeddings(neg_v)
-
-        score = torch.sum(torch.mul(emb_u, emb_v), dim=1)
-        score = torch.clamp(score, max=10, min=-10)
+        self.cast_tables()
+
+    def cast_tables(self):
+        """Move the u/v tables to the storage dtype chosen with --table_dtype."""
+        dtype = DTYPES[self.table_dtype]
+        self.u_embeddings.weight.data = self.u_embeddings.weight.data.to(dtype)
+        self.v_embeddings.weight.data = self.v_embeddings.weight.data.to(dtype)
+
+    def autocast(self, device):
+        """bf16 autocast for the scoring math, a no-op in fp32 mode."""
+        return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16")
+
+    def lookup(self, embedding, *indices):
+        """
+        Embedding lookup for one or more index tensors.
+        fp32 tables are looked up directly. Low precision tables are read once per unique row
+        into an fp32 master copy which receives the gradient; see MasterRowAdam.
+        """
+        if embedding.weight.dtype == torch.float32:
+            return [embedding(idx) for idx in indices]
+        flat = torch.cat([idx.reshape(-1) for idx in indices])
+        rows, inverse = torch.unique(flat, return_inverse=True)
+        master = embedding.weight.detach()[rows].float().requires_grad_()
+        self.master_rows.append((embedding.weight, rows, master))
+        gathered = master[inverse]
+        out, start = [], 0
+        for idx in indices:
+            out.append(gathered[start:start + idx.numel()].reshape(*idx.shape, -1))
+            start += idx.numel()
+        return out
+
+    def pop_master_rows(self):
+        master_rows, self.master_rows = self.master_rows, []
+        return master_rows
+
+    def scores(self, emb_u, emb_v, emb_neg_v):
+        with self.autocast(emb_u.device):
+            score = torch.bmm(emb_u.unsqueeze(1), emb_v.unsqueeze(2)).reshape(-1)
+            neg_score = torch.bmm(emb_neg_v, emb_u.unsqueeze(2)).squeeze(2)
+
+        score = torch.clamp(score.float(), max=10, min=-10)
         score = -F.logsigmoid(score)
 
-        neg_score = torch.bmm(emb_neg_v, emb_u.unsqueeze(2)).squeeze()
-        neg_score = torch.clamp(neg_score, max=10, min=-10)
+        neg_score = torch.clamp(neg_score.float(), max=10, min=-10)
         neg_score = -torch.sum(F.logsigmoid(-neg_score), dim=1)
+        return score, neg_score
 
+    def forward(self, pos_u, pos_v, neg_v):
+        emb_u, = self.lookup(self.u_embeddings, pos_u)
+        emb_v, emb_neg_v = self.lookup(self.v_embeddings, pos_v, neg_v)
+
+        score, neg_score = self.scores(emb_u, emb_v, emb_neg_v)
         return torch.mean(score + neg_score)
 
     def print_network(self, model, name):
@@ -76,28 +173,30 @@ class SkipGramModel(nn.Module):
         print(model)
         print("The number of parameters: {}".format(num_params))
 
-    def save_embedding(self, id2word, file_name):
-        embed_dict = dict()
-        embedding = self.u_embeddings.weight.cpu().data.numpy()
-        for wid, w in id2word.items():
-            try:
-                embed_dict[w] = embedding[wid]
-            except:
-                print(w)
-        with open(file_name, "wb") as handle:
-            pickle.dump(embed_dict, handle)
+    def saved_embedding(self):
+        """u embeddings as a numpy matrix, in float16 unless the run was full precision."""
+        embedding = self.u_embeddings.weight.detach().cpu().float().numpy()
+        if self.precision != "fp32" or self.table_dtype != "fp32":
+            embedding = embedding.astype(np.float16)
+        return embedding
+
+    def save_embedding(self, id2word, file_name, names=None):
+        embedding = self.saved_embedding()
+        ids = [id2word[wid] for wid in range(len(id2word))]
+        save_embedding_artifact(file_name, ids, embedding, names=names)
 
 
 class SkipGramModelAux(SkipGramModel):
-    def __init__(self, emb_size, emb_dimension, nodes=None, aux_coef=0.0001, CSP_save=False):
-        super(SkipGramModelAux, self).__init__(emb_size, emb_dimension)
+    def __init__(self, emb_size, emb_dimension, nodes=None, aux_coef=0.0001, CSP_save=False, precision="fp32", table_dtype="fp32"):
+        super(SkipGramModelAux, self).__init__(emb_size, emb_dimension, precision=precision, table_dtype=table_dtype)
         self.emb_size = emb_size                # row / # of vocab size / 8298
         self.emb_dimension = emb_dimension      # column / user-defined vector dimension / 128
         self.aux_coef = aux_coef
         self.aux_loss = 0.0
         self.CSP_save = CSP_save
 
-        self.aug_embeddings, self.aug_dimension, self.binary_masks = load_augmentive_features(nodes)
+        aug_dtype = torch.float32 if precision == "fp32" and table_dtype == "fp32" else torch.bfloat16
+        self.aug_embeddings, self.aug_dimension, self.binary_masks = load_augmentive_features(nodes, dtype=aug_dtype)
 
         # |V| x |d|
         self.u_embeddings = nn.Embedding(self.emb_size, self.emb_dimension)
@@ -122,23 +221,24 @@ class SkipGramModelAux(SkipGramModel):
         nn.init.constant_(self.v_embeddings.weight.data, 0)
         # nn.init.sparse_(self.v_embeddings.weight.data, sparsity=0.66, std=0.001)
         nn.init.sparse_(self.encoder.weight.data, sparsity=0.66, std=0.001)
+        self.cast_tables()
 
     def forward(self, pos_u, pos_v, neg_v):
-        emb_u = self.u_embeddings(pos_u)
-        emb_v = self.v_embeddings(pos_v)
-        emb_neg_v = self.v_embeddings(neg_v)
+        emb_u, = self.lookup(self.u_embeddings, pos_u)
+        emb_v, emb_neg_v = self.lookup(self.v_embeddings, pos_v, neg_v)
 
-        emb_u = self.encoder(emb_u)
-        emb_v = self.encoder(emb_v)
-        emb_neg_v = self.encoder(emb_neg_v)
+        with self.autocast(emb_u.device):
+            emb_u = self.encoder(emb_u)
+            emb_v = self.encoder(emb_v)
+            emb_neg_v = self.encoder(emb_neg_v)
 
         # For Chemical Structure Prediction Loss
         pos_u_masks = self.binary_masks[pos_u]
         #pos_v_masks = self.binary_masks[pos_v]
         #neg_v_masks = self.binary_masks[neg_v].reshape(-1, 5).reshape(-1)
 
-        aux_emb_u1 = emb_u[pos_u_masks.nonzero()[:, 0]]
-        aux_emb_u2 = self.a_embeddings(pos_u)[pos_u_masks.nonzero()[:, 0]]
+        aux_emb_u1 = emb_u[pos_u_masks.nonzero()[:, 0]].float()
+        aux_emb_u2 = self.a_embeddings(pos_u)[pos_u_masks.nonzero()[:, 0]].float()
 
         #aux_emb_v1 = emb_v[pos_v_masks.nonzero()[:, 0]]
         #aux_emb_v2 = self.a_embeddings(pos_v)[pos_v_masks.nonzero()[:, 0]]
@@ -156,13 +256,7 @@ class SkipGramModelAux(SkipGramModel):
         self.aux_loss = aux_loss1
         
         # For Main Skip-Gram Loss
-        score = torch.sum(torch.mul(emb_u, emb_v), dim=1)
-        score = torch.clamp(score, max=10, min=-10)
-        score = -F.logsigmoid(score)
-
-        neg_score = torch.bmm(emb_neg_v, emb_u.unsqueeze(2)).squeeze()
-        neg_score = torch.clamp(neg_score, max=10, min=-10)
-        neg_score = -torch.sum(F.logsigmoid(-neg_score), dim=1)
+        score, neg_score = self.scores(emb_u, emb_v, emb_neg_v)
 
         #return torch.mean(score + neg_score) + (self.aux_coef * self.aux_loss)
         return torch.mean(score + neg_score + (self.aux_coef*self.aux_loss) )
@@ -177,27 +271,12 @@ class SkipGramModelAux(SkipGramModel):
         print(model)
         print("The number of parameters: {}".format(num_params))
 
-    def save_embedding(self, id2word, file_name):
-        embed_dict = dict()
-        binary_dict = dict()
-        embedding = self.u_embeddings.weight.cpu().data.numpy()
-        for wid, w in id2word.items():
-            try:
-                embed_dict[w] = embedding[wid]
-            except:
-                print(w)
-        with open(file_name, "wb") as handle:
-            pickle.dump(embed_dict, handle)
-
+    def save_embedding(self, id2word, file_name, names=None):
+        embedding = self.saved_embedding()
+        ids = [id2word[wid] for wid in range(len(id2word))]
+        csp = None
         if self.CSP_save:
-            transform = self.encoder.weight.cpu().data.numpy()
-            for wid, w in id2word.items():
-                try:
-                    x = np.matmul(transform, embedding[wid])
-                    binary_dict[w] = x
-                except Exception as e:
-                    print(e)
-                    print("Something wrong with encoder?", w)
-
-            with open(file_name.replace('.pickle', '_CSPLayer.pickle'), "wb") as handle:
-                pickle.dump(binary_dict, handle)
+            # every row through the encoder at once
+            transform = self.encoder.weight.detach().cpu().float().numpy()
+            csp = np.matmul(embedding.astype(np.float32), transform.T).astype(embedding.dtype)
+        save_embedding_artifact(file_name, ids, embedding, csp=csp, names=names)
@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+"""
+Ingredient name -> node id resolution with prebuilt indexes, in this order:
+    exact    normalized name (lowercase, words joined by '_', as in the FlavorGraph node names)
+    alias    a versioned table of synonyms, e.g. "jeera" -> "cumin" (a synonym only resolves to its canonical name)
+    fuzzy    names sharing trigrams with the query (inverted index), ranked by Dice similarity, with a
+             bonus for names that contain every word of the query
+             (resolve_first(..., fuzzy=False) takes the first graph name containing the query instead)
+Results are memoized, so resolving the same name again is a dict lookup.
+
+    resolver = NameResolver.from_csv("input/nodes_191120.csv", ALIASES)
+    resolver.resolve("Lemon Juice")        # (node id, graph name)
+    resolver.matches("cardamon", k=5)      # [(node id, graph name, score)]
+"""
+ALIASES = "config/aliases/beverage_aliases.json"
+
+
+def normalize(name):
+    return re.sub(r"[^0-9a-z]+", "_", str(name).strip().lower()).strip("_")
+
+
+def trigrams(name):
+    padded = "  {} ".format(name)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def load_aliases(path=ALIASES):
+    """{normalized synonym: [canonical name]} from {"aliases": {canonical: [synonyms]}}; {} without the file."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        groups = json.load(f).get("aliases", {})
+    aliases = {}
+    for canonical, names in groups.items():
+        for name in names:
+            # synonyms never chain or point at each other: lemon_juice is not lemon
+            aliases.setdefault(normalize(name), [normalize(canonical)])
+    return aliases
+
+
+class NameResolver(object):
+    """
+    :param id_to_name: {node id: name}.
+    :param aliases: {normalized name: [names to try]}, as returned by load_aliases.
+    :param min_score: Smallest fuzzy score accepted by resolve().
+    :param memo_size: Resolved names remembered (the memo is cleared when full).
+    """
+    def __init__(self, id_to_name, aliases=None, min_score=0.5, memo_size=100000):
+        self.aliases = aliases or {}
+        self.min_score = min_score
+        self.exact = {}
+        for node_id, name in id_to_name.items():
+            # last occurrence wins, as in the name_to_id maps built from the nodes csv
+            self.exact[normalize(name)] = (node_id, name)
+        self.names = list(self.exact)
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(i)
+        self.memo = {}
+        self.memo_size = memo_size
+
+    def remember(self, key, found):
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[key] = found
+        return found
+
+    @classmethod
+    def from_csv(cls, nodes_csv, aliases_path=ALIASES, **kwargs):
+        with open(nodes_csv, newline='') as f:
+            id_to_name = {r["node_id"]: r["name"] for r in csv.DictReader(f)}
+        return cls(id_to_name, load_aliases(aliases_path), **kwargs)
+
+    def matches(self, query, k=5):
+        """Fuzzy matches of a name, best first: [(node id, graph name, score in [0, 1])]."""
+        query = normalize(query)
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        words = set(query.split("_"))
+        ranked = []
+        # only the names sharing the most trigrams can score well
+        for i, common in shared.most_common(max(k, 200)):
+            name = self.names[i]
+            score = 2.0 * common / (len(grams) + self.sizes[i])
+            if words <= set(name.split("_")):
+                score = 0.5 + 0.5 * score
+            ranked.append((-score, len(name), name))
+        ranked.sort()
+        return [self.exact[name] + (-score,) for score, _, name in ranked[:k]]
+
+    def lookup(self, query):
+        """(node id, graph name) by exact name, then alias; None if neither knows the name."""
+        key = normalize(query)
+        if key in self.exact:
+            return self.exact[key]
+        for name in self.aliases.get(key, ()):
+            if name in self.exact:
+                return self.exact[name]
+        return None
+
+    def resolve(self, query):
+        """(node id, graph name) for a name, or (None, query) if nothing scores min_score."""
+        if query not in self.memo:
+            found = self.lookup(query)
+            if found is None:
+                best = self.matches(query, k=1)
+                found = best[0][:2] if best and best[0][2] >= self.min_score else (None, query)
+            return self.remember(query, found)
+        return self.memo[query]
+
+    def containing(self, *queries):
+        """(node id, graph name) of the first graph name, in table order, that contains one of the normalized queries; None if none."""
+        first = None
+        for query in map(normalize, queries):
+            if not query:
+                continue
+            # a name containing the query has every trigram inside it, so only names in all those postings qualify
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            candidates = range(len(self.names))
+            if grams:
+                candidates = sorted(set.intersection(*(set(self.postings.get(gram, ())) for gram in grams)))
+            i = next((i for i in candidates if query in self.names[i]), None)
+            if i is not None and (first is None or i < first):
+                first = i
+        return None if first is None else self.exact[self.names[first]]
+
+    def resolve_first(self, preferred_names, fuzzy=True):
+        """
+        The first of several names known exactly or by alias, else the best fuzzy match of any of them.
+        :param fuzzy: False falls back to the first graph name containing one of the names instead,
+            which never picks a merely similar ingredient.
+        """
+        key = (tuple(preferred_names), fuzzy)
+        if key not in self.memo:
+            found = next((f for f in map(self.lookup, preferred_names) if f is not None), None)
+            if found is None and fuzzy:
+                ranked = sorted((m for n in preferred_names for m in self.matches(n, k=1)), key=lambda m: -m[2])
+                found = ranked[0][:2] if ranked and ranked[0][2] >= self.min_score else None
+            elif found is None:
+                found = self.containing(*preferred_names)
+            return self.remember(key, found or (None, preferred_names[0]))
+        return self.memo[key]
@@ -1,8 +1,9 @@
 import argparse
 
-def parameter_parser():
+def parameter_parser(argv=None):
     """
     A method to parse up command line parameters.
+    :param argv: Arguments to parse instead of sys.argv.
     """
     parser = argparse.ArgumentParser(description="FlavorNet2.0")
 
@@ -19,6 +20,7 @@ def parameter_parser():
     parser.add_argument('--output_path',
                         default="./output/",
                         type=str, help="output_path")
+    parser.add_argument('--tag', default=None, type=str, help="extra registry tag for the trained embedding")
 
     # Skip-Gram
     parser.add_argument('--idx_embed', default="FlavorGraph+CSL", type=str)
@@ -30,6 +32,12 @@ def parameter_parser():
     parser.add_argument('--initial_lr', default=0.0025, type=float, help="learning rate")
     parser.add_argument('--min_count', default=5, type=int, help="min count")
     parser.add_argument('--num_workers', default=16, type=int, help="number of workers")
+    parser.add_argument('--device_sampling', default=False, action="store_true", help="workers ship subsampled (u, v) pairs only; negatives are drawn per batch on the training device")
+    parser.add_argument('--prefetch', default=2, type=int, help="batches prepared ahead of the training step in a background thread (0: off)")
+    parser.add_argument('--checkpoint_every', default=0, type=int, help="write a resumable training checkpoint every N steps (0: off)")
+    parser.add_argument('--resume', default=False, action="store_true", help="continue from the checkpoint next to the output embedding")
+    parser.add_argument('--precision', default="fp32", choices=["fp32", "bf16"], help="bf16: autocast the scoring math and save float16 embeddings")
+    parser.add_argument('--table_dtype', default="fp32", choices=["fp32", "fp16", "bf16"], help="storage dtype of the embedding tables, updated through fp32 master rows")
 
     # Graph2vec - common
     
@@ -55,9 +63,26 @@ def parameter_parser():
 
     
     
+    # Plotting
+    parser.add_argument('--projection', default="tsne", choices=["tsne", "pca", "random"], help="2-D projection of the plots; pca and random are fast previews")
+    parser.add_argument('--pca_dim', default=50, type=int, help="PCA dimensions kept before t-SNE (0: none)")
+    parser.add_argument('--perplexity', default=30.0, type=float, help="t-SNE perplexity")
+
+    # Pipeline stages: graph, walks, train, quantize, plot, evaluate
+    parser.add_argument('--only', default=None, type=str, help="comma separated stages to run, e.g. 'train' or 'plot,evaluate'")
+    parser.add_argument('--from', dest='from_stage', default=None, type=str, help="run this stage and every stage after it")
+    parser.add_argument('--force', default=False, action="store_true", help="re-run the selected stages even if their results are cached")
+
+    # Link prediction
+    parser.add_argument('--holdout_ratio', default=0.0, type=float, help="hold out this fraction of ingr-ingr edges before the walks and evaluate link prediction on them")
+
+    # Quantized export
+    parser.add_argument('--quantize', default=False, action="store_true", help="also export int8 and PQ codes of the embeddings")
+    parser.add_argument('--pq_dsub', default=4, type=int, help="dimensions per PQ subspace")
+
     # Pytorch
     parser.add_argument("--seed",
                         type = int,
                         default = 42, help = "Random seed for PyTorch. Default is 42.")
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
@@ -0,0 +1,296 @@
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from embedding_store import load_embedding, artifact_stem, index_path
+from registry import Registry, embedding_params, file_hash
+
+"""
+main.py as a DAG of stages: graph -> walks -> train -> (quantize, plot, evaluate).
+Every stage declares its upstream stages and the parameters it depends on; its cache key hashes
+those parameters with the content hash of its inputs, and the record of a finished stage (key and
+outputs) is kept in <output_path>/pipeline.json. A stage whose key is recorded and whose files still
+exist is loaded instead of run. Loaded objects (graph, embedding table) are handed to the next stages
+in memory. Stages run in ORDER in this process, except for the last stages (those nothing else depends on,
+e.g. quantize, plot and evaluate): once train is done they run concurrently, each in a spawned process
+whose output is printed as one block when it finishes.
+Each stage imports what it needs (torch, pandas, plotting libraries) when it runs, so cached stages cost nothing.
+"""
+RECORD = "pipeline.json"
+LABELS = "./input/node_classification_hub.csv"
+
+# name: (upstream stages, parameters)
+STAGES = {
+    "graph": ([], ["holdout_ratio", "seed"]),
+    "walks": (["graph"], ["idx_embed", "idx_metapath", "which_metapath", "num_walks", "len_metapath", "number_of_walks", "walk_length"]),
+    "train": (["graph", "walks"], []),
+    "quantize": (["train"], ["quantize", "pq_dsub"]),
+    "plot": (["graph", "train"], ["CSP_save", "projection", "pca_dim", "perplexity"]),
+    "evaluate": (["graph", "train"], ["CSP_save"]),
+}
+ORDER = ["graph", "walks", "train", "quantize", "plot", "evaluate"]
+
+
+def select_stages(only=None, start=None):
+    """Stages to (re)run for --only a,b / --from name; the others are only loaded when something needs them."""
+    if only:
+        names = [name.strip() for name in only.split(",")]
+    elif start:
+        names = ORDER[ORDER.index(start):]
+    else:
+        names = list(ORDER)
+    for name in names:
+        if name not in STAGES:
+            raise ValueError("Unknown stage {}, expected one of {}".format(name, ", ".join(ORDER)))
+    return names
+
+
+class Pipeline(object):
+    def __init__(self, args):
+        self.args = args
+        self.root = args.output_path
+        self.path = os.path.join(self.root, RECORD)
+        self.registry = Registry(self.root)
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.records = json.load(f)
+        # in-memory outputs and cache keys of the stages done in this process
+        self.outputs = {}
+        self.keys = {}
+        self.selected = list(ORDER)
+        # in a stage process: records to hand back to the parent, which alone rewrites pipeline.json
+        self.deferred = None
+
+    def key(self, name, extra=()):
+        upstream, params = STAGES[name]
+        blob = json.dumps([name, {p: getattr(self.args, p, None) for p in params}, [self.keys[u] for u in upstream], list(extra)],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+    def record(self, name, key, outputs):
+        if self.deferred is not None:
+            self.deferred.append((name, key, outputs))
+            return
+        self.records.setdefault(name, {})[key] = dict(outputs, time=time.time())
+        os.makedirs(self.root, exist_ok=True)
+        tmp = "{}.tmp-{}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.records, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def rebuilding(self, name):
+        # an upstream stage that was not asked for, but has no usable cache entry
+        if name not in self.selected:
+            print("\n### Stage {} is not cached for these parameters, rebuilding it before {}".format(name, ", ".join(self.selected)))
+
+    def cached(self, name, key, files=()):
+        entry = self.records.get(name, {}).get(key)
+        if entry is None or not all(os.path.exists(entry[f]) for f in files):
+            return None
+        return entry
+
+    """
+    1. read graph (and hold out link prediction edges)
+    """
+    def graph(self, force):
+        from utils import graph_reader
+        from linkpred import split_ingredient_edges
+        args = self.args
+        key = self.key("graph", [file_hash(args.input_nodes), file_hash(args.input_edges)])
+        entry = None if force else self.cached("graph", key, ["pickle"])
+        if entry is not None:
+            print("\n### Graph loaded from cache", entry["pickle"])
+            with open(entry["pickle"], "rb") as f:
+                graph, heldout = pickle.load(f)
+        else:
+            self.rebuilding("graph")
+            graph, _ = graph_reader(args.input_nodes, args.input_edges)
+            heldout = split_ingredient_edges(graph, args.holdout_ratio, seed=args.seed) if args.holdout_ratio > 0 else None
+            path = os.path.join(self.root, "graph-{}.pickle".format(key))
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, "wb") as f:
+                pickle.dump((graph, heldout), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.record("graph", key, {"pickle": path})
+        return key, {"graph": graph, "heldout": heldout}
+
+    """
+    2. Metapath2vec with MetaPathWalker - Ingredient-Ingredient / Ingredient-Food-like Compound / Ingredient-Drug-like Compound
+    """
+    def walks(self, force):
+        from walkers import walk_file_name
+        key = self.key("walks")
+        path = walk_file_name(self.args)
+        entry = None if force else self.cached("walks", key, ["file"])
+        if entry is None and not force and os.path.exists(path) and not any(e["file"] == path for e in self.records.get("walks", {}).values()):
+            # walk files written before the pipeline existed: their name already encodes the walk parameters
+            print("\n !!! Found the file that you have specified...")
+            entry = {"file": path, "hash": file_hash(path)}
+            self.record("walks", key, entry)
+        if entry is None:
+            from graph2vec import generate_walks
+            self.rebuilding("walks")
+            print("\n### Generating walks...", path)
+            path = generate_walks(self.args, self.outputs["graph"]["graph"])
+            entry = {"file": path, "hash": file_hash(path)}
+            self.record("walks", key, entry)
+        print("### Walks", entry["file"])
+        # downstream stages depend on the walk content, not on how it was produced
+        return entry["hash"], {"file": entry["file"], "hash": entry["hash"]}
+
+    def train(self, force):
+        args = self.args
+        params = embedding_params(args)
+        key = self.key("train", [params])
+        entry = None if force or args.resume else self.cached("train", key, ["embedding"])
+        if entry is None:
+            from graph2vec import Metapath2Vec, Node2Vec, read_walks
+            self.rebuilding("train")
+            graph = self.outputs["graph"]["graph"]
+            walks = self.outputs["walks"]
+            data = read_walks(args, graph, walks["file"])
+            data.corpus_hash = walks["hash"]
+            trainer = Node2Vec(args, graph, data=data) if args.idx_embed == 'Node2vec' else Metapath2Vec(args, graph, data=data)
+            trainer.train()
+            entry = {"embedding": index_path(trainer.output_file_name), "artifact_id": trainer.artifact_id}
+            self.record("train", key, entry)
+        else:
+            print("\n### Embedding loaded from cache", entry["embedding"])
+        return key, {"table": load_embedding(entry["embedding"]), "artifact_id": entry["artifact_id"]}
+
+    def quantize(self, force):
+        args = self.args
+        key = self.key("quantize")
+        if not args.quantize:
+            return key, {}
+        table = self.outputs["train"]["table"]
+        stem = artifact_stem(table.path)
+        entry = None if force else self.cached("quantize", key, ["int8", "pq"])
+        if entry is None:
+            from quantize import export_quantized
+            self.rebuilding("quantize")
+            export_quantized(table.path, pq_dsub=args.pq_dsub)
+            entry = {"int8": stem + '_int8.npy', "pq": stem + '_pq_codes.npy'}
+            self.registry.update(self.outputs["train"]["artifact_id"], files=entry)
+            self.record("quantize", key, entry)
+        return key, entry
+
+    """
+    3. Plot your embedding if you like
+    """
+    def plot(self, force):
+        key = self.key("plot")
+        entry = None if force else self.cached("plot", key, ["html"])
+        if entry is None:
+            from plotter import plot_embedding
+            self.rebuilding("plot")
+            table = self.outputs["train"]["table"]
+            plot_embedding(self.args, self.outputs["graph"]["graph"], vectors=table)
+            entry = {"html": artifact_stem(table.path) + '.html'}
+            self.record("plot", key, entry)
+        return key, entry
+
+    """
+    4. Evaluate Node Classification & Node Clustering (and link prediction on the held-out edges)
+    """
+    def evaluate(self, force):
+        key = self.key("evaluate", [file_hash(LABELS)] if os.path.exists(LABELS) else [])
+        entry = None if force else self.cached("evaluate", key)
+        if entry is None:
+            from utils import evaluate as evaluate_embedding
+            from linkpred import link_prediction
+            self.rebuilding("evaluate")
+            graph, heldout = self.outputs["graph"]["graph"], self.outputs["graph"]["heldout"]
+            table = self.outputs["train"]["table"]
+            metrics = evaluate_embedding(self.args, graph, vectors=table)
+            if heldout is not None:
+                metrics.update({"linkpred_" + k: v for k, v in link_prediction(self.args, graph, heldout, table=table).items()})
+            entry = {"metrics": metrics}
+            self.record("evaluate", key, entry)
+        else:
+            print("\n### Evaluation cached:", entry["metrics"])
+        return key, entry
+
+    def needed(self, selected):
+        """Selected stages plus everything upstream of them."""
+        needed = set()
+        todo = list(selected)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo += STAGES[name][0]
+        return [name for name in ORDER if name in needed]
+
+    def run_stage(self, name, selected, force):
+        start = time.time()
+        key, outputs = getattr(self, name)(force and name in selected)
+        self.keys[name] = key
+        self.outputs[name] = outputs
+        print("### Stage {} done in {:.1f}s".format(name, time.time() - start))
+
+    def stage_inputs(self, name):
+        """Upstream outputs of a stage, picklable for a stage process (the embedding table goes as its path)."""
+        inputs = {u: self.outputs[u] for u in STAGES[name][0]}
+        if "train" in inputs:
+            inputs["train"] = dict(inputs["train"], table=inputs["train"]["table"].path)
+        return inputs
+
+    def run_concurrently(self, names, selected, force):
+        """Run independent stages in spawned processes (not forked: this process may hold torch threads)."""
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=len(names), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {name: pool.submit(run_stage_process, self.args, name, force and name in selected, self.selected,
+                                         self.keys, self.stage_inputs(name)) for name in names}
+            for name, future in futures.items():
+                key, outputs, records, log = future.result()
+                print(log, end="")
+                for record in records:
+                    self.record(*record)
+                self.keys[name] = key
+                self.outputs[name] = outputs
+                print("### Stage {} done in {:.1f}s".format(name, time.time() - start))
+
+    def run(self, only=None, start=None, force=False):
+        """
+        Run the stages picked by --only / --from, reusing cached upstream results.
+        Upstream stages without a cache entry are rebuilt (and say so). The last stages run concurrently.
+        """
+        selected = select_stages(only, start)
+        self.selected = selected
+        stages = self.needed(selected)
+        print("\n### Pipeline:", " -> ".join(stages))
+        last = [name for name in stages if not any(name in STAGES[other][0] for other in stages)]
+        for name in stages:
+            if name not in last or len(last) == 1:
+                self.run_stage(name, selected, force)
+        if len(last) > 1:
+            self.run_concurrently(last, selected, force)
+        return self.outputs
+
+
+def run_stage_process(args, name, force, selected, keys, inputs):
+    """
+    Body of a stage process: run one stage on the upstream outputs handed over by the parent.
+    :return cache key, outputs, records for pipeline.json, printed output of the stage
+    """
+    pipeline = Pipeline(args)
+    pipeline.deferred = []
+    pipeline.selected, pipeline.keys, pipeline.outputs = selected, keys, inputs
+    if "train" in inputs:
+        inputs["train"] = dict(inputs["train"], table=load_embedding(inputs["train"]["table"]))
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            key, outputs = getattr(pipeline, name)(force)
+    except Exception:
+        sys.stdout.write(log.getvalue())
+        raise
+    return key, outputs, pipeline.deferred, log.getvalue()
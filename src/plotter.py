@@ -1,23 +1,16 @@
-import random
-import time
-import pickle
 import numpy as np
-import pandas as pd
-import networkx as nx
 import seaborn as sns
 import itertools
-import operator
-import datetime
-import chart_studio.plotly as py
 import plotly.offline as offline
 import plotly.graph_objs as go
-from datetime import datetime
-from sklearn.manifold import TSNE
+from registry import resolve_embedding
+from embedding_store import load_embedding, artifact_stem
 
 # Embedding
-def plot_embedding(args, graph, mode=None):
+def plot_embedding(args, graph, mode=None, vectors=None):
     """
     Plot Embedding
+    :param vectors: Embedding table of the run, if it is already loaded.
     """
     print("\nPlot Embedding...")
     node2node_name={}
@@ -28,42 +21,34 @@ def plot_embedding(args, graph, mode=None):
         node2node_name[node] = node_name
         node_name2is_hub[node_name] = node_info['is_hub']
 
-    if args.idx_embed == 'Node2vec':
-        file = "{}{}-embedding_{}-deepwalk_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count)
-    else:
-        file = "{}{}-embedding_{}-metapath_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count-_{}-isCSP_{}-CSPcoef.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count, args.CSP_train, args.CSP_coef)
-
-    with open(file, "rb") as pickle_file:
-        vectors = pickle.load(pickle_file)
+    if vectors is None:
+        vectors = load_embedding(resolve_embedding(args))
+    file = vectors.path
     node_name2vec = {}
     for node in vectors:
         node_name = node2node_name[int(node)]
         node_name2vec[node_name] = vectors[node]
 
-    # TSNE
-    node_name2vec_tsne = load_TSNE(node_name2vec, dim=2)
-
     # SAVE
-    save_path = file
+    save_path = artifact_stem(file)
+
+    # TSNE (or a PCA / random projection preview), cached next to the embedding
+    node_name2vec_tsne = load_projection(node_name2vec, save_path, args)
     plot_category(node_name2vec, node_name2vec_tsne, save_path, node2node_name, node_name2is_hub, True)
 
     # For Binary Vectors
     if args.CSP_save:
-        file = file.replace('.pickle', '_CSPLayer.pickle')
-        with open(file, "rb") as pickle_file:
-            vectors = pickle.load(pickle_file)
+        vectors = vectors.csp_table()
         node_name2vec = {}
         for node in vectors:
             node_name = node2node_name[int(node)]
             node_name2vec[node_name] = vectors[node]
 
-        # TSNE
-        node_name2vec_tsne = load_TSNE(node_name2vec, dim=2)
-
         # SAVE
-        save_path = file
+        save_path = artifact_stem(file) + '_CSPLayer'
+
+        # TSNE
+        node_name2vec_tsne = load_projection(node_name2vec, save_path, args)
         plot_category(node_name2vec, node_name2vec_tsne, save_path, node2node_name, node_name2is_hub, True)
     return
 
@@ -148,20 +133,11 @@ def plot_category(node2vec, node2vec_tsne, path, node2name, node2is_hub, withLeg
 TSNE of Ingredient2Vec
 
 """
-def load_TSNE(ingr2vec, dim=2):
-    print("\nt-SNE Started... ")
-    time_start = time.time()
-
-    X = []
-    for x in ingr2vec:
-        X.append(ingr2vec[x])
-    tsne = TSNE(n_components=dim)
-    X_tsne = tsne.fit_transform(X)
-
-    print("t-SNE done!")
-    print("Time elapsed: {} seconds".format(time.time()-time_start))
-
-    return X_tsne
+def load_projection(ingr2vec, path, args, dim=2):
+    from projection import cached_projection
+    X = np.stack([ingr2vec[x] for x in ingr2vec])
+    return cached_projection(X, path, method=args.projection, dim=dim, pca_dim=args.pca_dim,
+                             perplexity=args.perplexity, seed=args.seed)
 
 
 """
@@ -218,6 +194,7 @@ def make_plot_only_labels(name, points, labels, publish):
 
     fig = go.Figure(data=traces, layout=layout)
     if publish:
+        import chart_studio.plotly as py
         plotter = py.iplot
     else:
         plotter = offline.plot
@@ -391,6 +368,7 @@ def make_plot_with_labels_legends(name, points, labels, label_to_plot, legend_la
     )
     fig = go.Figure(data=traces_ordered, layout=layout)
     if publish:
+        import chart_studio.plotly as py
         plotter = py.iplot
     else:
         plotter = offline.plot
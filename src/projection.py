@@ -0,0 +1,83 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+"""
+2-D projections of embedding matrices for plotting.
+    tsne    PCA pre-reduction, then FFT-accelerated t-SNE (openTSNE, if installed) or sklearn's
+            Barnes-Hut t-SNE, both on all cores
+    pca     the first principal components, a fast preview
+    random  Gaussian random projection, the fastest preview
+Results are cached as <prefix>_proj-<key>.npy, where the key hashes the input rows and the settings,
+so replotting an unchanged embedding does not recompute anything.
+"""
+METHODS = ("tsne", "pca", "random")
+
+
+def pca_reduce(X, dim):
+    """Project the centered rows on their top `dim` principal components (no-op if X is already that small)."""
+    X = X - X.mean(axis=0)
+    if X.shape[1] <= dim:
+        return X
+    # the rows are few enough (a few thousand nodes) for a thin SVD
+    _, s, vt = np.linalg.svd(X, full_matrices=False)
+    return X @ vt[:dim].T
+
+
+def tsne(X, dim=2, perplexity=30.0, seed=0, n_jobs=-1):
+    perplexity = min(perplexity, max(1.0, (len(X) - 1) / 3.0))
+    try:
+        from openTSNE import TSNE
+        return np.asarray(TSNE(n_components=dim, perplexity=perplexity, negative_gradient_method="fft",
+                               n_jobs=n_jobs, random_state=seed).fit(X))
+    except ImportError:
+        from sklearn.manifold import TSNE
+        return TSNE(n_components=dim, perplexity=perplexity, method="barnes_hut" if dim < 4 else "exact",
+                    init="pca", n_jobs=n_jobs, random_state=seed).fit_transform(X)
+
+
+def project(X, method="tsne", dim=2, pca_dim=50, perplexity=30.0, seed=0):
+    """
+    Project the rows of X to `dim` dimensions.
+    :param pca_dim: PCA dimensions kept before t-SNE (0: none).
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if method == "random":
+        rng = np.random.default_rng(seed)
+        return (X - X.mean(axis=0)) @ rng.standard_normal((X.shape[1], dim)).astype(np.float32) / np.sqrt(dim)
+    if method == "pca":
+        return pca_reduce(X, dim)[:, :dim]
+    if method == "tsne":
+        if pca_dim:
+            X = pca_reduce(X, pca_dim)
+        return tsne(X, dim=dim, perplexity=perplexity, seed=seed)
+    raise ValueError("Unknown projection method {}, expected one of {}".format(method, ", ".join(METHODS)))
+
+
+def projection_key(X, **settings):
+    digest = hashlib.sha1(np.ascontiguousarray(X, dtype=np.float32).tobytes())
+    digest.update(repr(sorted(settings.items())).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def cached_projection(X, prefix, method="tsne", dim=2, pca_dim=50, perplexity=30.0, seed=0):
+    """project(), reusing <prefix>_proj-<key>.npy when the same rows were projected with the same settings."""
+    X = np.asarray(X, dtype=np.float32)
+    key = projection_key(X, method=method, dim=dim, pca_dim=pca_dim, perplexity=perplexity, seed=seed)
+    path = "{}_proj-{}.npy".format(prefix, key)
+    if os.path.exists(path):
+        print("Projection loaded from cache", path)
+        return np.load(path)
+
+    print("\n{} projection started... ".format(method))
+    time_start = time.time()
+    points = project(X, method=method, dim=dim, pca_dim=pca_dim, perplexity=perplexity, seed=seed)
+    print("{} projection done!".format(method))
+    print("Time elapsed: {} seconds".format(time.time() - time_start))
+
+    tmp = "{}.tmp-{}.npy".format(path[:-len(".npy")], os.getpid())
+    np.save(tmp, points)
+    os.replace(tmp, path)
+    return points
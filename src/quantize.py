@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from texttable import Texttable
+
+from embedding_store import load_embedding, artifact_stem, index_path
+
+"""
+Compressed copies of an embedding artifact for low-memory serving.
+Rows are L2-normalized first, so every score below is a cosine similarity.
+    <stem>_int8.npy / <stem>_int8_scale.npy        int8 codes with one scale per dimension
+    <stem>_pq_codes.npy / <stem>_pq_codebooks.npy  product quantization, uint8 code per subspace
+"""
+BLOCK_ROWS = 65536
+
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+
+
+def kmeans(X, k, iterations=20, seed=0):
+    """
+    Plain Lloyd k-means (squared euclidean), initialized from k random rows.
+    :return centroids, assignment
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(X))
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+    x_sq = np.sum(X ** 2, axis=1, keepdims=True)
+    for _ in range(iterations):
+        distances = x_sq - 2 * X @ centroids.T + np.sum(centroids ** 2, axis=1)
+        assignment = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, X)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # reseed empty clusters with random rows
+        centroids[empty] = X[rng.choice(len(X), int(empty.sum()))]
+    distances = x_sq - 2 * X @ centroids.T + np.sum(centroids ** 2, axis=1)
+    return centroids, np.argmin(distances, axis=1)
+
+
+class Int8Codes:
+    """Per-dimension scaled int8 codes; q . x is approximated by (q * scale) . codes."""
+    def __init__(self, codes, scale):
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, X):
+        X = normalize_rows(X)
+        scale = np.maximum(np.abs(X).max(axis=0), 1e-12) / 127.0
+        codes = np.clip(np.round(X / scale), -127, 127).astype(np.int8)
+        return cls(codes, scale.astype(np.float32))
+
+    def scores(self, queries):
+        queries = normalize_rows(np.atleast_2d(queries)) * self.scale
+        out = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_ROWS):
+            block = np.asarray(self.codes[start:start + BLOCK_ROWS], dtype=np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+
+class PQCodes:
+    """
+    Product quantization: the (zero padded) dimensions are split into m subspaces with 256
+    centroids each. Queries are scored asymmetrically through a (m x 256) lookup table.
+    """
+    def __init__(self, codes, codebooks):
+        self.codes = codes
+        self.codebooks = codebooks
+
+    @classmethod
+    def fit(cls, X, m, iterations=20, seed=0, normalize=True):
+        """:param normalize: False for vectors that are not embeddings, e.g. IVF residuals."""
+        X = cls.split(normalize_rows(X) if normalize else np.asarray(X, dtype=np.float32), m)
+        codebooks, codes = [], []
+        for sub in range(m):
+            centroids, assignment = kmeans(X[:, sub], 256, iterations=iterations, seed=seed + sub)
+            padded = np.zeros((256, X.shape[2]), dtype=np.float32)
+            padded[:len(centroids)] = centroids
+            codebooks.append(padded)
+            codes.append(assignment.astype(np.uint8))
+        return cls(np.stack(codes, axis=1), np.stack(codebooks))
+
+    @staticmethod
+    def split(X, m):
+        dsub = -(-X.shape[1] // m)
+        padded = np.zeros((len(X), m * dsub), dtype=np.float32)
+        padded[:, :X.shape[1]] = X
+        return padded.reshape(len(X), m, dsub)
+
+    def encode(self, X):
+        """Codes of new rows (not normalized here) against the existing codebooks, in blocks of rows."""
+        m, _, dsub = self.codebooks.shape
+        codes = np.empty((len(X), m), dtype=np.uint8)
+        c_sq = np.sum(self.codebooks ** 2, axis=2)
+        for start in range(0, len(X), BLOCK_ROWS):
+            block = self.split(np.asarray(X[start:start + BLOCK_ROWS], dtype=np.float32), m)
+            for sub in range(m):
+                distances = c_sq[sub] - 2 * block[:, sub] @ self.codebooks[sub].T
+                codes[start:start + len(block), sub] = np.argmin(distances, axis=1)
+        return codes
+
+    def lookup_table(self, queries):
+        """lut[q, sub, c] = query subvector . centroid c of subspace sub, for already normalized queries."""
+        queries = self.split(np.atleast_2d(queries), self.codebooks.shape[0])
+        return np.einsum('qsd,scd->qsc', queries, self.codebooks)
+
+    def scores(self, queries):
+        m = self.codebooks.shape[0]
+        lut = self.lookup_table(normalize_rows(np.atleast_2d(queries)))
+        out = np.zeros((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_ROWS):
+            block = np.asarray(self.codes[start:start + BLOCK_ROWS], dtype=np.intp)
+            for sub in range(m):
+                out[:, start:start + len(block)] += lut[:, sub, block[:, sub]]
+        return out
+
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+
+def recall_at_k(exact, approx, k):
+    """Mean fraction of the exact top-k (by score row) found in the approximate top-k."""
+    k = min(k, exact.shape[1])
+    top_exact = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+    top_approx = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+    hits = [len(np.intersect1d(a, b)) for a, b in zip(top_exact, top_approx)]
+    return float(np.mean(hits)) / k
+
+
+def save_quantized(stem, int8, pq):
+    np.save(stem + '_int8.npy', int8.codes)
+    np.save(stem + '_int8_scale.npy', int8.scale)
+    np.save(stem + '_pq_codes.npy', pq.codes)
+    np.save(stem + '_pq_codebooks.npy', pq.codebooks)
+
+
+def load_quantized(path, kind="int8", mmap=True):
+    """Open the int8 or PQ codes stored next to an embedding artifact."""
+    stem = artifact_stem(path)
+    mmap_mode = 'r' if mmap else None
+    if kind == "int8":
+        return Int8Codes(np.load(stem + '_int8.npy', mmap_mode=mmap_mode), np.load(stem + '_int8_scale.npy'))
+    return PQCodes(np.load(stem + '_pq_codes.npy', mmap_mode=mmap_mode), np.load(stem + '_pq_codebooks.npy'))
+
+
+def quantize_matrix(stem, X, pq_dsub=4, k=10, num_queries=1000, seed=0):
+    """Fit, save and report both codes for one matrix; returns the report rows."""
+    X = np.asarray(X, dtype=np.float32)
+    m = -(-X.shape[1] // pq_dsub)
+    int8 = Int8Codes.fit(X)
+    pq = PQCodes.fit(X, m, seed=seed)
+    save_quantized(stem, int8, pq)
+
+    rng = np.random.default_rng(seed)
+    queries = X[rng.choice(len(X), min(num_queries, len(X)), replace=False)]
+    exact = normalize_rows(queries) @ normalize_rows(X).T
+    report = [{"codes": "float32", "bytes": int(X.shape[0] * X.shape[1] * 4), "recall@{}".format(k): 1.0}]
+    for name, codes in (("int8", int8), ("pq{}x8".format(m), pq)):
+        start = time.time()
+        approx = codes.scores(queries)
+        report.append({"codes": name, "bytes": int(codes.nbytes()), "recall@{}".format(k): recall_at_k(exact, approx, k),
+                       "query_ms": 1000.0 * (time.time() - start) / len(queries)})
+    return report
+
+
+def export_quantized(path, pq_dsub=4, k=10):
+    """
+    Export int8 and PQ codes for an embedding artifact (and its CSP projection if present),
+    record them in the artifact index and print recall@k against the float matrix.
+    """
+    print("\nQuantizing embeddings...", path)
+    table = load_embedding(path)
+    stem = artifact_stem(path)
+    reports = {"embedding": quantize_matrix(stem, table.matrix, pq_dsub=pq_dsub, k=k)}
+    if table.csp is not None:
+        reports["CSP"] = quantize_matrix(stem + '_CSPLayer', table.csp, pq_dsub=pq_dsub, k=k)
+
+    if os.path.exists(index_path(stem)):
+        with open(index_path(stem)) as f:
+            index = json.load(f)
+        index["quantized"] = reports
+        tmp = "{}.tmp-{}".format(index_path(stem), os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, index_path(stem))
+
+    for name, report in reports.items():
+        t = Texttable()
+        t.add_rows([["Codes ({})".format(name), "Bytes", "Recall@{}".format(k)]] +
+                   [[r["codes"], r["bytes"], "%.3f" % r["recall@{}".format(k)]] for r in report])
+        print(t.draw())
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export int8 / PQ codes of an embedding artifact")
+    parser.add_argument('--emb', required=True, type=str, help="embedding artifact (.npy, .index.json or legacy .pickle)")
+    parser.add_argument('--pq_dsub', default=4, type=int, help="dimensions per PQ subspace")
+    parser.add_argument('--k', default=10, type=int, help="k for the recall@k report")
+    args = parser.parse_args()
+    export_quantized(args.emb, pq_dsub=args.pq_dsub, k=args.k)
@@ -0,0 +1,156 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+"""
+Artifact registry: one manifest (output/registry.json) listing every published artifact with
+its hyperparameters, corpus hash, metrics and files. Artifacts are keyed by a hash of their
+parameters, so lookups by id, tag or parameter set are dict lookups instead of directory scans
+and filename templates. Publishing takes an exclusive lock and replaces the manifest atomically.
+"""
+MANIFEST = "registry.json"
+
+# parameters that define an embedding run; anything else (paths, workers, prefetch...) does not change the result
+EMBEDDING_PARAMS = ["idx_embed", "idx_metapath", "which_metapath", "num_walks", "len_metapath", "number_of_walks", "walk_length",
+                    "dim", "window_size", "iterations", "batch_size", "initial_lr", "min_count", "care_type",
+                    "CSP_train", "CSP_coef", "precision", "table_dtype", "device_sampling", "holdout_ratio", "seed"]
+
+
+def embedding_params(args):
+    params = {k: getattr(args, k) for k in EMBEDDING_PARAMS if hasattr(args, k)}
+    # walk parameters of the walker that is not used do not matter
+    if params.get("idx_embed") == "Node2vec":
+        for k in ("which_metapath", "num_walks", "len_metapath", "CSP_train", "CSP_coef"):
+            params.pop(k, None)
+    else:
+        params.pop("number_of_walks", None)
+        params.pop("walk_length", None)
+    if not params.get("holdout_ratio"):
+        params.pop("holdout_ratio", None)
+    return params
+
+
+def params_key(params, kind="embedding"):
+    blob = json.dumps([kind, params], sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Registry(object):
+    def __init__(self, root="./output/"):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST)
+        self.manifest = {"artifacts": {}, "tags": {}}
+        self.mtime = None
+
+    def load(self):
+        """(Re)read the manifest if it changed on disk."""
+        if not os.path.exists(self.path):
+            return self.manifest
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+            self.mtime = mtime
+        return self.manifest
+
+    @contextmanager
+    def locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.mtime = None
+                yield self.load()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def write(self, manifest):
+        tmp = "{}.tmp-{}".format(self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.manifest = manifest
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+    def artifact_id(self, params, kind="embedding"):
+        return params_key(params, kind)
+
+    def artifact_path(self, params, kind="embedding", prefix=None, ext=".npy"):
+        """Where the files of a new artifact go: <root>/<prefix>-<id><ext>."""
+        return os.path.join(self.root, "{}-{}{}".format(prefix or kind, self.artifact_id(params, kind), ext))
+
+    def publish(self, params, files, kind="embedding", corpus_hash=None, metrics=None, tags=()):
+        """
+        Register an artifact whose files are already written; re-publishing the same parameters replaces the entry.
+        Every artifact is also tagged 'latest' (per kind) and 'latest-<kind>'.
+        """
+        artifact_id = self.artifact_id(params, kind)
+        with self.locked() as manifest:
+            previous = manifest["artifacts"].get(artifact_id, {})
+            manifest["artifacts"][artifact_id] = {
+                "id": artifact_id,
+                "kind": kind,
+                "params": params,
+                "files": {k: os.path.relpath(v, self.root) for k, v in files.items()},
+                "corpus_hash": corpus_hash,
+                "metrics": dict(previous.get("metrics", {}), **(metrics or {})),
+                "created": time.time(),
+            }
+            for tag in list(tags) + ["latest-" + kind] + (["latest"] if kind == "embedding" else []):
+                manifest["tags"][tag] = artifact_id
+            self.write(manifest)
+        return artifact_id
+
+    def update(self, artifact_id, metrics=None, files=None):
+        """
+        Merge metrics or extra files (quantized codes, projections...) into an entry.
+        :return False, with a message, if the artifact is not registered (e.g. evaluated from an explicit path)
+        """
+        with self.locked() as manifest:
+            entry = manifest["artifacts"].get(artifact_id)
+            if entry is None:
+                print("### Artifact {} is not in the registry {}, not recording {}".format(
+                    artifact_id, self.path, ", ".join(sorted(list(metrics or {}) + list(files or {})))))
+                return False
+            entry["metrics"].update(metrics or {})
+            entry["files"].update({k: os.path.relpath(v, self.root) for k, v in (files or {}).items()})
+            self.write(manifest)
+        return True
+
+    def get(self, ref=None, params=None, kind="embedding"):
+        """Entry for an artifact id, a tag or a parameter set; None if unknown."""
+        manifest = self.load()
+        if params is not None:
+            ref = self.artifact_id(params, kind)
+        ref = manifest["tags"].get(ref, ref)
+        return manifest["artifacts"].get(ref)
+
+    def file(self, entry, name="embedding"):
+        return os.path.join(self.root, entry["files"][name])
+
+    def resolve(self, ref=None, params=None, kind="embedding", name="embedding"):
+        """
+        Path of an artifact file. `ref` may be an id, a tag, or a path that exists on disk.
+        """
+        if ref is not None and params is None and os.path.exists(ref):
+            return ref
+        entry = self.get(ref, params=params, kind=kind)
+        if entry is None:
+            raise FileNotFoundError("No {} artifact registered for {}".format(kind, ref if params is None else params))
+        return self.file(entry, name)
+
+
+def resolve_embedding(args):
+    """Embedding artifact of the run described by the command line parameters."""
+    return Registry(args.output_path).resolve(params=embedding_params(args))
@@ -0,0 +1,99 @@
+import numpy as np
+import torch
+
+
+def alias_table(probs):
+    """
+    Walker/Vose alias table for a discrete distribution.
+    :param probs: Probabilities, summing to one.
+    :return accept, alias: Column i is kept with probability accept[i], otherwise alias[i] is taken.
+    """
+    n = len(probs)
+    scaled = np.asarray(probs, dtype=np.float64) * n
+    accept = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        accept[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = scaled[l] + scaled[s] - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return accept, alias
+
+
+class TypedAliasTable:
+    """
+    One alias table per node type, concatenated into flat arrays so that a batch of
+    negatives for context nodes of mixed types is drawn with a handful of vectorized ops.
+    With a single type this is the plain unigram^0.75 sampler.
+    :param probs: Sampling probability of every word id.
+    :param types: Type index of every word id.
+    """
+    def __init__(self, probs, types):
+        probs = np.asarray(probs, dtype=np.float64)
+        types = np.asarray(types, dtype=np.int64)
+        num_types = int(types.max()) + 1 if len(types) else 0
+        self.members = np.argsort(types, kind="stable")
+        self.sizes = np.bincount(types, minlength=num_types).astype(np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)[:-1])).astype(np.int64)
+        self.accept = np.ones(len(probs), dtype=np.float64)
+        self.alias = np.arange(len(probs), dtype=np.int64)
+        for t in range(num_types):
+            start, size = self.offsets[t], self.sizes[t]
+            if size == 0:
+                continue
+            p = probs[self.members[start:start + size]]
+            accept, alias = alias_table(p / p.sum())
+            self.accept[start:start + size] = accept
+            self.alias[start:start + size] = start + alias
+
+    def sample(self, types, size, rng):
+        """Draw `size` word ids of the given type(s) each; returns shape types.shape + (size,)."""
+        types = np.asarray(types)
+        shape = types.shape + (size,)
+        slots = self.offsets[types][..., None] + (rng.random(shape) * self.sizes[types][..., None]).astype(np.int64)
+        slots = np.where(rng.random(shape) < self.accept[slots], slots, self.alias[slots])
+        return self.members[slots]
+
+
+class NegativeSampler:
+    """
+    Draws the negatives of a whole batch on the training device, so the data workers only have to
+    ship (u, v) ids. Subsampling stays in the workers: it discards word occurrences before the
+    windows are built, which cannot be done per pair.
+    Negatives come from the unigram^0.75 distribution of DataReader through an alias table:
+    one uniform column and one coin flip per negative. With care_type 1 they are drawn from
+    the table of the context node's type.
+    """
+    def __init__(self, data, device, seed=0):
+        self.device = device
+        table = data.typed_table if data.care_type == 1 else TypedAliasTable(data.sampling_prob, np.zeros(len(data.sampling_prob)))
+        self.members = torch.tensor(table.members, dtype=torch.long, device=device)
+        self.sizes = torch.tensor(table.sizes, dtype=torch.long, device=device)
+        self.offsets = torch.tensor(table.offsets, dtype=torch.long, device=device)
+        self.accept = torch.tensor(table.accept, dtype=torch.float32, device=device)
+        self.alias = torch.tensor(table.alias, dtype=torch.long, device=device)
+        self.types = torch.tensor(data.types, dtype=torch.long, device=device) if data.care_type == 1 else None
+        self.generator = torch.Generator(device=device)
+        self.generator.manual_seed(seed)
+
+    def negatives(self, pos_v, size):
+        types = self.types[pos_v] if self.types is not None else torch.zeros_like(pos_v)
+        draws = torch.rand((2, pos_v.shape[0], size), generator=self.generator, device=self.device)
+        slots = self.offsets[types].unsqueeze(1) + (draws[0] * self.sizes[types].unsqueeze(1)).long()
+        slots = torch.where(draws[1] < self.accept[slots], slots, self.alias[slots])
+        return self.members[slots]
+
+    def sample(self, pos_u, pos_v, size=5):
+        return pos_u, pos_v, self.negatives(pos_v, size)
+
+    def state_dict(self):
+        return {"generator": self.generator.get_state()}
+
+    def load_state_dict(self, state):
+        self.generator.set_state(state["generator"])
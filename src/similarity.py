@@ -0,0 +1,125 @@
+import csv
+
+import numpy as np
+
+from embedding_store import load_embedding
+
+"""
+Exact cosine top-k search over an embedding artifact.
+The matrix is L2-normalized once; node types and hub status are kept as boolean masks over its rows.
+A batch of queries is answered with one matrix product per block of queries and an argpartition,
+so only the k best columns of every row are ever sorted.
+
+    index = SimilarityIndex.from_files(emb_path, "input/nodes_191120.csv")
+    index.most_similar([lemon, ginger], k=10, types=["ingredient"])
+    index.combine([lemon, ginger], negative=[sugar], k=10, types=["ingredient"])
+"""
+
+
+def node_attributes(nodes_csv):
+    """{node id: (name, node type, is_hub)} read from the nodes csv."""
+    attributes = {}
+    with open(nodes_csv, newline='') as f:
+        for r in csv.DictReader(f):
+            attributes[r["node_id"]] = (r["name"], r["node_type"], r["is_hub"])
+    return attributes
+
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    return X / (np.linalg.norm(X, axis=-1, keepdims=True) + 1e-12)
+
+
+class SimilarityIndex(object):
+    """
+    :param table: EmbeddingTable (or anything with .ids and .as_matrix()).
+    :param attributes: {node id: (name, type, is_hub)}, used for the type / hub filters and names.
+    :param block_bytes: Size of the query x node score block computed at once.
+    """
+    def __init__(self, table, attributes=None, block_bytes=256 << 20):
+        self.ids = list(table.ids)
+        self.row = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.matrix = normalize_rows(table.as_matrix())
+        self.attributes = attributes or {}
+        self.block_bytes = block_bytes
+
+        self.names = np.array([self.attributes.get(i, (None,))[0] for i in self.ids], dtype=object)
+        types = np.array([self.attributes.get(i, (None, None, None))[1] for i in self.ids], dtype=object)
+        hubs = np.array([self.attributes.get(i, (None, None, None))[2] for i in self.ids], dtype=object)
+        self.type_masks = {t: types == t for t in set(types.tolist()) if t is not None}
+        self.hub_masks = {h: hubs == h for h in set(hubs.tolist()) if h is not None}
+
+    @classmethod
+    def from_files(cls, embedding_path, nodes_csv=None, **kwargs):
+        return cls(load_embedding(embedding_path), node_attributes(nodes_csv) if nodes_csv else None, **kwargs)
+
+    def __contains__(self, node_id):
+        return str(node_id) in self.row
+
+    def rows(self, node_ids):
+        return np.array([self.row[str(i)] for i in node_ids], dtype=np.int64)
+
+    def mask(self, types=None, hubs=None, exclude=()):
+        """Rows allowed as results: any of `types`, any of `hubs` (None: no filter), minus the `exclude` ids."""
+        allowed = np.ones(len(self.ids), dtype=bool)
+        if types is not None:
+            allowed &= np.any([self.type_masks.get(t, np.zeros_like(allowed)) for t in types], axis=0)
+        if hubs is not None:
+            allowed &= np.any([self.hub_masks.get(h, np.zeros_like(allowed)) for h in hubs], axis=0)
+        excluded = [self.row[str(i)] for i in exclude if str(i) in self.row]
+        allowed[excluded] = False
+        return allowed
+
+    def search(self, queries, k=10, allowed=None, exclude_rows=None):
+        """
+        Top-k rows for every query vector.
+        :param queries: (q, d) array, normalized here.
+        :param allowed: Boolean mask over the rows shared by all queries.
+        :param exclude_rows: Optional list with, per query, rows to leave out of that query's results.
+        :return (q, k) row indices and scores, best first; -1 / -inf where fewer than k rows are allowed.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        n = len(self.ids)
+        k = min(k, n)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        block = max(1, self.block_bytes // (4 * n))
+        for start in range(0, len(queries), block):
+            sims = queries[start:start + block] @ self.matrix.T
+            if allowed is not None:
+                sims[:, ~allowed] = -np.inf
+            if exclude_rows is not None:
+                for i, rows in enumerate(exclude_rows[start:start + block]):
+                    sims[i, rows] = -np.inf
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top, top_scores = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+            found = np.isfinite(top_scores)
+            ids[start:start + block] = np.where(found, top, -1)
+            scores[start:start + block] = top_scores
+        return ids, scores
+
+    def results(self, rows, scores):
+        return [[(self.ids[r], self.names[r], float(s)) for r, s in zip(row_ids, row_scores) if r >= 0]
+                for row_ids, row_scores in zip(rows, scores)]
+
+    def most_similar(self, node_ids, k=10, types=None, hubs=None, exclude=()):
+        """
+        Nearest neighbours of every node in `node_ids` (the node itself is left out).
+        :return per query, a list of (node id, name, cosine similarity), best first.
+        """
+        rows = self.rows(node_ids)
+        found, scores = self.search(self.matrix[rows], k, self.mask(types, hubs, exclude), exclude_rows=[[r] for r in rows])
+        return self.results(found, scores)
+
+    def combine(self, positive, negative=(), k=10, types=None, hubs=None, exclude=()):
+        """
+        Nodes closest to sum(positive) - sum(negative) of the normalized vectors, e.g. lemon + ginger - sugar.
+        The query nodes themselves are left out.
+        """
+        query = self.matrix[self.rows(positive)].sum(axis=0)
+        if len(negative):
+            query = query - self.matrix[self.rows(negative)].sum(axis=0)
+        found, scores = self.search(query, k, self.mask(types, hubs, list(exclude) + list(positive) + list(negative)))
+        return self.results(found, scores)[0]
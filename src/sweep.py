@@ -0,0 +1,189 @@
+import argparse
+import copy
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+
+from parser import parameter_parser
+from utils import graph_reader
+from graph2vec import Metapath2Vec, Node2Vec, build_data
+from walkers import walk_file_name
+from linkpred import split_ingredient_edges, link_prediction
+from embedding_store import index_path
+from evaluate_runner import category_labels, init_worker, evaluate_artifact, row_metrics, write_leaderboard
+from registry import Registry, embedding_params, file_hash
+
+"""
+Hyperparameter sweep over the skip-gram parameters.
+Trials are grouped by what they share upstream (graph split, walk file, vocabulary and negative
+table); each group is built once in this process and its trials are trained in forked worker
+processes that inherit it copy-on-write. Every trial is published and scored in the registry, and
+trials whose parameters are already registered with metrics are skipped, so a sweep can be re-run.
+
+    python3 src/sweep.py --space dim=128,300 window_size=3,5 CSP_coef=0.0001,0.001 -- --iterations 5
+    python3 src/sweep.py --space dim=64,128,300 window_size=2,3,5,7 --random 6 --threads_per_trial 4 -- --CSP_train
+Arguments after `--` are the usual main.py parameters shared by every trial.
+"""
+
+# (graph, data, heldout) of the group being trained, inherited by the forked workers
+_SHARED = None
+
+
+def parse_space(items, base):
+    """name=v1,v2,... items to {name: [values]}, values converted to the type of the main.py default."""
+    space = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        if not hasattr(base, name):
+            raise ValueError("Unknown parameter in --space: {}".format(name))
+        default = getattr(base, name)
+        if isinstance(default, bool):
+            convert = lambda v: v.lower() in ("1", "true", "yes")
+        elif default is None:
+            convert = str
+        else:
+            convert = type(default)
+        space[name] = [convert(v) for v in values.split(",")]
+    return space
+
+
+def make_trials(space, random=0, seed=0):
+    """Full grid, or `random` distinct points drawn from it."""
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[n] for n in names])]
+    if random and random < len(grid):
+        rng = np.random.default_rng(seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), random, replace=False))]
+    return grid
+
+
+def shared_key(args):
+    """Trials with the same key read the same walks into the same DataReader."""
+    return (walk_file_name(args), args.min_count, args.care_type, args.seed, args.device_sampling, args.holdout_ratio)
+
+
+def trial_bytes(data, args):
+    """Rough resident size of one trial: two tables with two Adam moments each, the CSP encoder, and slack for the loader."""
+    tables = 2 * len(data.word2id) * args.dim * 4 * 3
+    encoder = args.dim * 881 * 4 * 3 if args.CSP_train else 0
+    return tables + encoder + (256 << 20)
+
+
+def available_bytes():
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return None
+
+
+def run_trial(args, threads, n_init):
+    """Train, evaluate and record one trial in a forked worker."""
+    graph, data, heldout = _SHARED
+    torch.set_num_threads(threads)
+    torch.manual_seed(args.seed)
+    start = time.time()
+    trainer = Node2Vec(args, graph, data=data) if args.idx_embed == 'Node2vec' else Metapath2Vec(args, graph, data=data)
+    trainer.train()
+    train_s = time.time() - start
+
+    if heldout is not None:
+        link_prediction(args, graph, heldout)
+    row = evaluate_artifact(trainer.artifact_id, index_path(trainer.output_file_name), n_init=n_init)
+    trainer.registry.update(trainer.artifact_id, metrics=row_metrics(row))
+    row["train_s"] = train_s
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid / random search over skip-gram parameters with shared walks")
+    parser.add_argument('--space', nargs='+', required=True, help="name=v1,v2,... for every swept main.py parameter")
+    parser.add_argument('--random', default=0, type=int, help="sample this many grid points instead of the full grid")
+    parser.add_argument('--cores', default=os.cpu_count() or 1, type=int, help="cores the sweep may use")
+    parser.add_argument('--threads_per_trial', default=2, type=int, help="torch threads (and at most as many loader workers) per trial")
+    parser.add_argument('--mem_gb', default=None, type=float, help="memory budget for concurrent trials (default: currently available memory)")
+    parser.add_argument('--labels', default="./input/node_classification_hub.csv", type=str, help="category csv for the clustering score")
+    parser.add_argument('--n_init', default=100, type=int, help="k-means restarts per trial")
+    parser.add_argument('--sort', default="nmi", type=str, help="leaderboard metric")
+    parser.add_argument('--force', action='store_true', help="re-run trials that are already registered")
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    sweep_args = parser.parse_args(argv[:split])
+    base = parameter_parser(argv[split + 1:])
+
+    space = parse_space(sweep_args.space, base)
+    os.makedirs(base.output_path, exist_ok=True)
+    registry = Registry(base.output_path)
+    trials = []
+    for overrides in make_trials(space, sweep_args.random, base.seed):
+        args = copy.copy(base)
+        for name, value in overrides.items():
+            setattr(args, name, value)
+        args.num_workers = min(args.num_workers, sweep_args.threads_per_trial)
+        entry = registry.get(params=embedding_params(args))
+        if entry is not None and "nmi" in entry["metrics"] and not sweep_args.force:
+            print("Skipping trial {}, already registered as {}".format(overrides, entry["id"]))
+            continue
+        trials.append((overrides, args))
+
+    groups = {}
+    for overrides, args in trials:
+        groups.setdefault(shared_key(args), []).append((overrides, args))
+    print("\n{} trials in {} groups of shared walks".format(len(trials), len(groups)))
+    if not trials:
+        return
+
+    global _SHARED
+    full_graph, _ = graph_reader(base.input_nodes, base.input_edges)
+    labels = category_labels(full_graph, sweep_args.labels)
+    # inherited by the forked trial workers, like the group state below
+    init_worker(labels)
+    budget = sweep_args.mem_gb * (1 << 30) if sweep_args.mem_gb else available_bytes()
+    context = multiprocessing.get_context("fork")
+
+    rows = []
+    start = time.time()
+    for key, group in groups.items():
+        first = group[0][1]
+        graph, heldout = full_graph, None
+        if first.holdout_ratio > 0:
+            graph = full_graph.copy()
+            heldout = split_ingredient_edges(graph, first.holdout_ratio, seed=first.seed)
+        tick = time.time()
+        data = build_data(first, graph)
+        data.corpus_hash = file_hash(data.inputFileName)
+        print("### Shared walks and vocabulary built in {:.1f}s for {} trials".format(time.time() - tick, len(group)))
+
+        workers = max(1, min(len(group), sweep_args.cores // sweep_args.threads_per_trial))
+        if budget:
+            workers = max(1, min(workers, int(budget // max(trial_bytes(data, args) for _, args in group))))
+        print("### Running {} trials with {} workers".format(len(group), workers))
+
+        _SHARED = (graph, data, heldout)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(run_trial, args, sweep_args.threads_per_trial, sweep_args.n_init): overrides
+                       for overrides, args in group}
+            for future in as_completed(futures):
+                overrides = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    print("Trial {} failed: {}".format(overrides, e))
+                    continue
+                row.update(overrides)
+                print("Trial {}: nmi {:.4f}, trained in {:.1f}s".format(overrides, row["nmi"], row["train_s"]))
+                rows.append(row)
+        _SHARED = None
+    print("\nSweep finished in {:.1f}s".format(time.time() - start))
+
+    if rows:
+        write_leaderboard(rows, os.path.join(base.output_path, "sweep"), sweep_args.sort)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ import pickle
 import networkx as nx
 from tqdm import tqdm, trange
 from texttable import Texttable
+from registry import Registry, resolve_embedding, embedding_params
+from embedding_store import load_embedding
 
 def graph_reader(input_nodes, input_edges):
     """
@@ -46,10 +48,19 @@ def graph_reader(input_nodes, input_edges):
 
     return graph, graph_ingr_only
 
-def evaluate(args, graph):
+def node_type_keys(graph):
+    """
+    Type key of every node, keyed by the node id as written in the walk files.
+    Ingredients are split by hub status and compounds by food/drug-likeness, e.g. 'ingredient+hub', 'compound+drug'.
+    """
+    return {str(node): "{}+{}".format(info['type'], info['is_hub']) for node, info in graph.nodes(data=True)}
+
+def evaluate(args, graph, vectors=None):
     """
     Downstream Applications
     Evaluation
+    :param vectors: Embedding table of the run, if it is already loaded.
+    :return clustering metrics (also recorded in the registry when the run is registered)
     """
     print("\nEvaluation...")
 
@@ -66,15 +77,8 @@ def evaluate(args, graph):
     df = pd.read_csv(csv)
     categories = df.columns
 
-    if args.idx_embed == 'Node2vec':
-        file = "{}{}-embedding_{}-deepwalk_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count)
-    else:
-        file = "{}{}-embedding_{}-metapath_{}-dim_{}-initial_lr_{}-window_size_{}-iterations_{}-min_count-_{}-isCSP_{}-CSPcoef.pickle".format(
-                            args.output_path, args.idx_embed, args.idx_metapath, args.dim, args.initial_lr, args.window_size, args.iterations, args.min_count, args.CSP_train, args.CSP_coef)
-
-    with open(file, "rb") as pickle_file:
-        vectors = pickle.load(pickle_file)
+    if vectors is None:
+        vectors = load_embedding(resolve_embedding(args))
 
     node_name2vec={}
     for node in vectors:
@@ -94,21 +98,16 @@ def evaluate(args, graph):
                 print(name)
 
 
-    nmis = []
-    train_ratios = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
-    for ratio in train_ratios:
-        nmi = train(X, y, ratio)
-        print(nmi)
-        nmis.append(nmi)
-    print(np.mean(nmis))
-    print(np.std(nmis))
+    nmi, nmi_mean, nmi_std = cluster_nmi(X, y)
+    print("nmi: %f" % nmi)
+    print("nmi mean over restarts: %f" % nmi_mean)
+    print("nmi std over restarts: %f" % nmi_std)
+    metrics = {"nmi": nmi, "nmi_mean": nmi_mean, "nmi_std": nmi_std}
         
 
     # For Binary Vectors
     if args.CSP_save:
-        file = file.replace('.pickle', '_CSPLayer.pickle')
-        with open(file, "rb") as pickle_file:
-            vectors = pickle.load(pickle_file)
+        vectors = vectors.csp_table()
         node_name2vec={}
         for node in vectors:
             node_name = node2node_name[int(node)]
@@ -122,63 +121,29 @@ def evaluate(args, graph):
                 X.append(vec)
                 y.append(category)
 
-        train_ratios = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
-        nmis = []
-        for ratio in train_ratios:
-            nmi = train(X, y, ratio)
-            print(nmi)
-            nmis.append(nmi)
-        print("nmi mean: %f" % (np.mean(nmis)))
-        print("nmi std: %f" % (np.std(nmis)))
-        
-    return
-
-def train(X, y, train_ratio):
-    from sklearn.cluster import KMeans
-    from sklearn.linear_model import LogisticRegression
-    from sklearn import svm
-    from sklearn.metrics import precision_score, recall_score, f1_score
-    from sklearn.metrics import accuracy_score
-    from sklearn.model_selection import train_test_split
+        nmi, nmi_mean, nmi_std = cluster_nmi(X, y)
+        print("csp nmi: %f" % nmi)
+        print("csp nmi mean over restarts: %f" % nmi_mean)
+        print("csp nmi std over restarts: %f" % nmi_std)
+        metrics.update({"csp_nmi": nmi, "csp_nmi_mean": nmi_mean, "csp_nmi_std": nmi_std})
 
-    test_ratio = 1-train_ratio
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_ratio, random_state=36)
+    registry = Registry(args.output_path)
+    registry.update(registry.artifact_id(embedding_params(args)), metrics=metrics)
+    return metrics
 
+def cluster_nmi(X, y, num_clusters=8, n_init=100, n_jobs=None):
     """
-    Classification
+    Node clustering: spherical k-means with n_init restarts (best objective kept, as nltk's
+    KMeansClusterer did) scored by NMI against the category labels.
+    :param n_jobs: Worker processes for the restarts (default: all cores, spawned; 1 runs in process).
+    :return NMI of the best restart, mean and std of the NMI over all restarts
     """
-#     clf = LogisticRegression(C=1000.0, random_state=0).fit(X_train, y_train)
-#     clf = svm.SVC(kernel='linear', C=1e30).fit(X_train, y_train)
-#     y_pred = clf.predict(X_test)
-
-#     print(y_test)
-#     print(y_pred)
-#     print("accuracy: %.2f" %accuracy_score(y_test, y_pred))
-#     print("Precision : %.3f" % precision_score(y_test, y_pred))
-#     print("Recall : %.3f" % recall_score(y_test, y_pred))
-#     print("F1-micro : %.3f" % f1_score(y_test, y_pred, average='micro'))
-#     print("F1-macro : %.3f" % f1_score(y_test, y_pred, average='macro'))
-#     f1_micro = f1_score(y_test, y_pred, average='micro')
-#     f1_macro = f1_score(y_test, y_pred, average='macro')
-
-#     print("F1-macro")
-#     print(f1_macro)
-#     print("F1-micro")
-#     print(f1_micro)
-
-    """
-    Clustering
-    """
-
     from sklearn.metrics.cluster import normalized_mutual_info_score
-    from nltk.cluster import KMeansClusterer
-    import nltk
-
-    NUM_CLUSTERS=8
-    kclusterer = KMeansClusterer(NUM_CLUSTERS, distance=nltk.cluster.util.cosine_distance,  repeats=100, normalise=True, avoid_empty_clusters=True)
-    assigned_clusters = kclusterer.cluster(X, assign_clusters=True)
-    nmi = normalized_mutual_info_score(assigned_clusters, y)
-    return nmi
+    from clustering import spherical_kmeans
+
+    labels, runs = spherical_kmeans(np.array(X), num_clusters, n_init=n_init, n_jobs=n_jobs)
+    nmis = [normalized_mutual_info_score(y, run_labels) for _, run_labels in runs]
+    return float(normalized_mutual_info_score(y, labels)), float(np.mean(nmis)), float(np.std(nmis))
     
 
 def tab_printer(args):
@@ -5,6 +5,20 @@ import numpy as np
 from tqdm import tqdm
 import networkx as nx
 
+def holdout_suffix(args):
+    """Walks on a graph with held-out edges must not be mixed up with walks on the full graph."""
+    ratio = getattr(args, 'holdout_ratio', 0.0)
+    return "-holdout_{}-seed_{}".format(ratio, args.seed) if ratio > 0 else ""
+
+def metapath_file_name(args):
+    return "{}{}-metapath_{}-whichmeta_{}-num_walks_{}-len_metapath{}.txt".format(args.input_path, args.idx_metapath, args.which_metapath, args.num_walks, args.len_metapath, holdout_suffix(args))
+
+def deepwalk_file_name(args):
+    return "{}{}-deepwalk_{}-num_walks_{}-len_metapath{}.txt".format(args.input_path, args.idx_metapath, args.number_of_walks, args.walk_length, holdout_suffix(args))
+
+def walk_file_name(args):
+    return deepwalk_file_name(args) if args.idx_embed == 'Node2vec' else metapath_file_name(args)
+
 class MetaPathWalker(object):
     """
     DeepWalk node embedding learner object.
@@ -77,7 +91,7 @@ class MetaPathWalker(object):
         #print(walks[:10])
         print("MetaPath Walks: {}".format(len(walks)))
 
-        file = "{}{}-metapath_{}-whichmeta_{}-num_walks_{}-len_metapath.txt".format(args.input_path, args.idx_metapath, args.which_metapath, args.num_walks, args.len_metapath)
+        file = metapath_file_name(args)
         with open(file, "w") as fw:
             for walk in walks:
                 for node in walk:
@@ -216,7 +230,7 @@ class DeepWalker(object):
 
         print("# of DeepWalks: {}".format(len(self.paths)))
 
-        file = "{}{}-deepwalk_{}-num_walks_{}-len_metapath.txt".format(self.args.input_path, self.args.idx_metapath, self.args.number_of_walks, self.args.walk_length)
+        file = deepwalk_file_name(self.args)
         with open(file, "w") as fw:
             for walk in self.paths:
                 for node in walk:
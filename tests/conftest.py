@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# the modules in src/ import each other by name, as when run with python3 src/main.py;
+# the scripts in tools/ likewise import their neighbours (validate_beverage) by name
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+sys.path.insert(0, str(ROOT / "tools"))
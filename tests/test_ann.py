@@ -0,0 +1,32 @@
+import numpy as np
+
+from ann import IVFIndex
+from quantize import normalize_rows
+
+
+def exact_topk(matrix, queries, k, allowed=None):
+    scores = normalize_rows(queries) @ normalize_rows(matrix).T
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+def test_probing_every_list_is_exact_search():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(2000, 16)).astype(np.float32)
+    queries = rng.normal(size=(50, 16)).astype(np.float32)
+    index = IVFIndex.build([str(i) for i in range(len(matrix))], matrix, nlist=32)
+    rows, scores = index.search(queries, k=10, nprobe=32)
+    expected_rows, expected_scores = exact_topk(matrix, queries, 10)
+    np.testing.assert_array_equal(rows, expected_rows)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+
+def test_probing_every_list_with_a_filter_is_exact_filtered_search():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(size=(1000, 8)).astype(np.float32)
+    queries = rng.normal(size=(20, 8)).astype(np.float32)
+    allowed = rng.random(len(matrix)) < 0.1
+    index = IVFIndex.build([str(i) for i in range(len(matrix))], matrix, nlist=16)
+    rows, _ = index.search(queries, k=5, nprobe=16, allowed=allowed)
+    np.testing.assert_array_equal(rows, exact_topk(matrix, queries, 5, allowed)[0])
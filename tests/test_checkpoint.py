@@ -0,0 +1,90 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+import torch
+
+import graph2vec
+from checkpoint import CheckpointWriter
+from embedding_store import load_embedding
+from parser import parameter_parser
+
+
+def small_graph():
+    graph = nx.Graph()
+    for i in range(40):
+        graph.add_node(i, name="n%d" % i, type="ingredient" if i < 20 else "compound", is_hub=["hub", "no_hub", "food", "drug"][i % 4])
+    return graph
+
+
+def write_walks(path, num_walks=200, length=20):
+    rng = np.random.default_rng(0)
+    with open(path, "w") as f:
+        for _ in range(num_walks):
+            f.write(" ".join(str(n) for n in rng.integers(0, 40, length)) + "\n")
+
+
+def trainer(args, graph, walks):
+    torch.manual_seed(0)
+    return graph2vec.Metapath2Vec(args, graph, data=graph2vec.read_walks(args, graph, walks))
+
+
+@pytest.mark.parametrize("device_sampling", [False, True])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch, device_sampling):
+    monkeypatch.setattr(sys, "argv", ["main.py"])
+    args = parameter_parser()
+    args.output_path = str(tmp_path) + "/"
+    # care_type 1 keeps the 1e8 entry negative table out of the test
+    args.care_type, args.num_workers, args.iterations = 1, 0, 2
+    args.dim, args.batch_size, args.min_count = 8, 8, 1
+    args.device_sampling = device_sampling
+    graph = small_graph()
+    walks = str(tmp_path / "walks.txt")
+    write_walks(walks)
+
+    model = trainer(args, graph, walks)
+    forward, steps = model.skip_gram_model.forward, []
+    model.skip_gram_model.forward = lambda *batch: steps.append(batch) or forward(*batch)
+    model.train()
+    expected = load_embedding(model.output_file_name).as_dict()
+
+    # keep the writers, so the crashed run's last checkpoint can be flushed before resuming
+    writers = []
+
+    class RecordingWriter(CheckpointWriter):
+        def __init__(self, path):
+            super().__init__(path)
+            writers.append(self)
+    monkeypatch.setattr(graph2vec, "CheckpointWriter", RecordingWriter)
+
+    # crash in the second epoch, most likely between two checkpoints
+    args.checkpoint_every = 3
+    model = trainer(args, graph, walks)
+    forward, calls = model.skip_gram_model.forward, []
+
+    def crash(*batch):
+        calls.append(batch)
+        if len(calls) == len(steps) * 3 // 4:
+            raise RuntimeError("crash")
+        return forward(*batch)
+    model.skip_gram_model.forward = crash
+    with pytest.raises(RuntimeError, match="crash"):
+        model.train()
+    writers[-1].close()
+    assert os.path.exists(model.checkpoint_path)
+
+    args.resume = True
+    model = trainer(args, graph, walks)
+    forward, resumed_steps = model.skip_gram_model.forward, []
+    model.skip_gram_model.forward = lambda *batch: resumed_steps.append(batch) or forward(*batch)
+    model.train()
+    resumed = load_embedding(model.output_file_name).as_dict()
+
+    # only the steps after the last checkpoint were trained again
+    assert 0 < len(resumed_steps) < len(steps) - len(calls) + 1 + args.checkpoint_every
+    assert not os.path.exists(model.checkpoint_path)
+    assert expected.keys() == resumed.keys()
+    for node in expected:
+        np.testing.assert_array_equal(expected[node], resumed[node])
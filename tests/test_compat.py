@@ -0,0 +1,72 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from embedding_store import EmbeddingTable, save_embedding_artifact
+from generate_recipe import CompatMatrix, PairScorer, pair_features, score_set
+
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    ids = [str(i) for i in range(20)]
+    table = EmbeddingTable(ids, rng.normal(size=(20, 6)).astype(np.float32))
+    X = np.abs(rng.normal(size=(200, 6)))
+    clf = LogisticRegression().fit(X, (X[:, 0] > X[:, 1]).astype(int))
+    return table, clf
+
+
+def per_pair_score_set(ings, table, clf):
+    # the original one-predict_proba-per-pair loop
+    scores = [clf.predict_proba(pair_features(table[a], table[b]).reshape(1, -1))[0, 1] for a, b in combinations(ings, 2)]
+    return float(np.mean(scores))
+
+
+def test_score_set_matches_per_pair_scores(model):
+    table, clf = model
+    for ings in (["0", "1"], ["3", "7", "11", "19"], ["5", "2", "9", "14", "0"]):
+        assert score_set(ings, table, clf) == pytest.approx(per_pair_score_set(ings, table, clf), rel=1e-5)
+    assert score_set(["4"], table, clf) == 0.0
+
+
+def test_pair_scores_are_symmetric_and_cached(model):
+    table, clf = model
+    scorer = PairScorer(table, clf, max_cache=3)
+    first = scorer.pair_scores([("1", "2"), ("2", "1"), ("3", "4")])
+    assert first[0] == first[1]
+    assert list(scorer.cache) == [("1", "2"), ("3", "4")]
+    # (1, 2) was used again, so the least recently used (3, 4) is evicted
+    scorer.pair_scores([("5", "6"), ("1", "2"), ("7", "8")])
+    assert set(scorer.cache) == {("1", "2"), ("5", "6"), ("7", "8")}
+    np.testing.assert_allclose(scorer.pair_scores([("2", "1")]), first[:1])
+
+
+def test_compat_matrix_matches_the_scorer(model):
+    table, clf = model
+    scorer = PairScorer(table, clf)
+    pool = ["0", "3", "5", "8", "13"]
+    compat = CompatMatrix.build(pool, scorer)
+    assert np.all(np.diag(compat.matrix) == 0) and np.allclose(compat.matrix, compat.matrix.T)
+    pairs = list(combinations(pool, 2)) + [("3", "17"), ("19", "0")]
+    np.testing.assert_allclose(compat.pair_scores(pairs), PairScorer(table, clf).pair_scores(pairs), rtol=1e-5)
+
+
+def test_compat_matrix_cache_follows_the_embedding_matrix(model, tmp_path):
+    table, clf = model
+    emb_path = save_embedding_artifact(str(tmp_path / "emb.npy"), table.ids, table.matrix)
+    model_path = tmp_path / "compat_model.pkl"
+    model_path.write_bytes(b"model")
+    pool = ["0", "3", "5"]
+
+    compat = CompatMatrix.cached(pool, PairScorer(table, clf), emb_path, str(model_path))
+    files = sorted(tmp_path.glob("emb_compat-*.npy"))
+    assert len(files) == 1
+    np.testing.assert_array_equal(CompatMatrix.cached(pool, PairScorer(table, clf), emb_path, str(model_path)).matrix, compat.matrix)
+
+    # a retrained matrix behind the same index is a new cache entry
+    retrained = EmbeddingTable(table.ids, table.matrix[::-1].copy())
+    save_embedding_artifact(emb_path, retrained.ids, retrained.matrix)
+    CompatMatrix.cached(pool, PairScorer(retrained, clf), emb_path, str(model_path))
+    assert len(list(tmp_path.glob("emb_compat-*.npy"))) == 2
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from knn_table import all_pairs_topk
+from similarity import normalize_rows
+
+
+def brute_force_topk(X, k):
+    scores = normalize_rows(X) @ normalize_rows(X).T
+    np.fill_diagonal(scores, -np.inf)
+    return np.argsort(-scores, axis=1, kind="stable")[:, :k], np.sort(scores, axis=1)[:, ::-1][:, :k]
+
+
+@pytest.mark.parametrize("memory_mb, threads", [(512, 1), (0, 3), (0, 8)])
+def test_all_pairs_topk_matches_brute_force(memory_mb, threads):
+    # memory_mb=0 gives one row per block, threads > 1 splits the columns into blocks to merge
+    X = np.random.default_rng(0).normal(size=(300, 12)).astype(np.float32)
+    ids, scores = all_pairs_topk(X, k=7, memory_mb=memory_mb, threads=threads)
+    expected_ids, expected_scores = brute_force_topk(X, 7)
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+    assert not (ids == np.arange(len(X))[:, None]).any()
+
+
+def test_all_pairs_topk_caps_k_at_the_other_rows():
+    ids, _ = all_pairs_topk(np.eye(4, dtype=np.float32) + 0.1, k=10, threads=2)
+    assert ids.shape == (4, 3)
+    assert all(sorted(row) == [j for j in range(4) if j != i] for i, row in enumerate(ids.tolist()))
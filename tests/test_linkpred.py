@@ -0,0 +1,40 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from linkpred import ranking_metrics
+
+
+def pairwise_auc(pos, neg):
+    """Probability that a positive outscores a negative, ties counting one half."""
+    wins = [1.0 if p > n else 0.5 if p == n else 0.0 for p, n in itertools.product(pos, neg)]
+    return sum(wins) / len(wins)
+
+
+def test_auc_with_tied_scores_counts_ties_as_half():
+    pos = np.array([0.9, 0.5, 0.5, 0.2])
+    neg = np.array([0.5, 0.5, 0.2, 0.1, 0.9])
+    assert ranking_metrics(pos, neg)["auc"] == pytest.approx(pairwise_auc(pos, neg))
+
+
+def test_auc_of_identical_scores_is_one_half():
+    assert ranking_metrics(np.zeros(5), np.zeros(7))["auc"] == pytest.approx(0.5)
+
+
+def test_auc_matches_pairwise_count_on_coarse_scores():
+    rng = np.random.default_rng(0)
+    # rounded, so most scores are tied with others
+    pos = np.round(rng.normal(0.5, 1.0, 300), 1)
+    neg = np.round(rng.normal(0.0, 1.0, 400), 1)
+    assert ranking_metrics(pos, neg)["auc"] == pytest.approx(pairwise_auc(pos, neg))
+
+
+def test_hits_counts_positives_above_the_kth_negative():
+    pos = np.array([0.95, 0.8, 0.6, 0.3])
+    neg = np.array([0.9, 0.7, 0.5, 0.1])
+    metrics = ranking_metrics(pos, neg, ks=(1, 2, 10))
+    assert metrics["hits@1"] == pytest.approx(0.25)
+    assert metrics["hits@2"] == pytest.approx(0.5)
+    # fewer negatives than K: every positive counts
+    assert metrics["hits@10"] == pytest.approx(1.0)
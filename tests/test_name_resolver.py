@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from name_resolver import NameResolver, load_aliases, normalize
+
+NODES = {"1": "lemon", "2": "lime", "3": "lemon_juice", "4": "cardamom", "5": "ginger", "6": "cumin", "7": "carbonated_water", "8": "sugar"}
+ALIASES = {"cumin": ["jeera", "zeera"], "water": ["paani"]}
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    path = tmp_path / "aliases.json"
+    path.write_text(json.dumps({"aliases": ALIASES}))
+    return NameResolver(NODES, load_aliases(str(path)))
+
+
+def test_exact_and_alias_lookups(resolver):
+    assert resolver.lookup("Lemon Juice") == ("3", "lemon_juice")
+    assert resolver.lookup("jeera") == ("6", "cumin")
+
+
+def test_aliases_only_lead_to_their_canonical_name(resolver):
+    # "water" is not a node, and carbonated water is a different ingredient
+    assert resolver.lookup("water") is None
+    assert resolver.lookup("paani") is None
+    assert resolver.lookup("zeera") == ("6", "cumin")
+
+
+@pytest.mark.parametrize("near_miss", ["lemn", "limes", "cardamon", "lemonade", "jeeraa"])
+def test_lookup_rejects_near_misses(resolver, near_miss):
+    assert resolver.lookup(near_miss) is None
+
+
+@pytest.mark.parametrize("near_miss", ["lemn", "cardamon", "lemonade"])
+def test_resolve_first_without_fuzzy_rejects_near_misses(resolver, near_miss):
+    assert resolver.resolve_first([near_miss], fuzzy=False) == (None, near_miss)
+
+
+def test_resolve_first_without_fuzzy_falls_back_to_a_containing_name(resolver):
+    assert resolver.resolve_first(["lemonade", "juice"], fuzzy=False) == ("3", "lemon_juice")
+
+
+def test_memo_keeps_fuzzy_and_exact_resolutions_apart(resolver):
+    assert resolver.resolve_first(["cardamon"]) == ("4", "cardamom")
+    assert resolver.resolve_first(["cardamon"], fuzzy=False) == (None, "cardamon")
+
+
+@pytest.mark.parametrize("unrelated", ["cola", "salt", "orange", "rose"])
+def test_resolve_rejects_names_below_min_score(resolver, unrelated):
+    assert resolver.resolve(unrelated) == (None, unrelated)
+
+
+def test_alias_file_maps_synonyms_to_the_canonical_name(tmp_path):
+    path = tmp_path / "aliases.json"
+    path.write_text('{"aliases": {"Black Salt": ["kala namak", "sanchal"]}}')
+    aliases = load_aliases(str(path))
+    assert aliases[normalize("Kala Namak")] == ["black_salt"]
+    assert aliases["sanchal"] == ["black_salt"]
+    assert "black_salt" not in aliases
+    assert load_aliases(str(tmp_path / "missing.json")) == {}
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline import Pipeline, select_stages, ORDER
+
+
+def make_args(tmp_path, **overrides):
+    args = dict(output_path=str(tmp_path), holdout_ratio=0.0, seed=42, idx_embed="FlavorGraph+CSL", idx_metapath="M11",
+                which_metapath="CHC", num_walks=5, len_metapath=10, number_of_walks=10, walk_length=80, dim=8)
+    args.update(overrides)
+    return SimpleNamespace(**args)
+
+
+def walks_key(tmp_path, graph_key="g1", **overrides):
+    pipeline = Pipeline(make_args(tmp_path, **overrides))
+    pipeline.keys["graph"] = graph_key
+    return pipeline.key("walks")
+
+
+def test_stage_key_changes_with_its_parameters_and_upstream_only(tmp_path):
+    key = walks_key(tmp_path)
+    assert walks_key(tmp_path) == key
+    assert walks_key(tmp_path, num_walks=6) != key
+    assert walks_key(tmp_path, graph_key="g2") != key
+    # skip-gram parameters do not invalidate the walks
+    assert walks_key(tmp_path, dim=16) == key
+
+
+def test_recorded_stage_is_stale_once_its_file_is_gone(tmp_path):
+    output = tmp_path / "graph.pickle"
+    output.write_bytes(b"")
+    Pipeline(make_args(tmp_path)).record("graph", "k1", {"pickle": str(output)})
+
+    # a later run reads the record from pipeline.json
+    pipeline = Pipeline(make_args(tmp_path))
+    assert pipeline.cached("graph", "k1", ["pickle"])["pickle"] == str(output)
+    assert pipeline.cached("graph", "k2", ["pickle"]) is None
+    output.unlink()
+    assert pipeline.cached("graph", "k1", ["pickle"]) is None
+
+
+def test_deferred_records_are_not_written(tmp_path):
+    pipeline = Pipeline(make_args(tmp_path))
+    pipeline.deferred = []
+    pipeline.record("plot", "k1", {"html": "x.html"})
+    assert pipeline.deferred == [("plot", "k1", {"html": "x.html"})]
+    assert Pipeline(make_args(tmp_path)).records == {}
+
+
+def test_selected_stages_pull_in_their_upstream(tmp_path):
+    pipeline = Pipeline(make_args(tmp_path))
+    assert pipeline.needed(select_stages(only="evaluate")) == ["graph", "walks", "train", "evaluate"]
+    assert pipeline.needed(select_stages(start="plot")) == ["graph", "walks", "train", "plot", "evaluate"]
+    assert select_stages() == ORDER
+    with pytest.raises(ValueError):
+        select_stages(only="train,nonsense")
+
+
+def test_upstream_rebuild_is_announced(tmp_path, capsys):
+    pipeline = Pipeline(make_args(tmp_path))
+    pipeline.selected = ["evaluate"]
+    pipeline.rebuilding("train")
+    pipeline.rebuilding("evaluate")
+    out = capsys.readouterr().out
+    assert "Stage train is not cached" in out and "Stage evaluate" not in out
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from quantize import Int8Codes, PQCodes, normalize_rows, quantize_matrix, load_quantized, recall_at_k
+
+
+def test_int8_round_trip_error_is_half_a_step():
+    X = np.random.default_rng(0).normal(size=(500, 24)).astype(np.float32)
+    codes = Int8Codes.fit(X)
+    error = np.abs(codes.codes * codes.scale - normalize_rows(X))
+    assert np.all(error <= codes.scale / 2 + 1e-7)
+
+
+def test_int8_scores_are_close_to_exact_cosine():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(500, 24)).astype(np.float32)
+    queries = rng.normal(size=(20, 24)).astype(np.float32)
+    exact = normalize_rows(queries) @ normalize_rows(X).T
+    np.testing.assert_allclose(Int8Codes.fit(X).scores(queries), exact, atol=0.02)
+
+
+def test_pq_with_a_centroid_per_row_is_lossless():
+    # fewer rows than the 256 centroids per subspace: every row is its own centroid
+    X = np.random.default_rng(2).normal(size=(200, 10)).astype(np.float32)
+    pq = PQCodes.fit(X, m=3)
+    exact = normalize_rows(X[:10]) @ normalize_rows(X).T
+    np.testing.assert_allclose(pq.scores(X[:10]), exact, atol=1e-5)
+
+
+def test_pq_encode_matches_the_fitted_codes():
+    X = np.random.default_rng(3).normal(size=(1000, 16)).astype(np.float32)
+    pq = PQCodes.fit(X, m=4, iterations=30)
+    np.testing.assert_array_equal(pq.encode(normalize_rows(X)), pq.codes)
+
+
+def test_saved_codes_load_back_with_the_same_scores(tmp_path):
+    rng = np.random.default_rng(4)
+    X = rng.normal(size=(600, 16)).astype(np.float32)
+    stem = str(tmp_path / "emb")
+    report = quantize_matrix(stem, X, pq_dsub=4, num_queries=100)
+    assert report[1]["codes"] == "int8" and report[1]["recall@10"] > 0.9
+    queries = rng.normal(size=(5, 16)).astype(np.float32)
+    int8, pq = load_quantized(stem + ".npy", "int8"), load_quantized(stem + ".npy", "pq")
+    np.testing.assert_array_equal(int8.scores(queries), Int8Codes.fit(X).scores(queries))
+    assert pq.codes.shape == (600, 4)
+    assert recall_at_k(normalize_rows(queries) @ normalize_rows(X).T, pq.scores(queries), 10) > 0.3
+
+
+def test_recall_at_k():
+    exact = np.array([[4.0, 3.0, 2.0, 1.0]])
+    assert recall_at_k(exact, np.array([[4.0, 3.0, 2.0, 1.0]]), 2) == pytest.approx(1.0)
+    assert recall_at_k(exact, np.array([[1.0, 3.0, 4.0, 2.0]]), 2) == pytest.approx(0.5)
@@ -0,0 +1,75 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from registry import Registry, embedding_params, params_key
+
+PARAMS = {"idx_embed": "FlavorGraph+CSL", "dim": 8, "seed": 42}
+
+
+def publish(registry, params=PARAMS, **kwargs):
+    path = registry.artifact_path(params, prefix="FlavorGraph+CSL-embedding")
+    open(path, "w").close()
+    return registry.publish(params, {"embedding": path}, **kwargs), path
+
+
+def test_publish_then_resolve_by_id_tag_and_params(tmp_path):
+    registry = Registry(str(tmp_path))
+    artifact_id, path = publish(registry, tags=["paper"])
+    assert artifact_id == params_key(PARAMS)
+    assert os.path.basename(path) == "FlavorGraph+CSL-embedding-{}.npy".format(artifact_id)
+    for ref in (artifact_id, "paper", "latest", "latest-embedding"):
+        assert registry.resolve(ref) == path
+    assert registry.resolve(params=PARAMS) == path
+    # files are stored relative to the root, so a moved output folder keeps working
+    assert registry.get(artifact_id)["files"]["embedding"] == os.path.basename(path)
+
+
+def test_a_second_registry_sees_published_artifacts(tmp_path):
+    _, path = publish(Registry(str(tmp_path)))
+    assert Registry(str(tmp_path)).resolve("latest") == path
+
+
+def test_latest_moves_and_republishing_keeps_metrics(tmp_path):
+    registry = Registry(str(tmp_path))
+    first, _ = publish(registry)
+    assert registry.update(first, metrics={"nmi": 0.5})
+    second, second_path = publish(registry, dict(PARAMS, dim=16))
+    assert registry.resolve("latest") == second_path
+    publish(registry)
+    assert registry.get("latest")["id"] == first
+    assert registry.get(first)["metrics"] == {"nmi": 0.5}
+
+
+def test_update_merges_metrics_and_files(tmp_path):
+    registry = Registry(str(tmp_path))
+    artifact_id, _ = publish(registry)
+    registry.update(artifact_id, metrics={"nmi": 0.4})
+    registry.update(artifact_id, metrics={"auc": 0.8}, files={"int8": str(tmp_path / "x_int8.npy")})
+    entry = registry.get(artifact_id)
+    assert entry["metrics"] == {"nmi": 0.4, "auc": 0.8}
+    assert entry["files"]["int8"] == "x_int8.npy"
+
+
+def test_update_of_an_unregistered_artifact_records_nothing(tmp_path):
+    registry = Registry(str(tmp_path))
+    assert registry.update("0123456789abcdef", metrics={"nmi": 0.4}) is False
+    assert registry.get("0123456789abcdef") is None
+
+
+def test_resolve_accepts_paths_and_rejects_unknown_refs(tmp_path):
+    registry = Registry(str(tmp_path))
+    path = tmp_path / "legacy.pickle"
+    path.write_bytes(b"")
+    assert registry.resolve(str(path)) == str(path)
+    with pytest.raises(FileNotFoundError):
+        registry.resolve("no-such-tag")
+
+
+def test_embedding_params_ignore_the_unused_walker():
+    args = SimpleNamespace(idx_embed="FlavorGraph+CSL", dim=8, num_walks=5, number_of_walks=10, walk_length=80,
+                           holdout_ratio=0.0, num_workers=16)
+    params = embedding_params(args)
+    assert params == {"idx_embed": "FlavorGraph+CSL", "dim": 8, "num_walks": 5}
+    assert params_key(params) == params_key(embedding_params(SimpleNamespace(**dict(vars(args), num_workers=1, walk_length=40))))
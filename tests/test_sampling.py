@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from sampling import TypedAliasTable, NegativeSampler
+
+PROBS = np.array([0.05, 0.25, 0.1, 0.3, 0.2, 0.1])
+TYPES = np.array([0, 1, 0, 1, 1, 0])
+
+
+def expected_within_type(t):
+    p = np.where(TYPES == t, PROBS, 0.0)
+    return p / p.sum()
+
+
+def frequencies(draws):
+    return np.bincount(np.asarray(draws).ravel(), minlength=len(PROBS)) / np.size(draws)
+
+
+def test_typed_alias_table_draws_each_type_by_its_probabilities():
+    table = TypedAliasTable(PROBS, TYPES)
+    rng = np.random.default_rng(0)
+    for t in (0, 1):
+        draws = table.sample(np.full(1000, t), 200, rng)
+        assert draws.shape == (1000, 200)
+        np.testing.assert_allclose(frequencies(draws), expected_within_type(t), atol=0.005)
+
+
+def test_typed_alias_table_single_type_is_the_unigram_table():
+    draws = TypedAliasTable(PROBS, np.zeros(len(PROBS), dtype=np.int64)).sample(np.zeros(1000, dtype=np.int64), 200, np.random.default_rng(1))
+    np.testing.assert_allclose(frequencies(draws), PROBS, atol=0.005)
+
+
+def test_negative_sampler_follows_the_type_of_the_context_node():
+    data = SimpleNamespace(care_type=1, typed_table=TypedAliasTable(PROBS, TYPES), types=TYPES, sampling_prob=PROBS)
+    sampler = NegativeSampler(data, torch.device("cpu"), seed=0)
+    pos_v = torch.tensor([0, 1] * 50000)
+    negs = sampler.negatives(pos_v, 5).numpy()
+    assert negs.shape == (100000, 5)
+    for t, rows in ((0, negs[0::2]), (1, negs[1::2])):
+        np.testing.assert_allclose(frequencies(rows), expected_within_type(t), atol=0.005)
+
+
+def test_negative_sampler_resumes_its_stream_from_state_dict():
+    data = SimpleNamespace(care_type=0, sampling_prob=PROBS)
+    sampler = NegativeSampler(data, torch.device("cpu"), seed=3)
+    pos_v = torch.arange(6)
+    sampler.negatives(pos_v, 5)
+    state = sampler.state_dict()
+    expected = sampler.negatives(pos_v, 5)
+    restored = NegativeSampler(data, torch.device("cpu"), seed=99)
+    restored.load_state_dict(state)
+    assert torch.equal(restored.negatives(pos_v, 5), expected)
@@ -0,0 +1,50 @@
+import numpy as np
+
+from embedding_store import EmbeddingTable
+from similarity import SimilarityIndex, normalize_rows
+
+
+def make_index(n=60, d=8, block_bytes=256 << 20):
+    X = np.random.default_rng(0).normal(size=(n, d)).astype(np.float32)
+    ids = [str(i) for i in range(n)]
+    attributes = {i: ("node" + i, "ingredient" if int(i) % 2 else "compound", "no_hub") for i in ids}
+    return SimilarityIndex(EmbeddingTable(ids, X), attributes, block_bytes=block_bytes), X
+
+
+def test_most_similar_matches_brute_force_without_the_node_itself():
+    # a tiny block_bytes answers the queries one at a time
+    for block_bytes in (256 << 20, 1):
+        index, X = make_index(block_bytes=block_bytes)
+        scores = normalize_rows(X) @ normalize_rows(X).T
+        np.fill_diagonal(scores, -np.inf)
+        results = index.most_similar(["0", "7", "12"], k=5)
+        for query, result in zip([0, 7, 12], results):
+            expected = np.argsort(-scores[query], kind="stable")[:5]
+            assert [node_id for node_id, _, _ in result] == [str(i) for i in expected]
+            np.testing.assert_allclose([sim for _, _, sim in result], scores[query, expected], rtol=1e-5)
+
+
+def test_type_filter_and_short_results():
+    index, _ = make_index()
+    result = index.most_similar(["3"], k=10, types=["ingredient"])[0]
+    assert all(int(node_id) % 2 for node_id, _, _ in result)
+    assert all(name == "node" + node_id for node_id, name, _ in result)
+
+    # only three rows allowed: the missing slots come back as -1 and are dropped from the results
+    allowed = index.mask(exclude=[str(i) for i in range(3, 60)])
+    rows, scores = index.search(index.matrix[[10]], k=5, allowed=allowed)
+    assert sorted(rows[0, :3]) == [0, 1, 2]
+    assert list(rows[0, 3:]) == [-1, -1] and np.all(np.isneginf(scores[0, 3:]))
+    assert len(index.results(rows, scores)[0]) == 3
+
+
+def test_combine_leaves_the_query_nodes_out():
+    index, X = make_index()
+    result = index.combine(["1", "2"], negative=["4"], k=5)
+    found = [node_id for node_id, _, _ in result]
+    assert not {"1", "2", "4"} & set(found)
+    unit = normalize_rows(X)
+    query = normalize_rows(unit[1] + unit[2] - unit[4])
+    scores = unit @ query
+    scores[[1, 2, 4]] = -np.inf
+    assert found == [str(i) for i in np.argsort(-scores, kind="stable")[:5]]
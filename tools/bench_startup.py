@@ -0,0 +1,104 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+"""
+Startup-time benchmark for the command line entry points.
+Every entry point is started with `python -X importtime` a few times; the median wall time and the
+cumulative import time of the top-level modules are compared against the thresholds below, and the
+heavy modules an entry point must not import at startup are checked. Exits 1 on any regression.
+
+    python3 tools/bench_startup.py
+    python3 tools/bench_startup.py --runs 10 --scale 1.5 --json startup.json
+"""
+ROOT = Path(__file__).resolve().parent.parent
+
+# name: (argv, wall ms, import ms, modules that must not be imported)
+ENTRY_POINTS = {
+    "main --help": (["src/main.py", "--help"], 200, 100,
+                    ["torch", "pandas", "networkx", "sklearn", "seaborn", "plotly", "chart_studio"]),
+    "generate_recipe --help": (["tools/generate_recipe.py", "--help"], 400, 250,
+                               ["torch", "pandas", "joblib", "sklearn"]),
+    "validate_beverage": (["tools/validate_beverage.py"], 200, 60,
+                          ["numpy", "pandas", "torch", "sklearn"]),
+}
+
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us, depth)} from the -X importtime report."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def run_once(argv):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime"] + argv, cwd=ROOT, capture_output=True, text=True)
+    wall_ms = 1000.0 * (time.perf_counter() - start)
+    return wall_ms, parse_importtime(result.stderr)
+
+
+def bench(name, argv, runs):
+    walls, imports = [], []
+    for _ in range(runs):
+        wall_ms, modules = run_once(argv)
+        walls.append(wall_ms)
+        # top-level modules only, so nested imports are not counted twice
+        imports.append(sum(cum for _, cum, depth in modules.values() if depth == 0) / 1000.0)
+    slowest = sorted(((cum / 1000.0, module) for module, (_, cum, depth) in modules.items() if depth == 0), reverse=True)[:5]
+    return {"name": name, "wall_ms": statistics.median(walls), "import_ms": statistics.median(imports),
+            "modules": sorted(modules), "slowest": slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the CLI entry points with regression thresholds")
+    parser.add_argument("--runs", default=5, type=int, help="runs per entry point, the median is reported")
+    parser.add_argument("--scale", default=1.0, type=float, help="multiply every time threshold (slow machines, CI)")
+    parser.add_argument("--json", default=None, help="also write the measurements to this file")
+    args = parser.parse_args()
+
+    # the interpreter alone, to put the thresholds in perspective
+    baseline = bench("python -c pass", ["-c", "pass"], args.runs)["wall_ms"]
+    print("{:<26} {:>9.1f} ms".format("interpreter", baseline))
+
+    failures = []
+    report = []
+    for name, (argv, wall_limit, import_limit, forbidden) in ENTRY_POINTS.items():
+        result = bench(name, argv, args.runs)
+        report.append(result)
+        print("{:<26} {:>9.1f} ms wall (limit {:.0f}), {:>7.1f} ms imports (limit {:.0f})".format(
+            name, result["wall_ms"], wall_limit * args.scale, result["import_ms"], import_limit * args.scale))
+        for ms, module in result["slowest"]:
+            print("    {:>8.1f} ms  {}".format(ms, module))
+
+        if result["wall_ms"] > wall_limit * args.scale:
+            failures.append("{}: {:.0f} ms wall > {:.0f} ms".format(name, result["wall_ms"], wall_limit * args.scale))
+        if result["import_ms"] > import_limit * args.scale:
+            failures.append("{}: {:.0f} ms imports > {:.0f} ms".format(name, result["import_ms"], import_limit * args.scale))
+        loaded = set(m.split(".")[0] for m in result["modules"])
+        for module in forbidden:
+            if module in loaded:
+                failures.append("{}: imports {} at startup".format(name, module))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"interpreter_ms": baseline, "entry_points": report}, f, indent=1)
+    if failures:
+        print("\nStartup regressions:")
+        for failure in failures:
+            print("  -", failure)
+        sys.exit(1)
+    print("\nAll entry points within their startup budget.")
+
+
+if __name__ == "__main__":
+    main()
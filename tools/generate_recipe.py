@@ -1,41 +1,42 @@
 import argparse
+import csv
+import hashlib
 import json
+import multiprocessing
 import os
 import random
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import combinations
 from pathlib import Path
 
-import joblib
 import numpy as np
-import pandas as pd
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from embedding_store import load_embedding, artifact_stem, index_path
+from registry import Registry, file_hash
 from validate_beverage import load_constraints, validate_record
-
-
-def find_latest_embedding(output_dir: str) -> str:
-    cand = []
-    for fn in os.listdir(output_dir):
-        if fn.startswith("FlavorGraph+CSL-embedding_") and fn.endswith(".pickle"):
-            cand.append((os.path.getmtime(os.path.join(output_dir, fn)), fn))
-    if not cand:
-        raise FileNotFoundError("No embedding found")
-    cand.sort(reverse=True)
-    return os.path.join(output_dir, cand[0][1])
+from similarity import SimilarityIndex, normalize_rows
+from ann import load_ann
+from name_resolver import NameResolver, load_aliases, ALIASES
 
 
 def load_embeddings(path: str):
-    import pickle
-    with open(path, "rb") as f:
-        return pickle.load(f)
+    # dict-like EmbeddingTable over a memory-mapped matrix; keys are node_id strings
+    return load_embedding(path)
 
 
 def load_nodes(nodes_csv: str):
-    df = pd.read_csv(nodes_csv)
-    id_to_name = {str(r.node_id): r.name for _, r in df.iterrows()}
-    id_to_type = {str(r.node_id): r.node_type for _, r in df.iterrows()}
-    # case-insensitive map, prefer last occurrence
-    name_to_id = {}
-    for _, r in df.iterrows():
-        name_to_id[str(r.name).strip().lower()] = str(r.node_id)
+    # plain csv: pandas is not needed for three columns and costs more to import than to read the file
+    id_to_name, id_to_type, name_to_id = {}, {}, {}
+    with open(nodes_csv, newline='') as f:
+        for r in csv.DictReader(f):
+            id_to_name[r["node_id"]] = r["name"]
+            id_to_type[r["node_id"]] = r["node_type"]
+            # case-insensitive map, prefer last occurrence
+            name_to_id[r["name"].strip().lower()] = r["node_id"]
     return id_to_name, id_to_type, name_to_id
 
 
@@ -50,18 +51,134 @@ def pair_features(e1, e2):
     return np.abs(e1 - e2)
 
 
+class PairScorer(object):
+    """
+    Compatibility of ingredient pairs, vectorized and memoized.
+    Vectors are normalized once per node; the features of all pairs of a call are one array op and
+    one predict_proba. Scores are symmetric (|a - b|), so a pair is cached under its sorted ids, in an
+    LRU of at most `max_cache` pairs.
+    """
+    def __init__(self, embeddings, clf, max_cache=100000):
+        self.embeddings = embeddings
+        self.clf = clf
+        self.unit = {}
+        self.cache = OrderedDict()
+        self.max_cache = max_cache
+
+    def vectors(self, ids):
+        missing = [nid for nid in dict.fromkeys(ids) if nid not in self.unit]
+        if missing:
+            self.unit.update(zip(missing, normalize_rows(self.embeddings.vectors(missing))))
+        return np.stack([self.unit[nid] for nid in ids])
+
+    def pair_scores(self, pairs):
+        """Scores of (a, b) pairs, computing only the pairs not in the cache."""
+        keys = [(a, b) if a <= b else (b, a) for a, b in pairs]
+        missing = list(dict.fromkeys(key for key in keys if key not in self.cache))
+        scores = {}
+        if missing:
+            features = np.abs(self.vectors([a for a, _ in missing]) - self.vectors([b for _, b in missing]))
+            scores = dict(zip(missing, self.clf.predict_proba(features)[:, 1].tolist()))
+        for key in keys:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                scores[key] = self.cache[key]
+        self.cache.update(scores)
+        while len(self.cache) > self.max_cache:
+            self.cache.popitem(last=False)
+        return np.array([scores[key] for key in keys], dtype=np.float64)
+
+    def score_set(self, ings):
+        # score = average pairwise compatibility
+        if len(ings) < 2:
+            return 0.0
+        return float(self.pair_scores(list(combinations(ings, 2))).mean())
+
+
+_HASHES = {}
+
+
+def artifact_hash(path):
+    # content hash, recomputed only when the file changes (a long-lived process generates many recipes)
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if key not in _HASHES:
+        _HASHES[key] = file_hash(path)
+    return _HASHES[key]
+
+
+def embedding_hash(path):
+    """
+    Content hash of an embedding artifact. The index alone is not enough: a retrained run with the same
+    parameters writes the same index next to a different matrix, so the matrix it points to is hashed too.
+    """
+    stem = artifact_stem(path)
+    if not os.path.exists(index_path(stem)):
+        # legacy pickle
+        return artifact_hash(stem + '.pickle')
+    with open(index_path(stem)) as f:
+        matrix = os.path.join(os.path.dirname(stem), json.load(f)["matrix"])
+    return "{} {}".format(artifact_hash(index_path(stem)), artifact_hash(matrix))
+
+
+class CompatMatrix(object):
+    """
+    Symmetric float32 compatibility matrix over a candidate pool (zero diagonal), so scoring a recipe
+    is array indexing. Pairs with a node outside the pool go to the scorer and its LRU.
+    """
+    BLOCK_PAIRS = 1 << 18
+
+    def __init__(self, ids, matrix, scorer):
+        self.ids = list(ids)
+        self.row = {nid: i for i, nid in enumerate(self.ids)}
+        self.matrix = matrix
+        self.scorer = scorer
+
+    @classmethod
+    def build(cls, ids, scorer):
+        ids = list(dict.fromkeys(ids))
+        vectors = scorer.vectors(ids)
+        matrix = np.zeros((len(ids), len(ids)), dtype=np.float32)
+        a, b = np.triu_indices(len(ids), 1)
+        # batched over blocks of pairs, to bound the size of the feature matrix
+        for start in range(0, len(a), cls.BLOCK_PAIRS):
+            i, j = a[start:start + cls.BLOCK_PAIRS], b[start:start + cls.BLOCK_PAIRS]
+            matrix[i, j] = matrix[j, i] = scorer.clf.predict_proba(np.abs(vectors[i] - vectors[j]))[:, 1]
+        return cls(ids, matrix, scorer)
+
+    @classmethod
+    def cached(cls, ids, scorer, emb_path, model_path):
+        """build(), persisted as <embedding stem>_compat-<key>.npy; the key hashes both artifacts and the pool."""
+        ids = list(dict.fromkeys(ids))
+        digest = hashlib.sha1("{} {} {}".format(embedding_hash(emb_path), artifact_hash(model_path), json.dumps(ids)).encode("utf-8"))
+        path = "{}_compat-{}.npy".format(artifact_stem(emb_path), digest.hexdigest()[:16])
+        if os.path.exists(path):
+            return cls(ids, np.load(path), scorer)
+        compat = cls.build(ids, scorer)
+        tmp = "{}.tmp-{}.npy".format(path[:-len(".npy")], os.getpid())
+        np.save(tmp, compat.matrix)
+        os.replace(tmp, path)
+        return compat
+
+    def __contains__(self, node_id):
+        return node_id in self.row
+
+    def rows(self, ids):
+        return np.array([self.row[nid] for nid in ids], dtype=np.int64)
+
+    def pair_scores(self, pairs):
+        scores = np.empty(len(pairs), dtype=np.float64)
+        inside = [k for k, (a, b) in enumerate(pairs) if a in self.row and b in self.row]
+        outside = [k for k, (a, b) in enumerate(pairs) if a not in self.row or b not in self.row]
+        if inside:
+            scores[inside] = self.matrix[self.rows([pairs[k][0] for k in inside]), self.rows([pairs[k][1] for k in inside])]
+        if outside:
+            scores[outside] = self.scorer.pair_scores([pairs[k] for k in outside])
+        return scores
+
+
 def score_set(ings, embeddings, clf):
-    # score = average pairwise compatibility
-    if len(ings) < 2:
-        return 0.0
-    scores = []
-    for i in range(len(ings)):
-        for j in range(i + 1, len(ings)):
-            a, b = ings[i], ings[j]
-            f = pair_features(embeddings[a], embeddings[b]).reshape(1, -1)
-            s = clf.predict_proba(f)[0, 1]
-            scores.append(s)
-    return float(np.mean(scores)) if scores else 0.0
+    return PairScorer(embeddings, clf).score_set(ings)
 
 
 def propose_base_pool(id_to_type, name_to_id):
@@ -74,6 +191,24 @@ def propose_base_pool(id_to_type, name_to_id):
     return [nid for nid in pool if id_to_type.get(nid) == "ingredient"]
 
 
+def expand_pool(pool, seeds, emb_path, embeddings, id_to_name, id_to_type, k):
+    # add the k ingredients closest to every seed; the IVF index is used when one was built for the embeddings
+    attributes = {nid: (id_to_name.get(nid), id_to_type.get(nid), None) for nid in embeddings.ids}
+    index = SimilarityIndex(embeddings, attributes)
+    allowed = index.mask(types=["ingredient"], exclude=seeds)
+    seeds = [nid for nid in seeds if nid in embeddings]
+    if not seeds or k <= 0:
+        return pool
+    try:
+        ann = load_ann(emb_path)
+        rows, _ = ann.search(embeddings.vectors(seeds), k, allowed=allowed)
+        found = [ann.ids[r] for r in rows.ravel() if r >= 0]
+    except FileNotFoundError:
+        rows, _ = index.search(embeddings.vectors(seeds), k, allowed)
+        found = [index.ids[r] for r in rows.ravel() if r >= 0]
+    return pool + [nid for nid in dict.fromkeys(found) if nid not in pool]
+
+
 def amounts_for_profile(names):
     # simple heuristics for demo
     total_mL = 1000.0
@@ -105,94 +240,30 @@ def amounts_for_profile(names):
     }
 
 
-def resolve_node_id(preferred_names, name_to_id, id_to_name):
-    # try exact (case-insensitive), then contains
-    for n in preferred_names:
-        key = n.strip().lower()
-        if key in name_to_id:
-            return name_to_id[key], n
-    # contains search fallback
-    # build reverse: lower name -> id already exists in name_to_id; but we need list of names
-    # We'll iterate id_to_name
-    for nid, nm in id_to_name.items():
-        low = str(nm).strip().lower()
-        if any(p in low for p in [p.strip().lower() for p in preferred_names]):
-            return nid, nm
-    return None, preferred_names[0]
+_RESOLVER = None
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--nodes", default="input/nodes_191120.csv")
-    parser.add_argument("--emb", default=None)
-    parser.add_argument("--model", default="models/compat_beverage_IN.pkl")
-    parser.add_argument("--constraints", default="config/constraints/fssai_carbonated_beverage_constraints.json")
-    args = parser.parse_args()
+def name_resolver(id_to_name):
+    """NameResolver of a node table, built once (and again only for another table)."""
+    global _RESOLVER
+    if _RESOLVER is None or _RESOLVER[0] is not id_to_name:
+        _RESOLVER = (id_to_name, NameResolver(id_to_name, load_aliases(ALIASES)))
+    return _RESOLVER[1]
 
-    emb_path = args.emb or find_latest_embedding("output")
-    embeddings = load_embeddings(emb_path)
-    id_to_name, id_to_type, name_to_id = load_nodes(args.nodes)
-    clf = joblib.load(args.model)["model"]
-    rules = load_constraints(args.constraints)
 
-    pool = propose_base_pool(id_to_type, name_to_id)
-    # Start with water + acid + citrus; greedily add others if score improves and validation passes
-    water_id, water_name = resolve_node_id(["water", "carbonated_water", "bottled_water", "distilled_water"], name_to_id, id_to_name)
-    acid_id, acid_name = resolve_node_id(["citric_acid"], name_to_id, id_to_name)
-    citrus_id, citrus_name = resolve_node_id(["lemon", "lime"], name_to_id, id_to_name)
-    start = [nid for nid in [water_id, acid_id, citrus_id] if nid]
-    current = [nid for nid in start if nid in embeddings]
-    best_score = score_set(current, embeddings, clf)
+def resolve_node_id(preferred_names, name_to_id, id_to_name):
+    # exact (normalized), alias, then the first name containing one of them, through indexes built once per node table;
+    # no fuzzy matches, so a recipe never gets a merely similar-sounding ingredient
+    return name_resolver(id_to_name).resolve_first(preferred_names, fuzzy=False)
 
-    improved = True
-    while improved:
-        improved = False
-        for cand in pool:
-            if cand in current:
-                continue
-            trial = current + [cand]
-            s = score_set(trial, embeddings, clf)
-            if s > best_score:
-                # build a rec for validation
-                names = [id_to_name[nid] for nid in trial]
-                targets, amt = amounts_for_profile([id_to_name[nid] for nid in trial])
-                rec = {
-                    "id": "GEN-CSD-001",
-                    "name": "Generated Carbonated Beverage",
-                    "country": "IN",
-                    "subcategory": "carbonated",
-                    "dietary_mode": "liquid",
-                    "veg_flag": True,
-                    "jain_flag": True,
-                    "targets": targets,
-                    "ingredients": [],
-                    "process": {"template": "standard_csd", "steps": [{"step": s, "params": {}} for s in [
-                        "prepare_syrup_mix", "filter", "in_line_blend_to_target_brix_and_acid", "chill_to_cold_fill_temperature", "carbonation_to_target_volumes", "fill_and_seal", "date_code_and_pack"
-                    ]]},
-                    "labels": {"veg_symbol": True, "claims": [], "warnings": []}
-                }
-                for k, v in amt.items():
-                    if v[0] <= 0:
-                        continue
-                    nid, actual_name = resolve_node_id([k], name_to_id, id_to_name)
-                    if nid is None:
-                        continue
-                    rec["ingredients"].append({
-                        "name": actual_name,
-                        "node_id": nid,
-                        "quantity": float(v[0]),
-                        "unit": v[1],
-                        "class": ("water" if k=="water" else ("acid" if k=="citric_acid" else ("sweetener" if k in ["sugar","stevia"] else "flavor")))
-                    })
-                v = validate_record(rec, rules)
-                if not v:
-                    current = trial
-                    best_score = s
-                    improved = True
 
-    # Finalize recipe
-    names = [id_to_name[nid] for nid in current]
-    targets, amt = amounts_for_profile(names)
+def build_recipe(ids, id_to_name, name_to_id, extra=False):
+    """
+    Recipe record for a set of node ids, with the heuristic targets and amounts.
+    :param extra: Also list the ingredients the heuristic has no amount for, as flavors with a placeholder
+        quantity of 0 g and "amount_pending": true, so the record stays schema-valid until a formulator sets the amount.
+    """
+    targets, amt = amounts_for_profile([id_to_name[nid] for nid in ids])
     recipe = {
         "id": "GEN-CSD-001",
         "name": "Generated Carbonated Beverage",
@@ -221,11 +292,377 @@ def main():
             "unit": v[1],
             "class": ("water" if k=="water" else ("acid" if k=="citric_acid" else ("sweetener" if k in ["sugar","stevia"] else "flavor")))
         })
+    if extra:
+        listed = set(ing["node_id"] for ing in recipe["ingredients"])
+        for nid in ids:
+            if nid not in listed:
+                recipe["ingredients"].append({"name": id_to_name[nid], "node_id": nid, "quantity": 0.0, "unit": "g", "class": "flavor",
+                                              "amount_pending": True})
+    return recipe
 
-    print(json.dumps(recipe, ensure_ascii=False, indent=2))
 
+def start_set(embeddings, id_to_name, name_to_id):
+    # Start with water + acid + citrus
+    water_id, water_name = resolve_node_id(["water", "carbonated_water", "bottled_water", "distilled_water"], name_to_id, id_to_name)
+    acid_id, acid_name = resolve_node_id(["citric_acid"], name_to_id, id_to_name)
+    citrus_id, citrus_name = resolve_node_id(["lemon", "lime"], name_to_id, id_to_name)
+    start = [nid for nid in [water_id, acid_id, citrus_id] if nid]
+    return [nid for nid in start if nid in embeddings]
 
-if __name__ == "__main__":
-    main()
+
+def feasible_mask(index, rules, types=("ingredient",)):
+    """Rows that may be retrieved: nodes of `types`, minus the ingredients the constraints reject by name."""
+    hard = rules.get("hard_constraints", {})
+    prohibited = set(n.lower() for n in hard.get("prohibited_ingredients", []))
+    # validate_record rejects any caffeine ingredient while the caffeine limit is undefined
+    no_caffeine = hard.get("caffeine", {}).get("max") is None
+    names = [str(n or "").lower() for n in index.names]
+    blocked = np.array([n in prohibited or (no_caffeine and "caffeine" in n) for n in names], dtype=bool)
+    return index.mask(types=list(types)) & ~blocked
+
+
+def retrieve_and_rank(index, scorer, members, k, allowed):
+    """
+    Candidates for the next ingredient: the k allowed nodes closest to the centroid of the members,
+    ranked by their summed compatibility with the members (one classifier call).
+    :return [(node id, summed score)], best first
+    """
+    if not members:
+        return []
+    rows = index.rows(members)
+    allowed = allowed.copy()
+    allowed[rows] = False
+    found, _ = index.search(index.matrix[rows].mean(axis=0), k, allowed)
+    candidates = [index.ids[r] for r in found[0] if r >= 0]
+    if not candidates:
+        return []
+    scores = scorer.pair_scores([(c, m) for c in candidates for m in members]).reshape(len(candidates), len(members)).sum(axis=1)
+    return [(candidates[i], float(scores[i])) for i in np.argsort(-scores, kind="stable")]
 
 
+def generate_retrieved(embeddings, id_to_name, id_to_type, name_to_id, clf, rules, k=50, max_size=12, index=None):
+    """
+    Greedy search over the whole catalog: every step retrieves k candidates around the current recipe
+    and adds the best ranked one that improves the set score and validates.
+    """
+    if index is None:
+        attributes = {nid: (id_to_name.get(nid), id_to_type.get(nid), None) for nid in embeddings.ids}
+        index = SimilarityIndex(embeddings, attributes)
+    allowed = feasible_mask(index, rules)
+    scorer = PairScorer(embeddings, clf)
+    members = start_set(embeddings, id_to_name, name_to_id)
+    total = float(scorer.pair_scores(list(combinations(members, 2))).sum())
+    count = len(members) * (len(members) - 1) // 2
+    best_score = total / count if count else 0.0
+
+    while len(members) < max_size:
+        accepted = False
+        for cand, new in retrieve_and_rank(index, scorer, members, k, allowed):
+            s = (total + new) / (count + len(members))
+            if s <= best_score:
+                # ranked best first: no later candidate improves either
+                break
+            if not validate_record(build_recipe(members + [cand], id_to_name, name_to_id, extra=True), rules):
+                count += len(members)
+                members.append(cand)
+                total += new
+                best_score = s
+                accepted = True
+                break
+        if not accepted:
+            break
+    return build_recipe(members, id_to_name, name_to_id, extra=True)
+
+
+def candidate_pool(embeddings, id_to_name, id_to_type, name_to_id, clf, emb_path=None, expand=0, model_path=None, seeds=()):
+    """
+    (compatibility matrix, starting set, candidate pool) of the pool-based searches.
+    :param seeds: Ingredient names or node ids added to the starting set.
+    """
+    pool = propose_base_pool(id_to_type, name_to_id)
+    current = start_set(embeddings, id_to_name, name_to_id)
+    for seed in seeds:
+        nid = seed if seed in id_to_name else resolve_node_id([seed], name_to_id, id_to_name)[0]
+        if nid is not None and nid in embeddings and nid not in current:
+            current.append(nid)
+    if expand:
+        pool = expand_pool(pool, current, emb_path, embeddings, id_to_name, id_to_type, expand)
+    scorer = PairScorer(embeddings, clf)
+    if emb_path and model_path:
+        compat = CompatMatrix.cached(current + pool, scorer, emb_path, model_path)
+    else:
+        compat = CompatMatrix.build(current + pool, scorer)
+    return compat, current, pool
+
+
+def generate(embeddings, id_to_name, id_to_type, name_to_id, clf, rules, emb_path=None, expand=0, model_path=None,
+             retrieve=0, max_size=12, index=None, extra=False):
+    """
+    Greedy search: add pool ingredients while the set score improves and the recipe still validates.
+    The pool's compatibility matrix is computed once, and reused across runs when both artifact paths are given.
+    With `retrieve`, the candidates come from the whole catalog instead (generate_retrieved).
+    :param extra: Validate and return the recipes with build_recipe(extra=True), as the beam search does.
+    """
+    if retrieve:
+        return generate_retrieved(embeddings, id_to_name, id_to_type, name_to_id, clf, rules, k=retrieve,
+                                  max_size=max_size, index=index)
+    compat, current, pool = candidate_pool(embeddings, id_to_name, id_to_type, name_to_id, clf, emb_path, expand, model_path)
+    matrix = compat.matrix
+    # running sum and count of the current set's pair scores: a candidate only adds its n new pairs
+    members = list(compat.rows(current))
+    total = float(matrix[np.ix_(members, members)].sum()) / 2
+    count = len(members) * (len(members) - 1) // 2
+    best_score = total / count if count else 0.0
+
+    improved = True
+    while improved:
+        improved = False
+        for cand in compat.rows(pool):
+            if cand in members:
+                continue
+            new = float(matrix[cand, members].sum())
+            s = (total + new) / (count + len(members)) if count + len(members) else 0.0
+            if s > best_score:
+                # build a rec for validation
+                trial = [compat.ids[r] for r in members + [cand]]
+                rec = build_recipe(trial, id_to_name, name_to_id, extra=extra)
+                v = validate_record(rec, rules)
+                if not v:
+                    members.append(cand)
+                    total += new
+                    count += len(members) - 1
+                    best_score = s
+                    improved = True
+    current = [compat.ids[r] for r in members]
+
+    # Finalize recipe
+    return build_recipe(current, id_to_name, name_to_id, extra=extra)
+
+
+# node maps and rules of the validation workers, inherited through fork
+_VALIDATION = None
+
+
+def apply_brief(recipe, brief=None):
+    """Targets and dietary flags of a product brief, over the heuristic ones."""
+    if brief:
+        recipe["targets"].update(brief.get("targets", {}))
+        for key in ("dietary_mode", "veg_flag", "jain_flag", "subcategory", "country"):
+            if key in brief:
+                recipe[key] = brief[key]
+    return recipe
+
+
+def validate_sets(sets, brief=None):
+    """Whether the recipe of every node id set passes the constraints."""
+    id_to_name, name_to_id, rules = _VALIDATION
+    return [not validate_record(apply_brief(build_recipe(ids, id_to_name, name_to_id, extra=True), brief), rules) for ids in sets]
+
+
+def beam_search(compat, start, pool, id_to_name, name_to_id, rules, width=8, max_size=8, top=5, workers=None, brief=None):
+    """
+    Beam search over the pool: every level extends each of the `width` best sets by one ingredient.
+    All extensions of a level are scored with one product of the beam's membership matrix with the
+    compatibility matrix, duplicate sets are dropped, and the constraints are checked in worker processes.
+    :param brief: Product brief whose targets and flags apply to the validated records.
+    :return [(score, node ids)] of the `top` best validated sets, best first.
+    """
+    global _VALIDATION
+    _VALIDATION = (id_to_name, name_to_id, rules)
+    matrix = compat.matrix
+    candidates = np.zeros(len(compat.ids), dtype=bool)
+    candidates[compat.rows(pool)] = True
+    start_rows = tuple(sorted(compat.rows(start).tolist()))
+    # beam: member rows -> (sum of pair scores, number of pairs)
+    beam = {start_rows: (float(matrix[np.ix_(start_rows, start_rows)].sum()) / 2, len(start_rows) * (len(start_rows) - 1) // 2)}
+    found = {}
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context("fork")
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context) if workers > 1 else None
+    try:
+        while beam and len(next(iter(beam))) < max_size:
+            states = list(beam)
+            members = np.zeros((len(states), len(compat.ids)), dtype=np.float32)
+            for i, rows in enumerate(states):
+                members[i, list(rows)] = 1.0
+            totals = np.array([beam[rows][0] for rows in states])[:, None] + members @ matrix
+            counts = np.array([beam[rows][1] + len(rows) for rows in states], dtype=np.float64)[:, None]
+            scores = np.where(candidates & (members == 0), totals / np.maximum(counts, 1), -np.inf)
+
+            extensions = {}
+            for i, j in zip(*np.nonzero(np.isfinite(scores))):
+                key = tuple(sorted(states[i] + (int(j),)))
+                if key not in extensions:
+                    extensions[key] = (float(scores[i, j]), float(totals[i, j]), int(counts[i, 0]))
+            if not extensions:
+                break
+            keys = sorted(extensions, key=lambda key: -extensions[key][0])
+            sets = [[compat.ids[r] for r in key] for key in keys]
+            if executor is None:
+                valid = validate_sets(sets, brief)
+            else:
+                chunk = -(-len(sets) // workers)
+                valid = [v for part in executor.map(validate_sets, [sets[i:i + chunk] for i in range(0, len(sets), chunk)], [brief] * workers) for v in part]
+            valid_keys = [key for key, ok in zip(keys, valid) if ok]
+            for key in valid_keys:
+                found[key] = extensions[key][0]
+            beam = {key: extensions[key][1:] for key in valid_keys[:width]}
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    best = sorted(found.items(), key=lambda item: -item[1])[:top]
+    return [(score, [compat.ids[r] for r in key]) for key, score in best]
+
+
+# artifacts shared with the batch workers, inherited through fork
+_BATCH = None
+
+
+def brief_recipes(brief, defaults):
+    """Beam search for one product brief; returns (brief id, JSONL rows) with ids unique across the batch."""
+    embeddings, id_to_name, id_to_type, name_to_id, clf, rules, emb_path, model_path = _BATCH
+    settings = dict(defaults, **{k: brief[k] for k in defaults if k in brief})
+    compat, current, pool = candidate_pool(embeddings, id_to_name, id_to_type, name_to_id, clf, emb_path, settings["expand"],
+                                           model_path, seeds=brief.get("seeds", ()))
+    best = beam_search(compat, current, pool, id_to_name, name_to_id, rules, width=settings["beam"],
+                       max_size=settings["max_size"], top=settings["count"], workers=1, brief=brief)
+    rows = []
+    for rank, (score, ids) in enumerate(best):
+        recipe = apply_brief(build_recipe(ids, id_to_name, name_to_id, extra=True), brief)
+        recipe["id"] = "GEN-{}-{:05d}".format(brief["id"], rank)
+        rows.append({"brief_id": brief["id"], "rank": rank, "score": score, "recipe": recipe})
+    return brief["id"], rows
+
+
+def load_briefs(path):
+    """Briefs from a JSONL file; a brief without an "id" is named after its line number."""
+    briefs = []
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                brief = json.loads(line)
+                brief["id"] = str(brief.get("id", line_no))
+                briefs.append(brief)
+    ids = [b["id"] for b in briefs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Duplicate brief ids in {}".format(path))
+    return briefs
+
+
+def completed_briefs(out):
+    """
+    Brief ids finished by an earlier run of the batch. A brief is finished once its id is in <out>.done,
+    which is appended after its recipes; recipes of unfinished briefs are dropped from <out>.
+    """
+    if not os.path.exists(out + ".done"):
+        return set()
+    with open(out + ".done") as f:
+        done = set(line.strip() for line in f if line.strip())
+    kept = []
+    if os.path.exists(out):
+        with open(out) as f:
+            for line in f:
+                try:
+                    if json.loads(line)["brief_id"] in done:
+                        kept.append(line)
+                except (ValueError, KeyError):
+                    # a line cut short by the interruption
+                    continue
+    tmp = "{}.tmp-{}".format(out, os.getpid())
+    with open(tmp, "w") as f:
+        f.writelines(kept)
+    os.replace(tmp, out)
+    return done
+
+
+def generate_batch(briefs, out, defaults, jobs=None, resume=False):
+    """Generate the recipes of every brief in worker processes, appending them to `out` as each brief finishes."""
+    done = completed_briefs(out) if resume else set()
+    if not resume:
+        for path in (out, out + ".done"):
+            if os.path.exists(path):
+                os.remove(path)
+    pending = [b for b in briefs if b["id"] not in done]
+    print("{} briefs, {} already done".format(len(briefs), len(briefs) - len(pending)), file=sys.stderr)
+
+    start = time.time()
+    written = 0
+    context = multiprocessing.get_context("fork")
+    with open(out, "a") as f, open(out + ".done", "a") as done_file, \
+            ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), mp_context=context) as pool:
+        futures = [pool.submit(brief_recipes, brief, defaults) for brief in pending]
+        for i, future in enumerate(as_completed(futures), 1):
+            brief_id, rows = future.result()
+            f.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            f.flush()
+            done_file.write(brief_id + "\n")
+            done_file.flush()
+            written += len(rows)
+            print("[{}/{}] brief {}: {} recipes ({:.1f} recipes/s)".format(
+                i, len(pending), brief_id, len(rows), written / max(time.time() - start, 1e-9)), file=sys.stderr)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", default="input/nodes_191120.csv")
+    parser.add_argument("--emb", default=None, help="registry id/tag or artifact path (default: latest)")
+    parser.add_argument("--model", default="models/compat_beverage_IN.pkl")
+    parser.add_argument("--constraints", default="config/constraints/fssai_carbonated_beverage_constraints.json")
+    parser.add_argument("--expand", default=0, type=int, help="also consider the k nearest ingredients of every starting ingredient")
+    parser.add_argument("--retrieve", default=0, type=int, help="search the whole catalog: rank the k ingredients closest to the recipe at every step")
+    parser.add_argument("--max_size", default=12, type=int, help="most ingredients in a recipe with --retrieve or --beam")
+    parser.add_argument("--beam", default=0, type=int, help="beam search of this width over the pool instead of greedy (0: greedy)")
+    parser.add_argument("--top", default=5, type=int, help="validated recipes returned by --beam, as a JSON list of {score, recipe}")
+    parser.add_argument("--compare", action="store_true", help="with --beam, also time the greedy search and print both rates to stderr")
+    parser.add_argument("--workers", default=None, type=int, help="constraint-check processes for --beam (default: all cores)")
+    parser.add_argument("--briefs", default=None, help="JSONL of product briefs: beam search every brief, recipes go to --out")
+    parser.add_argument("--out", default="output/recipes.jsonl", help="JSONL output of --briefs")
+    parser.add_argument("--jobs", default=None, type=int, help="briefs generated in parallel (default: all cores)")
+    parser.add_argument("--resume", action="store_true", help="skip the briefs already finished in --out")
+    args = parser.parse_args()
+
+    # --emb: registry id or tag, or a path to an artifact
+    emb_path = Registry("output").resolve(args.emb or "latest")
+    embeddings = load_embeddings(emb_path)
+    id_to_name, id_to_type, name_to_id = load_nodes(args.nodes)
+    # joblib (and sklearn, through the pickled model) only load once the arguments are parsed
+    import joblib
+    clf = joblib.load(args.model)["model"]
+    rules = load_constraints(args.constraints)
+
+    if args.briefs:
+        global _BATCH
+        # built before the workers fork, so they share it
+        name_resolver(id_to_name)
+        _BATCH = (embeddings, id_to_name, id_to_type, name_to_id, clf, rules, emb_path, args.model)
+        defaults = {"beam": args.beam or 8, "max_size": args.max_size, "count": args.top, "expand": args.expand}
+        generate_batch(load_briefs(args.briefs), args.out, defaults, jobs=args.jobs, resume=args.resume)
+        return
+
+    if not args.beam:
+        recipe = generate(embeddings, id_to_name, id_to_type, name_to_id, clf, rules, emb_path=emb_path, expand=args.expand,
+                          model_path=args.model, retrieve=args.retrieve, max_size=args.max_size)
+        print(json.dumps(recipe, ensure_ascii=False, indent=2))
+        return
+
+    start = time.time()
+    compat, current, pool = candidate_pool(embeddings, id_to_name, id_to_type, name_to_id, clf, emb_path, args.expand, args.model)
+    best = beam_search(compat, current, pool, id_to_name, name_to_id, rules, width=args.beam, max_size=args.max_size,
+                       top=args.top, workers=args.workers)
+    beam_s = time.time() - start
+    print(json.dumps([{"score": score, "recipe": build_recipe(ids, id_to_name, name_to_id, extra=True)} for score, ids in best],
+                     ensure_ascii=False, indent=2))
+    if not args.compare:
+        return
+    # the greedy baseline over the same pool, validating the same recipe records as the beam search
+    start = time.time()
+    generate(embeddings, id_to_name, id_to_type, name_to_id, clf, rules, emb_path=emb_path, expand=args.expand,
+             model_path=args.model, extra=True)
+    greedy_s = time.time() - start
+    # stderr, so stdout stays valid JSON
+    print("greedy: 1 recipe in {:.3f}s ({:.1f} recipes/s); beam (width {}): {} recipes in {:.3f}s ({:.1f} recipes/s)".format(
+        greedy_s, 1 / max(greedy_s, 1e-9), args.beam, len(best), beam_s, len(best) / max(beam_s, 1e-9)), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from registry import Registry
+from similarity import SimilarityIndex
+from validate_beverage import load_constraints, validate_record
+from generate_recipe import load_embeddings, load_nodes, generate, name_resolver
+
+"""
+Long-lived pairing / recipe service (stdlib asyncio HTTP, JSON in and out).
+The nodes csv, the embedding artifact, the compatibility model and the constraints are loaded once
+into an immutable snapshot. Pair scores requested concurrently are queued and scored together: the
+batcher waits at most --max_wait_ms for up to --max_batch pairs and makes one predict_proba call on
+their feature matrix. A background task polls the registry (and the file mtimes) and swaps in a new
+snapshot once it is fully loaded, so requests never see a half-reloaded state.
+
+    POST /suggest_flavors   {"ingredients": ["lemon", "ginger"], "k": 10}
+    POST /score_pairs       {"pairs": [["lemon", "ginger"], ["231", "4087"]]}
+    POST /generate_recipe   {"expand": 0} or {"retrieve": 50, "max_size": 12}
+    POST /validate_recipe   {"recipe": {...}}
+    POST /reload
+    GET  /health, /metrics (Prometheus text), /metrics.json
+
+    python3 tools/pairing_service.py --port 8080 --emb latest --model latest-compat_model
+"""
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+class Histogram(object):
+    """Cumulative-bucket histogram in the Prometheus layout."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bucket bound below which a fraction q of the observations fall."""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, n in zip(list(self.buckets) + [float("inf")], self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return bound
+        return float("inf")
+
+    def prometheus(self, name, labels=""):
+        lines, seen = [], 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            seen += n
+            lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, labels + "," if labels else "", bound, seen))
+        braces = "{" + labels + "}" if labels else ""
+        lines.append("{}_sum{} {}".format(name, braces, self.sum))
+        lines.append("{}_count{} {}".format(name, braces, self.count))
+        return lines
+
+    def summary(self):
+        return {"count": self.count, "mean": self.sum / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class Artifacts(object):
+    """Everything a request needs, loaded together; replaced as a whole on reload, never modified."""
+    def __init__(self, emb_path, nodes, model_path, constraints, version):
+        self.emb_path = emb_path
+        self.model_path = model_path
+        self.embeddings = load_embeddings(emb_path)
+        self.id_to_name, self.id_to_type, self.name_to_id = load_nodes(nodes)
+        self.resolver = name_resolver(self.id_to_name)
+        attributes = {nid: (self.id_to_name.get(nid), self.id_to_type.get(nid), None) for nid in self.embeddings.ids}
+        # normalized once: a pair feature is |x_a - x_b| of unit vectors, as in training
+        self.index = SimilarityIndex(self.embeddings, attributes)
+        import joblib
+        self.clf = joblib.load(model_path)["model"]
+        self.rules = load_constraints(constraints)
+        self.version = version
+        self.loaded = time.time()
+
+    def node_id(self, ref):
+        """Node id for a node id or an ingredient name; None if unknown."""
+        ref = str(ref)
+        if ref in self.index:
+            return ref
+        nid = self.resolver.resolve(ref)[0]
+        return nid if nid in self.index else None
+
+    def score_rows(self, a, b):
+        features = np.abs(self.index.matrix[a] - self.index.matrix[b])
+        return self.clf.predict_proba(features)[:, 1]
+
+
+class MicroBatcher(object):
+    """
+    Collects the pairs of concurrent requests and scores them with one classifier call per batch.
+    :param max_batch: Pairs scored together at most.
+    :param max_wait_ms: How long the first queued pair waits for others.
+    """
+    def __init__(self, service, executor, max_batch=1024, max_wait_ms=2.0):
+        self.service = service
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+
+    async def score(self, pairs):
+        """Compatibility of every (node id, node id) pair; None where a node is unknown."""
+        if not pairs:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((pairs, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            size = len(jobs[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                jobs.append(job)
+                size += len(job[0])
+            self.batch_sizes.observe(size)
+            try:
+                results = await loop.run_in_executor(self.executor, self.score_jobs, self.service.artifacts, jobs)
+                for (_, future), result in zip(jobs, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in jobs:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @staticmethod
+    def score_jobs(artifacts, jobs):
+        # one snapshot for the whole batch, so a reload in between cannot mix two models
+        a, b, slots = [], [], []
+        for pairs in (pairs for pairs, _ in jobs):
+            job_slots = []
+            for x, y in pairs:
+                if x in artifacts.index and y in artifacts.index:
+                    job_slots.append(len(a))
+                    a.append(artifacts.index.row[x])
+                    b.append(artifacts.index.row[y])
+                else:
+                    job_slots.append(None)
+            slots.append(job_slots)
+        scores = artifacts.score_rows(np.array(a, dtype=np.int64), np.array(b, dtype=np.int64)) if a else []
+        return [[None if s is None else float(scores[s]) for s in job_slots] for job_slots in slots]
+
+
+class PairingService(object):
+    def __init__(self, args):
+        self.args = args
+        self.registry = Registry(args.output_path)
+        self.executor = ThreadPoolExecutor(max_workers=args.threads)
+        self.artifacts = None
+        self.batcher = MicroBatcher(self, self.executor, args.max_batch, args.max_wait_ms)
+        self.latency = {}
+        self.errors = {}
+        self.reload_lock = asyncio.Lock()
+        self.routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+            ("GET", "/metrics.json"): self.metrics_json,
+            ("POST", "/suggest_flavors"): self.suggest_flavors,
+            ("POST", "/score_pairs"): self.score_pairs,
+            ("POST", "/generate_recipe"): self.generate_recipe,
+            ("POST", "/validate_recipe"): self.validate_recipe,
+            ("POST", "/reload"): self.reload,
+        }
+
+    # artifacts
+
+    def sources(self):
+        """(embedding path, model path, version) from the registry refs; the version changes with any input."""
+        emb_path = self.registry.resolve(self.args.emb)
+        model_path = self.args.model
+        if not os.path.exists(model_path):
+            model_path = self.registry.resolve(self.args.model, kind="compat_model", name="model")
+        files = [emb_path, model_path, self.args.nodes, self.args.constraints]
+        version = tuple((f, os.stat(f).st_mtime_ns) for f in files)
+        return emb_path, model_path, version
+
+    async def reload(self, body=None):
+        async with self.reload_lock:
+            loop = asyncio.get_running_loop()
+            emb_path, model_path, version = await loop.run_in_executor(self.executor, self.sources)
+            if self.artifacts is not None and self.artifacts.version == version and not (body or {}).get("force"):
+                return {"reloaded": False, "version": self.describe()}
+            start = time.time()
+            artifacts = await loop.run_in_executor(self.executor, Artifacts, emb_path, self.args.nodes, model_path,
+                                                   self.args.constraints, version)
+            self.artifacts = artifacts
+            print("Loaded {} and {} in {:.1f}s".format(emb_path, model_path, time.time() - start))
+            return {"reloaded": True, "version": self.describe()}
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.args.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                # keep serving the current snapshot
+                print("Reload failed:", e)
+
+    def describe(self):
+        return {"embedding": self.artifacts.emb_path, "files": [f for f, _ in self.artifacts.version],
+                "loaded": self.artifacts.loaded}
+
+    # endpoints
+
+    async def health(self, body):
+        return {"status": "ok", "artifacts": self.describe(), "nodes": len(self.artifacts.index.ids)}
+
+    async def suggest_flavors(self, body):
+        """Nearest ingredients to the sum of the given ones, with their mean compatibility with them."""
+        artifacts = self.artifacts
+        known = [artifacts.node_id(i) for i in body.get("ingredients", [])]
+        unknown = [i for i, nid in zip(body.get("ingredients", []), known) if nid is None]
+        known = [nid for nid in known if nid is not None]
+        if not known:
+            raise ValueError("None of the ingredients is known: {}".format(unknown))
+        k = int(body.get("k", 10))
+        found = artifacts.index.combine(known, k=k, types=body.get("types", ["ingredient"]), exclude=body.get("exclude", ()))
+        scores = await self.batcher.score([(nid, q) for nid, _, _ in found for q in known])
+        compat = np.array(scores, dtype=np.float64).reshape(len(found), len(known)).mean(axis=1) if found else []
+        return {"unknown": unknown, "suggestions": [
+            {"node_id": nid, "name": name, "similarity": sim, "compatibility": float(c)}
+            for (nid, name, sim), c in zip(found, compat)]}
+
+    async def score_pairs(self, body):
+        artifacts = self.artifacts
+        pairs = [(artifacts.node_id(a), artifacts.node_id(b)) for a, b in body.get("pairs", [])]
+        scores = await self.batcher.score(pairs)
+        return {"scores": scores}
+
+    async def generate_recipe(self, body):
+        artifacts = self.artifacts
+        recipe = await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: generate(artifacts.embeddings, artifacts.id_to_name, artifacts.id_to_type,
+                                            artifacts.name_to_id, artifacts.clf, artifacts.rules,
+                                            emb_path=artifacts.emb_path, expand=int(body.get("expand", 0)),
+                                            model_path=artifacts.model_path, retrieve=int(body.get("retrieve", 0)),
+                                            max_size=int(body.get("max_size", 12)), index=artifacts.index))
+        violations = validate_record(recipe, artifacts.rules)
+        return {"recipe": recipe, "violations": violations}
+
+    async def validate_recipe(self, body):
+        violations = validate_record(body.get("recipe", body), self.artifacts.rules)
+        return {"valid": not violations, "violations": violations}
+
+    async def metrics_json(self, body):
+        return {"latency_ms": {route: h.summary() for route, h in self.latency.items()},
+                "errors": self.errors, "batch_size": self.batcher.batch_sizes.summary()}
+
+    async def metrics(self, body):
+        lines = ["# TYPE request_latency_ms histogram"]
+        for route, h in sorted(self.latency.items()):
+            lines += h.prometheus("request_latency_ms", 'route="{}"'.format(route))
+        lines.append("# TYPE request_errors_total counter")
+        lines += ['request_errors_total{{route="{}"}} {}'.format(route, n) for route, n in sorted(self.errors.items())]
+        lines.append("# TYPE score_batch_size histogram")
+        lines += self.batcher.batch_sizes.prometheus("score_batch_size")
+        return "\n".join(lines) + "\n"
+
+    # HTTP
+
+    async def dispatch(self, method, path, body):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            return 404, {"error": "no route {} {}".format(method, path)}
+        start = time.perf_counter()
+        try:
+            status, result = 200, await handler(json.loads(body) if body else {})
+        except (ValueError, KeyError, TypeError) as e:
+            status, result = 400, {"error": str(e)}
+        except Exception as e:
+            status, result = 500, {"error": repr(e)}
+        if status != 200:
+            self.errors[path] = self.errors.get(path, 0) + 1
+        self.latency.setdefault(path, Histogram(LATENCY_BUCKETS_MS)).observe(1000.0 * (time.perf_counter() - start))
+        return status, result
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, result = await self.dispatch(method, target.split("?")[0], body)
+                text = isinstance(result, str)
+                payload = (result if text else json.dumps(result, ensure_ascii=False)).encode("utf-8")
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                    status, {200: "OK", 400: "Bad Request", 404: "Not Found"}.get(status, "Internal Server Error"),
+                    "text/plain; version=0.0.4" if text else "application/json", len(payload),
+                    "keep-alive" if keep_alive else "close").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        await self.reload()
+        tasks = [asyncio.ensure_future(self.batcher.run())]
+        if self.args.reload_interval > 0:
+            tasks.append(asyncio.ensure_future(self.watch()))
+        server = await asyncio.start_server(self.handle, self.args.host, self.args.port)
+        print("Serving on http://{}:{}".format(self.args.host, self.args.port))
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pairing and recipe service over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default=8080, type=int)
+    parser.add_argument("--output_path", default="output", help="registry root")
+    parser.add_argument("--nodes", default="input/nodes_191120.csv")
+    parser.add_argument("--emb", default="latest", help="registry id/tag or artifact path")
+    parser.add_argument("--model", default="latest-compat_model", help="registry id/tag or model path")
+    parser.add_argument("--constraints", default="config/constraints/fssai_carbonated_beverage_constraints.json")
+    parser.add_argument("--max_batch", default=1024, type=int, help="pairs scored in one classifier call at most")
+    parser.add_argument("--max_wait_ms", default=2.0, type=float, help="time a pair waits for others to batch with")
+    parser.add_argument("--threads", default=4, type=int, help="threads for scoring, generation and reloads")
+    parser.add_argument("--reload_interval", default=30.0, type=float, help="seconds between registry checks (0: only POST /reload)")
+    args = parser.parse_args()
+    asyncio.run(PairingService(args).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import json
 import os
 import pickle
 import random
+import sys
 from pathlib import Path
 
 import joblib
@@ -12,23 +13,14 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split
 
-
-def find_latest_embedding(output_dir: str) -> str:
-    cand = []
-    for fn in os.listdir(output_dir):
-        if fn.startswith("FlavorGraph+CSL-embedding_") and fn.endswith(".pickle"):
-            cand.append((os.path.getmtime(os.path.join(output_dir, fn)), fn))
-    if not cand:
-        raise FileNotFoundError("No embedding file found in output/")
-    cand.sort(reverse=True)
-    return os.path.join(output_dir, cand[0][1])
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from embedding_store import load_embedding
+from registry import Registry, file_hash
 
 
 def load_embeddings(path: str):
-    with open(path, "rb") as f:
-        emb = pickle.load(f)
-    # keys are node_id strings; values are numpy arrays
-    return emb
+    # dict-like EmbeddingTable over a memory-mapped matrix; keys are node_id strings
+    return load_embedding(path)
 
 
 def load_nodes(nodes_csv: str):
@@ -100,11 +92,12 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--seed", default="data/beverage_seed_carbonated_IN.jsonl")
     parser.add_argument("--nodes", default="input/nodes_191120.csv")
-    parser.add_argument("--emb", default=None)
+    parser.add_argument("--emb", default=None, help="registry id/tag or artifact path (default: latest)")
     parser.add_argument("--out", default="models/compat_beverage_IN.pkl")
     args = parser.parse_args()
 
-    emb_path = args.emb or find_latest_embedding("output")
+    # --emb: registry id or tag, or a path to an artifact
+    emb_path = Registry("output").resolve(args.emb or "latest")
     os.makedirs(Path(args.out).parent, exist_ok=True)
 
     embeddings = load_embeddings(emb_path)
@@ -129,6 +122,8 @@ def main():
         "num_test": int(len(X_test))
     }
     joblib.dump({"model": clf, "meta": meta}, args.out)
+    Registry("output").publish({"emb": emb_path, "seed_data": args.seed, "feature": meta["feature"]}, {"model": args.out},
+                               kind="compat_model", corpus_hash=file_hash(args.seed), metrics={"auc": auc})
     print(f"Saved compatibility model → {args.out} | AUC={auc:.3f}")
 
 